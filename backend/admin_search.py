@@ -0,0 +1,106 @@
+# backend/admin_search.py
+
+# Deben coincidir con los índices de migrations/005_busqueda_admin.sql
+USER_TSVECTOR = (
+    "to_tsvector('simple', coalesce(u.nombre_completo, '') || ' ' || coalesce(u.email, '')"
+    " || ' ' || coalesce(u.ong, ''))"
+)
+ANALYSIS_TSVECTOR = "to_tsvector('spanish', coalesce(a.resultado_prediccion, ''))"
+
+# Coincidencia por texto completo, por subcadena (ILIKE) o aproximada
+# (word_similarity, tolera errores de escritura). Todas usan índices GIN.
+# En el email solo se busca por subcadena: los dominios compartidos harían
+# que la búsqueda aproximada coincidiera con casi todos los usuarios.
+_USER_MATCH = f"""(
+    {USER_TSVECTOR} @@ plainto_tsquery('simple', %(q)s)
+    OR u.nombre_completo ILIKE %(patron)s OR u.email ILIKE %(patron)s OR u.ong ILIKE %(patron)s
+    OR %(q)s <%% u.nombre_completo OR %(q)s <%% u.ong
+)"""
+
+_USER_SCORE = f"""(
+    ts_rank({USER_TSVECTOR}, plainto_tsquery('simple', %(q)s))
+    + GREATEST(
+        word_similarity(%(q)s, coalesce(u.nombre_completo, '')),
+        word_similarity(%(q)s, coalesce(u.email, '')),
+        word_similarity(%(q)s, coalesce(u.ong, ''))
+    )
+)"""
+
+_ANALYSIS_MATCH = f"""(
+    {ANALYSIS_TSVECTOR} @@ plainto_tsquery('spanish', %(q)s)
+    OR a.resultado_prediccion ILIKE %(patron)s
+    OR %(q)s <%% a.resultado_prediccion
+)"""
+
+_ANALYSIS_SCORE = f"""(
+    ts_rank({ANALYSIS_TSVECTOR}, plainto_tsquery('spanish', %(q)s))
+    + word_similarity(%(q)s, coalesce(a.resultado_prediccion, ''))
+)"""
+
+USERS_QUERY = f"""
+    SELECT u.id_usuario, u.nombre_completo, u.email, u.ong, u.profile_image_url, u.es_admin,
+           {_USER_SCORE} AS puntuacion,
+           COUNT(*) OVER () AS total
+    FROM usuarios u
+    WHERE {_USER_MATCH}
+    ORDER BY puntuacion DESC, u.id_usuario
+    LIMIT %(limite)s OFFSET %(desplazamiento)s
+"""
+
+# Un análisis coincide por su predicción o por el usuario que lo hizo. Cada
+# rama del UNION usa sus propios índices; después se queda la mejor
+# puntuación de cada análisis. Solo se consideran los `max_usuarios`
+# usuarios más parecidos: un término muy común (un apellido, una ONG) no
+# obliga así a recorrer los análisis de miles de usuarios.
+ANALYSES_QUERY = f"""
+    WITH usuarios_coincidentes AS (
+        SELECT u.id_usuario, {_USER_SCORE} AS puntuacion
+        FROM usuarios u
+        WHERE (%(id_usuario)s::int IS NULL OR u.id_usuario = %(id_usuario)s)
+          AND {_USER_MATCH}
+        ORDER BY puntuacion DESC
+        LIMIT %(max_usuarios)s
+    ),
+    coincidencias AS (
+        SELECT a.id_analisis, {_ANALYSIS_SCORE} AS puntuacion
+        FROM analisis a
+        WHERE a.fecha_eliminado IS NULL
+          AND (%(id_usuario)s::int IS NULL OR a.id_usuario = %(id_usuario)s)
+          AND {_ANALYSIS_MATCH}
+        UNION ALL
+        SELECT a.id_analisis, uc.puntuacion
+        FROM usuarios_coincidentes uc
+        JOIN analisis a ON a.id_usuario = uc.id_usuario
+        WHERE a.fecha_eliminado IS NULL
+    ),
+    ranking AS (
+        SELECT id_analisis, MAX(puntuacion) AS puntuacion
+        FROM coincidencias
+        GROUP BY id_analisis
+    )
+    SELECT a.*, u.email, u.nombre_completo, r.puntuacion,
+           COUNT(*) OVER () AS total
+    FROM ranking r
+    JOIN analisis a ON a.id_analisis = r.id_analisis
+    JOIN usuarios u ON u.id_usuario = a.id_usuario
+    ORDER BY r.puntuacion DESC, a.fecha_analisis DESC, a.id_analisis
+    LIMIT %(limite)s OFFSET %(desplazamiento)s
+"""
+
+SEARCH_QUERIES = {
+    "usuarios": USERS_QUERY,
+    "analisis": ANALYSES_QUERY,
+}
+
+
+def search_params(text, page, page_size, id_usuario=None, max_users=500):
+    """Parámetros comunes de las consultas de búsqueda."""
+    escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return {
+        "q": text,
+        "patron": f"%{escaped}%",
+        "limite": page_size,
+        "desplazamiento": (page - 1) * page_size,
+        "id_usuario": id_usuario,
+        "max_usuarios": max_users,
+    }
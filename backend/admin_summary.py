@@ -0,0 +1,105 @@
+# backend/admin_summary.py
+
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+import metrics
+
+log = logging.getLogger(__name__)
+
+
+def build_summary(row):
+    """Da forma de respuesta a la fila de repository.admin_summary()."""
+    return {
+        "usuarios": {
+            "total": row["usuarios"],
+            "administradores": row["administradores"],
+            "activos_7_dias": row["usuarios_semana"],
+        },
+        "analisis": {
+            "activos": int(row["activos"]),
+            "en_papelera": int(row["en_papelera"]),
+            "por_clase": row["por_clase"],
+        },
+        "actividad": {
+            "ultimas_24h": row["ultimo_dia"],
+            "ultimos_7_dias": row["ultima_semana"],
+            "ultimos_30_dias": row["ultimo_mes"],
+            "ultimo_analisis": row["ultimo_analisis"].isoformat() if row["ultimo_analisis"] else None,
+        },
+        "almacenamiento": {
+            "imagenes_analisis": row["imagenes"],
+            "imagenes_perfil": row["imagenes_perfil"],
+            "total": row["imagenes"] + row["imagenes_perfil"],
+        },
+    }
+
+
+class SummaryCache:
+    """
+    Resumen del panel en memoria (por worker) durante `ttl_seconds`. Al
+    caducar se sigue sirviendo el anterior mientras `submit` (io_executor)
+    lo recalcula en segundo plano, así que solo la primera petición del
+    worker espera a la consulta.
+    """
+
+    def __init__(self, loader, ttl_seconds, submit):
+        self._loader = loader
+        self._ttl_seconds = ttl_seconds
+        self._submit = submit
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._summary = None
+        self._loaded_at = 0.0
+        self._refreshing = False
+
+    def _load(self):
+        start = time.perf_counter()
+        summary = self._loader()
+        summary["generado"] = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        metrics.observe("admin_summary.load", time.perf_counter() - start)
+        with self._lock:
+            self._summary = summary
+            self._loaded_at = time.monotonic()
+        return summary
+
+    def _refresh(self):
+        try:
+            self._load()
+        except Exception as e:
+            log.warning("No se pudo recalcular el resumen de administración: %s", e)
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def get(self):
+        """Devuelve (resumen, edad en segundos)."""
+        with self._lock:
+            summary, age = self._summary, time.monotonic() - self._loaded_at
+            stale = summary is not None and age >= self._ttl_seconds
+            start_refresh = stale and not self._refreshing
+            if start_refresh:
+                self._refreshing = True
+
+        if summary is None:
+            # Las peticiones que llegan a la vez esperan a una sola consulta
+            with self._load_lock:
+                with self._lock:
+                    summary = self._summary
+                if summary is None:
+                    metrics.increment("admin_summary.loads")
+                    return self._load(), 0.0
+            metrics.increment("admin_summary.hits")
+            return summary, 0.0
+
+        if start_refresh:
+            metrics.increment("admin_summary.refreshes")
+            try:
+                self._submit(self._refresh)
+            except Exception:
+                with self._lock:
+                    self._refreshing = False
+                raise
+        metrics.increment("admin_summary.stale" if stale else "admin_summary.hits")
+        return summary, age
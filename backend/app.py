@@ -1,32 +1,51 @@
 # backend/app.py
 
 from flask import Flask, request, jsonify
+import logging
 from flask_cors import CORS
 import psycopg2
-import psycopg2.extras
 from psycopg2.extras import RealDictCursor
 import bcrypt
 import jwt
 from datetime import datetime, timedelta
-from functools import wraps
+from functools import partial, wraps
 from config import Config
-from roboflow import Roboflow
 import os
-import requests
-from urllib.parse import unquote
-import firebase_admin
-from firebase_admin import credentials, storage
-from PIL import Image 
+import io
+import base64
 import time
 import re 
-
-try:
-    cred = credentials.Certificate("serviceAccountKey.json")
-    firebase_admin.initialize_app(cred, {
-        'storageBucket': 'identificador-plagas-v2.firebasestorage.app'
-    })
-except Exception as e:
-    print(f"Error inicializando Firebase Admin: {e}")
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from storage_utils import io_executor, storage_breaker, delete_image, delete_images, upload_image, download_image
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from image_variants import analysis_image_urls, store_analysis_variants
+from image_hash import DuplicateIndex, content_hash, lookup_image, register_images, index_analysis, unreferenced_urls
+import metrics
+from response_encoding import encode_response
+from rate_limit import inflight_limiter, rate_limited, admission_controlled
+from dose_table import DoseTable, calculate_plan
+from startup import preload_heavy_modules
+from admin_search import SEARCH_QUERIES, search_params
+from admin_summary import SummaryCache, build_summary
+from decision_policy import resolve as resolve_decision, displayed_prediction
+from detections import pack_detections, unpack_detections
+from batching import MicroBatcher
+from shadow import ShadowEvaluator
+import repository
+from repository import db_route, reading, transaction
+import profiling
+import structured_logging
+
+# Antes que nada, para que los mensajes de la precarga ya salgan en JSON
+structured_logging.setup_logging()
+log = logging.getLogger(__name__)
+
+# Firebase Admin, PIL, numpy y requests se cargan la primera vez que se usan.
+# Con PRELOAD_HEAVY_MODULES=true se cargan ya al importar la app, pensado
+# para el proceso maestro de gunicorn con preload_app: los workers los
+# heredan al hacer fork en lugar de cargarlos cada uno.
+if Config.PRELOAD_HEAVY_MODULES:
+    preload_heavy_modules()
 
 origins = [
     re.compile(r"http://localhost:.*"), # PERMITE CUALQUIER PUERTO EN LOCALHOST
@@ -42,13 +61,77 @@ CORS(
     supports_credentials=True,
     allow_headers=["Authorization", "Content-Type", "x-access-token"]
 )
+# Compresión y formatos compactos (MessagePack / por columnas) de las respuestas JSON
+app.after_request(encode_response)
+# Identificador de petición (cabecera X-Request-ID) en cada mensaje del registro
+structured_logging.init_app(app)
+
+# Perfilado bajo demanda (rutas /admin/profile/*): con la tasa a 0, que es
+# el valor por defecto, cada petición solo paga una comparación
+request_profiler = profiling.RequestProfiler(Config.PROFILE_REQUEST_RATE, keep=Config.PROFILE_KEEP)
+memory_tracer = profiling.MemoryTracer()
+
+
+@app.before_request
+def _start_request_profile():
+    if request_profiler.rate:
+        request_profiler.start(request.endpoint)
+
+
+@app.teardown_request
+def _stop_request_profile(exc):
+    request_profiler.stop(structured_logging.current_request_id())
+
 
 def get_db_connection():
-    conn = psycopg2.connect(app.config['DATABASE_URI'])
-    return conn
+    """Conexión del pool al primario para los módulos auxiliares; close() la devuelve."""
+    return repository.connect()
+
+# Tope de inferencias en curso por worker (y, con INFLIGHT_BACKEND=postgres,
+# entre todos los workers): por encima se rechaza con 429
+inference_limiter = inflight_limiter(get_db_connection)
+
+# Si Roboflow falla o se vuelve muy lento, /analyze responde "reintentar más
+# tarde" al instante en lugar de ocupar el worker esperando.
+inference_breaker = CircuitBreaker(
+    "inference",
+    window_seconds=Config.BREAKER_WINDOW_SECONDS,
+    min_calls=Config.BREAKER_MIN_CALLS,
+    failure_ratio=Config.BREAKER_FAILURE_RATIO,
+    slow_call_seconds=Config.INFERENCE_SLOW_SECONDS,
+    slow_call_ratio=Config.BREAKER_SLOW_CALL_RATIO,
+    open_seconds=Config.BREAKER_OPEN_SECONDS,
+)
+
+# Índice en memoria de hashes perceptuales para marcar análisis duplicados
+duplicate_index = DuplicateIndex(get_db_connection, Config.DUPLICATE_INDEX_REFRESH)
+
+# Parámetros de dosis de los tratamientos en memoria, comprobados contra la
+# versión de la base de datos cada DOSE_TABLE_CHECK_SECONDS
+dose_table = DoseTable(get_db_connection, Config.DOSE_TABLE_CHECK_SECONDS)
+
+
+def _load_admin_summary():
+    with reading() as cur:
+        return build_summary(repository.admin_summary(cur))
+
+
+# Totales del panel de administración; al caducar se recalculan en segundo plano
+admin_summary_cache = SummaryCache(_load_admin_summary, Config.ADMIN_SUMMARY_TTL, io_executor.submit)
+
+
+def _service_unavailable(retry_after):
+    response = jsonify({
+        "error": "El servicio de análisis no está disponible en este momento. Inténtalo de nuevo más tarde.",
+        "reintentar": True
+    })
+    response.status_code = 503
+    response.headers["Retry-After"] = str(max(1, int(retry_after + 0.999)))
+    return response
 
 
 @app.route('/register', methods=['POST'])
+@db_route("escritura", 1)
 def register():
     data = request.get_json()
     nombre_completo = data.get('nombre_completo')
@@ -63,15 +146,10 @@ def register():
     hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
 
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute(
-            "INSERT INTO usuarios (nombre_completo, email, password_hash, ong, profile_image_url) VALUES (%s, %s, %s, %s, %s)",
-            (nombre_completo, email, hashed_password.decode('utf-8'), ong, profile_image_url)
-        )
-        conn.commit()
-        cur.close()
-        conn.close()
+        with transaction() as cur:
+            repository.create_user(
+                cur, nombre_completo, email, hashed_password.decode('utf-8'), ong, profile_image_url
+            )
         return jsonify({"message": "Usuario registrado exitosamente"}), 201
     except psycopg2.IntegrityError:
         return jsonify({"error": "El correo electrónico ya está registrado"}), 409
@@ -79,6 +157,7 @@ def register():
         return jsonify({"error": str(e)}), 500
 
 @app.route('/login', methods=['POST'])
+@db_route("lectura", 1)
 def login():
     data = request.get_json()
     email = data.get('email')
@@ -88,12 +167,9 @@ def login():
         return jsonify({"error": "Email y contraseña son requeridos"}), 400
 
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cur.execute("SELECT id_usuario, password_hash, es_admin, nombre_completo FROM usuarios WHERE LOWER(email) = LOWER(%s)", (email,))
-        user = cur.fetchone()
-        cur.close()
-        conn.close()
+        # En el primario: una cuenta recién registrada aún podría no estar en las réplicas
+        with transaction() as cur:
+            user = repository.user_credentials(cur, email)
 
         if not user:
             return jsonify({"error": "Credenciales inválidas"}), 401
@@ -158,104 +234,472 @@ def admin_required(f):
         return f(current_user_id, *args, **kwargs)
     return decorated    
     
-def _run_prediction(image_url):
-    temp_image_path = "temp_image.jpg"
-    try:
-        start_download = time.time()
-        response = requests.get(image_url, stream=True)
+def _encode_for_inference(image_bytes):
+    """JPEG en base64, lo que esperan tanto el modelo alojado como el servidor de inferencia."""
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+    buffered = io.BytesIO()
+    image.save(buffered, quality=90, format="JPEG")
+    return base64.b64encode(buffered.getvalue()).decode("ascii")
+
+
+def _post_inference(encoded_image, model_id):
+    """
+    Envía la imagen al modelo alojado `model_id` de Roboflow usando la sesión
+    HTTP compartida, de modo que la conexión TLS se reutiliza entre
+    peticiones. Replica lo que hace el SDK de Roboflow (JPEG en base64 por
+    POST) sin crear un cliente ni consultar el proyecto en cada llamada.
+    """
+    from http_session import get_session
+
+    response = get_session().post(
+        f"{app.config['ROBOFLOW_API_URL']}/{model_id}",
+        params={
+            "api_key": app.config['ROBOFLOW_API_KEY'],
+            "confidence": 40,
+            "overlap": 30,
+            "format": "json",
+        },
+        data=encoded_image,
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
+    )
+    # Solo los 5xx y los timeouts cuentan como fallos del servicio
+    if response.status_code >= 500:
         response.raise_for_status()
-        with open(temp_image_path, 'wb') as f:
-            f.write(response.content)
-        end_download = time.time()
-        print(f"✅ Tiempo de descarga de imagen: {end_download - start_download:.2f} segundos")
+    return response
 
 
-        start_prediction = time.time()
-        rf = Roboflow(api_key=app.config['ROBOFLOW_API_KEY'])
-        project_id, version_id = app.config['ROBOFLOW_MODEL_ID'].split('/')
-        project = rf.workspace().project(project_id)
-        model = project.version(version_id).model
-        
-        prediction_result = model.predict(temp_image_path, confidence=40, overlap=30).json()
-        end_prediction = time.time()
-        print(f"🤖 Tiempo de predicción de Roboflow: {end_prediction - start_prediction:.2f} segundos")
-
-        class_detected = "No se detectó ninguna plaga"
-        confidence = 0.0
-        if prediction_result.get('predictions'):
-            top_pred = max(prediction_result['predictions'], key=lambda p: p['confidence'])
-            class_detected = top_pred['class']
-            confidence = top_pred['confidence']
-        
-        return {"prediction": class_detected, "confidence": confidence}
+def _infer_one(encoded_image):
+    """Predicción del modelo de producción, a través del circuito de inferencia."""
+    response = inference_breaker.call(partial(_post_inference, encoded_image, app.config['ROBOFLOW_MODEL_ID']))
+    response.raise_for_status()
+    return response.json()
+
+
+def _infer_batch(encoded_images):
+    """
+    Envía un lote de imágenes en una sola petición al servidor de inferencia
+    de Roboflow (ROBOFLOW_INFERENCE_URL), que las pasa juntas por el modelo.
+    Devuelve una respuesta por imagen, en el mismo orden y con el mismo
+    formato que el modelo alojado; la de una imagen que el servidor no pudo
+    procesar se devuelve como excepción para que falle solo esa petición.
+    """
+    from http_session import get_session
+
+    def _post():
+        response = get_session().post(
+            f"{app.config['ROBOFLOW_INFERENCE_URL']}/infer/object_detection",
+            json={
+                "api_key": app.config['ROBOFLOW_API_KEY'],
+                "model_id": app.config['ROBOFLOW_MODEL_ID'],
+                "image": [{"type": "base64", "value": encoded} for encoded in encoded_images],
+                "confidence": 0.4,
+                "iou_threshold": 0.3,
+            },
+        )
+        if response.status_code >= 500:
+            response.raise_for_status()
+        return response
+
+    response = inference_breaker.call(_post)
+    response.raise_for_status()
+    results = response.json()
+    results = results if isinstance(results, list) else [results]
+    return [
+        result if "predictions" in result else RuntimeError(
+            f"El servidor de inferencia no pudo procesar la imagen: {result.get('message') or result.get('error')}"
+        )
+        for result in results
+    ]
+
+
+def _is_rejected_image(error):
+    """Un 4xx del lote suele deberse a una sola imagen: se reintentan por separado."""
+    response = getattr(error, "response", None)
+    return response is not None and 400 <= response.status_code < 500
+
+
+# Con INFERENCE_BATCH_WINDOW_MS > 0, las imágenes de las peticiones que
+# llegan a la vez al worker se agrupan en un solo lote (ver batching.py)
+inference_batcher = None
+if Config.INFERENCE_BATCH_WINDOW_MS > 0 and Config.INFERENCE_BATCH_MAX_SIZE > 1:
+    if Config.ROBOFLOW_INFERENCE_URL:
+        inference_batcher = MicroBatcher(
+            "inference",
+            _infer_batch,
+            max_batch_size=Config.INFERENCE_BATCH_MAX_SIZE,
+            window_seconds=Config.INFERENCE_BATCH_WINDOW_MS / 1000,
+            concurrency=Config.INFERENCE_BATCH_CONCURRENCY,
+            retry_individually=_is_rejected_image,
+        )
+    else:
+        log.warning("INFERENCE_BATCH_WINDOW_MS necesita ROBOFLOW_INFERENCE_URL: se infiere imagen a imagen")
+
+
+def _infer(image_bytes):
+    """Predicción de una imagen: dentro de un lote si el agrupamiento está activo."""
+    encoded_image = _encode_for_inference(image_bytes)
+    if inference_batcher is None:
+        return _infer_one(encoded_image)
+    future = inference_batcher.submit(encoded_image)
+    try:
+        return future.result(timeout=Config.INFERENCE_BATCH_TIMEOUT)
+    except FutureTimeoutError:
+        # Si su lote aún no ha empezado, la imagen ya no se envía
+        future.cancel()
+        metrics.increment("inference.batch.timeouts")
+        raise TimeoutError(f"La inferencia no respondió en {Config.INFERENCE_BATCH_TIMEOUT:g} segundos")
+
+
+def _shadow_predict(image_bytes):
+    """
+    Predicción del modelo candidato. No pasa por el circuito de inferencia
+    ni por los lotes: sus fallos no deben afectar al modelo de producción.
+    """
+    response = _post_inference(_encode_for_inference(image_bytes), Config.SHADOW_MODEL_ID)
+    response.raise_for_status()
+    return _top_prediction(response.json())
+
+
+def _save_shadow_evaluation(evaluation):
+    with transaction() as cur:
+        repository.save_shadow_evaluation(cur, evaluation)
+
+
+# Con SHADOW_MODEL_ID, una muestra de las imágenes de /analyze se evalúa
+# también con el modelo candidato, después de enviar la respuesta (ver shadow.py)
+shadow_evaluator = None
+if Config.SHADOW_MODEL_ID:
+    shadow_evaluator = ShadowEvaluator(
+        Config.SHADOW_MODEL_ID,
+        Config.ROBOFLOW_MODEL_ID,
+        _shadow_predict,
+        _save_shadow_evaluation,
+        sample_rate=Config.SHADOW_SAMPLE_RATE,
+        queue_size=Config.SHADOW_QUEUE_SIZE,
+        workers=Config.SHADOW_WORKERS,
+    )
+
+
+def _shadow_copy(image_bytes, prediction, latency_ms):
+    """Lo que necesita la evaluación en sombra de una imagen, o None si no entra en la muestra."""
+    if shadow_evaluator is None or not shadow_evaluator.sampled():
+        return None
+    return {
+        "image_bytes": image_bytes,
+        "clase_produccion": prediction["prediction"],
+        "confianza_produccion": prediction["confidence"],
+        "hash_contenido": prediction["hash_contenido"],
+        "latencia_produccion_ms": latency_ms,
+    }
+
+
+def _lookup_known_image(image_hash, reserve_for=None):
+    """
+    Consulta imagenes_hash. Un fallo aquí no debe impedir el análisis. Con
+    `reserve_for` la URL devuelta queda reservada para ese usuario hasta que
+    guarde el análisis (ver lookup_image).
+    """
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        known = lookup_image(cur, image_hash, reserve_for, Config.IMAGE_REUSE_LEASE_SECONDS)
+        cur.close()
+        if reserve_for is not None:
+            conn.commit()
+        return known
+    except Exception as e:
+        log.warning("No se pudo consultar el índice de imágenes: %s", e)
+        return None
+    finally:
+        if conn:
+            conn.close()
 
+
+def _register_analyzed_images(images):
+    """Guarda en imagenes_hash el hash, la URL y la predicción de cada imagen analizada."""
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        register_images(cur, images)
+        conn.commit()
+        cur.close()
+    except Exception as e:
+        log.warning("No se pudo actualizar el índice de imágenes: %s", e)
     finally:
-        if os.path.exists(temp_image_path):
-            os.remove(temp_image_path)
+        if conn:
+            conn.close()
+
+
+def _delete_unreferenced_images(urls):
+    """Borra de Firebase Storage las URLs que ningún análisis guardado utiliza."""
+    if not urls:
+        return 0
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        urls = unreferenced_urls(cur, urls)
+        cur.close()
+    finally:
+        conn.close()
+    return delete_images(urls)
+
+
+def _run_prediction(image_url, cancel=None):
+    if cancel is not None and cancel.is_set():
+        return None
+    start_download = time.time()
+    image_bytes = download_image(image_url)
+    end_download = time.time()
+    metrics.observe("analyze.download", end_download - start_download)
+    log.info(
+        "Tiempo de descarga de imagen: %.2f segundos", end_download - start_download,
+        extra={"duracion_s": round(end_download - start_download, 3)}
+    )
+
+    image_hash = content_hash(image_bytes)
+    return _predict_image(image_bytes, image_hash, _lookup_known_image(image_hash), cancel)
+
+
+def _top_prediction(prediction_result):
+    """Clase y confianza de la detección más segura de una respuesta de Roboflow."""
+    if not prediction_result.get('predictions'):
+        return "No se detectó ninguna plaga", 0.0
+    top_pred = max(prediction_result['predictions'], key=lambda p: p['confidence'])
+    return top_pred['class'], top_pred['confidence']
+
+
+def _predict_image(image_bytes, image_hash, known=None, cancel=None):
+    """
+    Predice la clase de una imagen. Si la misma imagen (mismo hash de
+    contenido) ya se analizó con el modelo actual, se reutiliza el resultado.
+    Si `cancel` está activado antes de llamar al modelo, devuelve None: la
+    política de decisión ya no necesita esta cara.
+    """
+    if known and known['prediction'] is not None and known['modelo'] == app.config['ROBOFLOW_MODEL_ID']:
+        metrics.increment("analyze.prediction_reused")
+        log.info("Imagen ya analizada: se reutiliza la predicción anterior")
+        result = {
+            "prediction": known['prediction'],
+            "confidence": known['confidence'],
+            "hash_contenido": image_hash,
+            "modelo": known['modelo'],
+            # Las detecciones ya guardadas en imagenes_hash se conservan
+            "detecciones": None,
+        }
+        result["sombra"] = _shadow_copy(image_bytes, result, None)
+        return result
+
+    if cancel is not None and cancel.is_set():
+        metrics.increment("analyze.inference_skipped")
+        return None
+
+    start_prediction = time.time()
+    prediction_result = _infer(image_bytes)
+    end_prediction = time.time()
+    metrics.observe("analyze.inference", end_prediction - start_prediction)
+    log.info(
+        "Tiempo de predicción de Roboflow: %.2f segundos", end_prediction - start_prediction,
+        extra={"duracion_s": round(end_prediction - start_prediction, 3)}
+    )
+
+    class_detected, confidence = _top_prediction(prediction_result)
+    result = {
+        "prediction": class_detected,
+        "confidence": confidence,
+        "hash_contenido": image_hash,
+        "modelo": app.config['ROBOFLOW_MODEL_ID'],
+        "detecciones": pack_detections(prediction_result),
+    }
+    result["sombra"] = _shadow_copy(image_bytes, result, round((end_prediction - start_prediction) * 1000, 1))
+    return result
+
+
+def _detect_image(image_url):
+    """Vuelve a predecir una imagen guardada y devuelve sus detecciones compactas."""
+    start_detection = time.time()
+    detections = pack_detections(_infer(download_image(image_url)))
+    metrics.observe("detections.recompute", time.time() - start_detection)
+    return detections
+
+
+def _submit_uploaded_image(image_file, user_id):
+    """
+    Lanza la subida a Firebase Storage de una imagen recibida como multipart
+    y prepara su predicción. Devuelve (iniciar_prediccion, futuro_url), donde
+    iniciar_prediccion(cancel=...) lanza la inferencia y devuelve su Future:
+    la política de decisión elige cuándo (o si) se lanza. Si la imagen ya
+    está guardada por otro análisis, se reutiliza su URL en lugar de subir
+    una copia, reservándola para `user_id` para que no se borre antes de
+    que guarde el suyo.
+    """
+    image_bytes = image_file.read()
+    image_hash = content_hash(image_bytes)
+    known = _lookup_known_image(image_hash, reserve_for=user_id)
+    start_prediction = partial(io_executor.submit, _predict_image, image_bytes, image_hash, known)
+
+    if known and known['url_imagen']:
+        metrics.increment("analyze.upload_reused")
+        future_upload = Future()
+        future_upload.set_result(known['url_imagen'])
+    else:
+        extension = os.path.splitext(image_file.filename or "")[1].lstrip('.').lower() or "jpg"
+        content_type = image_file.mimetype or f"image/{extension}"
+        future_upload = io_executor.submit(upload_image, image_bytes, content_type, "analisis", extension)
+    return start_prediction, future_upload
 
 
 @app.route('/analyze', methods=['POST'])
 @token_required
+# Limitador de tasa (con RATE_LIMIT_BACKEND=postgres), reserva y liberación
+# del hueco global (con INFLIGHT_BACKEND=postgres), búsqueda de las dos
+# imágenes subidas en imagenes_hash y registro de sus hashes
+@db_route("escritura", 6)
+@rate_limited('analyze', Config.RATE_LIMIT_ANALYZE_BURST, Config.RATE_LIMIT_ANALYZE_PER_MINUTE, get_db_connection)
+@admission_controlled(inference_limiter, Config.INFLIGHT_RETRY_AFTER)
 def analyze_image(current_user_id):
     total_start_time = time.time()
-    data = request.get_json()
-    image_url_front = data.get('image_url_front')
-    image_url_back = data.get('image_url_back')
-
-    if not image_url_front:
-        return jsonify({"error": "La URL de la imagen del frente es requerida"}), 400
-
-    try:
-        print("\n--- Iniciando análisis (sin guardar) para el usuario:", current_user_id)
-        
-        result_front = _run_prediction(image_url_front)
-        final_result = result_front
+    upload_front = upload_back = None
+
+    if inference_breaker.is_open():
+        return _service_unavailable(inference_breaker.retry_after())
+
+    if 'image_front' in request.files:
+        # Subida directa (multipart): la inferencia usa los bytes recibidos y
+        # la copia a Firebase Storage se hace en paralelo, sin volver a
+        # descargar la imagen.
+        image_back_file = request.files.get('image_back')
+        start_front, upload_front = _submit_uploaded_image(request.files['image_front'], current_user_id)
+        start_back, upload_back = (
+            _submit_uploaded_image(image_back_file, current_user_id) if image_back_file else (None, None)
+        )
+        image_url_front = image_url_back = None
+    else:
+        data = request.get_json()
+        image_url_front = data.get('image_url_front')
+        image_url_back = data.get('image_url_back')
 
-        if image_url_back:
-            print("--- Procesando imagen del reverso ---")
-            result_back = _run_prediction(image_url_back)
-            
-            is_front_disease = result_front['prediction'] not in ['No se detectó ninguna plaga', 'Hoja sana']
-            is_back_disease = result_back['prediction'] not in ['No se detectó ninguna plaga', 'Hoja sana']
+        if not image_url_front:
+            return jsonify({"error": "La URL de la imagen del frente es requerida"}), 400
 
-            if is_back_disease:
-                final_result = result_back
-            elif is_front_disease and not is_back_disease:
-                final_result = result_front
-            else:
-                final_result = result_front if result_front['confidence'] >= result_back['confidence'] else result_back
+        # Frente y reverso son independientes: la política de decisión los
+        # descarga y predice en paralelo (o solo los que necesita).
+        start_front = partial(io_executor.submit, _run_prediction, image_url_front)
+        start_back = partial(io_executor.submit, _run_prediction, image_url_back) if image_url_back else None
 
+    try:
+        log.info("Iniciando análisis (sin guardar) para el usuario %s", current_user_id, extra={"id_usuario": current_user_id})
 
-        MIN_CONFIDENCE_FOR_VALID_LEAF = 0.30 
+        decision_start = time.time()
+        final_result, result_front, result_back, decision_route = resolve_decision(
+            Config.DECISION_POLICY, start_front, start_back, Config.DECISION_FRONT_MIN_CONFIDENCE
+        )
+        metrics.increment(f"analyze.route.{decision_route}")
+        metrics.observe(f"analyze.decision.{decision_route}", time.time() - decision_start)
+        log.info(
+            "Ruta de decisión: %s (política '%s')", decision_route, Config.DECISION_POLICY,
+            extra={"ruta_decision": decision_route}
+        )
 
-        prediction_text = final_result['prediction']
+        prediction_text, is_valid_leaf = displayed_prediction(final_result)
         prediction_confidence = final_result['confidence']
-        is_valid_leaf = True
 
-        if prediction_text == 'No se detectó ninguna plaga' or prediction_confidence < MIN_CONFIDENCE_FOR_VALID_LEAF:
-            is_valid_leaf = False
-            prediction_text = "Imagen no reconocida"
-        
+        if upload_front:
+            image_url_front = upload_front.result()
+            image_url_back = upload_back.result() if upload_back else None
+
+        # Se indexa cada imagen para reutilizar su predicción y su archivo, y
+        # se guardan sus detecciones hasta que el análisis se guarde. Se hace
+        # antes de responder: /history/save las copia por hash de contenido
+        # y el cliente puede guardar en cuanto recibe la respuesta.
+        analyzed = [
+            (result['hash_contenido'], url, result['modelo'], result['prediction'], result['confidence'],
+             result['detecciones'])
+            for result, url in ((result_front, image_url_front), (result_back, image_url_back))
+            if result
+        ]
+        _register_analyzed_images(analyzed)
 
         total_end_time = time.time()
-        print(f"⏱️ Tiempo total de la solicitud '/analyze': {total_end_time - total_start_time:.2f} segundos\n")
+        log.info(
+            "Tiempo total de la solicitud '/analyze': %.2f segundos", total_end_time - total_start_time,
+            extra={"duracion_s": round(total_end_time - total_start_time, 3)}
+        )
 
         response_data = {
             "prediction": prediction_text,
             "confidence": prediction_confidence,
             "is_valid_leaf": is_valid_leaf,
             "url_imagen": image_url_front,
-            "url_imagen_reverso": image_url_back
+            "url_imagen_reverso": image_url_back,
+            # Se devuelven en /history/save para copiar las detecciones
+            "hash_contenido": result_front['hash_contenido'] if result_front else None,
+            "hash_contenido_reverso": result_back['hash_contenido'] if result_back else None,
+            "ruta_decision": decision_route
         }
 
-        return jsonify(response_data), 200
+        response = jsonify(response_data)
+        # La evaluación en sombra se encola cuando la respuesta ya se ha enviado
+        shadow_items = [
+            {**result['sombra'], "request_id": structured_logging.current_request_id()}
+            for result in (result_front, result_back)
+            if result and result.get('sombra')
+        ]
+        if shadow_items:
+            response.call_on_close(partial(shadow_evaluator.offer, shadow_items))
+        return response, 200
 
     except Exception as e:
+        # Si el análisis falla, no dejamos huérfanas las imágenes ya subidas
+        # (las reutilizadas de otros análisis se conservan)
+        orphan_urls = [
+            future.result() for future in (upload_front, upload_back)
+            if future and not future.exception()
+        ]
+        try:
+            _delete_unreferenced_images(orphan_urls)
+        except Exception as cleanup_error:
+            log.warning("No se pudieron borrar las imágenes huérfanas: %s", cleanup_error)
+        if isinstance(e, CircuitOpenError):
+            return _service_unavailable(e.retry_after)
         return jsonify({"error": f"Ocurrió un error durante el análisis: {str(e)}"}), 500
 
 
+def _process_saved_analysis(id_analisis, url_imagen, url_imagen_reverso):
+    """
+    Trabajo posterior al guardado: indexa la imagen para detectar duplicados
+    y genera sus variantes, descargando el frente una sola vez.
+    """
+    conn = None
+    try:
+        conn = get_db_connection()
+        front_bytes = download_image(url_imagen)
+        try:
+            duplicado_de = index_analysis(
+                conn, duplicate_index, id_analisis, url_imagen, front_bytes, Config.DUPLICATE_MAX_DISTANCE
+            )
+            if duplicado_de:
+                metrics.increment("analyze.duplicates_flagged")
+                log.info("Análisis %s marcado como duplicado de %s", id_analisis, duplicado_de)
+        except Exception as e:
+            # El script backfill_hashes.py recogerá este análisis más tarde
+            conn.rollback()
+            log.warning("No se pudo indexar el análisis %s: %s", id_analisis, e)
+        store_analysis_variants(conn, id_analisis, url_imagen, url_imagen_reverso, front_bytes)
+    except Exception as e:
+        # El script backfill_variants.py recogerá este análisis más tarde
+        log.warning("No se pudieron generar las variantes del análisis %s: %s", id_analisis, e)
+    finally:
+        if conn:
+            conn.close()
+
+
 @app.route('/history/save', methods=['POST'])
 @token_required
+@db_route("escritura", 2)
 def save_analysis(current_user_id):
     data = request.get_json()
     
@@ -263,25 +707,25 @@ def save_analysis(current_user_id):
     url_imagen_reverso = data.get('url_imagen_reverso')
     resultado_prediccion = data.get('prediction')
     confianza = data.get('confidence')
+    # Hashes de contenido que devolvió /analyze (opcionales)
+    hash_frente = data.get('hash_contenido')
+    hash_reverso = data.get('hash_contenido_reverso')
 
     if not all([url_imagen, resultado_prediccion, confianza is not None]):
         return jsonify({"error": "Faltan datos para guardar el análisis"}), 400
 
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        cur.execute(
-            """
-            INSERT INTO analisis (id_usuario, url_imagen, url_imagen_reverso, resultado_prediccion, confianza, fecha_analisis)
-            VALUES (%s, %s, %s, %s, %s, %s) RETURNING id_analisis;
-            """,
-            (current_user_id, url_imagen, url_imagen_reverso, resultado_prediccion, confianza, datetime.utcnow())
-        )
-        new_id = cur.fetchone()[0] 
-        conn.commit()
-        cur.close()
-        conn.close()
+        with transaction(current_user_id) as cur:
+            # Las detecciones de cada cara se copian de imagenes_hash, donde
+            # /analyze las dejó, para no tener que volver a predecir la imagen
+            new_id = repository.save_analysis(
+                cur, current_user_id, url_imagen, url_imagen_reverso, resultado_prediccion, confianza,
+                datetime.utcnow(), hash_frente, hash_reverso
+            )
+
+        # El índice de duplicados y las miniaturas se generan fuera de la
+        # petición para no retrasar la respuesta
+        io_executor.submit(_process_saved_analysis, new_id, url_imagen, url_imagen_reverso)
 
         # Devolvemos el resultado completo con el nuevo ID
         response_data = {
@@ -300,26 +744,17 @@ def save_analysis(current_user_id):
 
 @app.route('/disease/<string:roboflow_name>', methods=['GET'])
 @token_required
+@db_route("lectura", 2)
 def get_disease_details(current_user_id, roboflow_name):
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        with reading(current_user_id) as cur:
+            disease = repository.disease_by_class(cur, roboflow_name)
 
-        cur.execute("SELECT * FROM enfermedades WHERE roboflow_class = %s", (roboflow_name,))
-        disease = cur.fetchone()
+            if not disease:
+                return jsonify({"error": "Enfermedad no encontrada"}), 404
 
-        if not disease:
-            return jsonify({"error": "Enfermedad no encontrada"}), 404
+            treatments = repository.disease_treatments(cur, disease['id_enfermedad'])
 
-        cur.execute(
-            "SELECT * FROM tratamientos WHERE id_enfermedad = %s",
-            (disease['id_enfermedad'],)
-        )
-        treatments = cur.fetchall()
-
-        cur.close()
-        conn.close()
-        
         response = {
             "info": dict(disease),
             "recommendations": [dict(t) for t in treatments]
@@ -332,24 +767,11 @@ def get_disease_details(current_user_id, roboflow_name):
 
 @app.route('/history', methods=['GET'])
 @token_required
+@db_route("lectura", 1)
 def get_history(current_user_id):
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-
-        cur.execute(
-            """SELECT 
-               id_analisis, url_imagen, url_imagen_reverso, 
-               resultado_prediccion, confianza, fecha_analisis 
-               FROM analisis 
-               WHERE id_usuario = %s AND fecha_eliminado IS NULL 
-               ORDER BY fecha_analisis DESC""", 
-            (current_user_id,)
-        )
-        
-        history = cur.fetchall()
-        cur.close()
-        conn.close()
+        with reading(current_user_id) as cur:
+            history = repository.user_history(cur, current_user_id)
         
         results = []
         for row in history:
@@ -358,6 +780,10 @@ def get_history(current_user_id):
                 "id_analisis": row["id_analisis"],
                 "url_imagen": row["url_imagen"],
                 "url_imagen_reverso": row["url_imagen_reverso"], 
+                "url_miniatura": row["url_miniatura"],
+                "url_mediana": row["url_mediana"],
+                "url_miniatura_reverso": row["url_miniatura_reverso"],
+                "url_mediana_reverso": row["url_mediana_reverso"],
                 "resultado_prediccion": row["resultado_prediccion"],
                 "confianza": row["confianza"],
                 "fecha_analisis": row["fecha_analisis"].isoformat()
@@ -369,81 +795,160 @@ def get_history(current_user_id):
         return jsonify({"error": f"Ocurrió un error al obtener el historial: {str(e)}"}), 500
         return jsonify({"error": f"Ocurrió un error al obtener el historial: {str(e)}"}), 500
 
-@app.route('/history/<int:analysis_id>', methods=['DELETE'])
+@app.route('/history/sync', methods=['GET'])
 @token_required
-def delete_history_item(current_user_id, analysis_id):
+@db_route("lectura", 1)
+def sync_history(current_user_id):
+    """
+    Sincronización incremental del historial. Devuelve solo los análisis
+    insertados, modificados (papelera/restauración) o borrados definitivamente
+    desde la marca `since` que envía el cliente, junto con la nueva marca.
+    El tamaño de la respuesta depende del número de cambios, no del historial.
+    """
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        since = int(request.args.get('since', 0))
+        limit = min(int(request.args.get('limit', app.config['SYNC_PAGE_SIZE'])), app.config['SYNC_PAGE_SIZE'])
+    except ValueError:
+        return jsonify({"error": "Los parámetros 'since' y 'limit' deben ser números enteros"}), 400
+    if limit <= 0:
+        return jsonify({"error": "El parámetro 'limit' debe ser mayor que cero"}), 400
 
-        cur.execute(
-            "SELECT url_imagen FROM analisis WHERE id_analisis = %s AND id_usuario = %s",
-            (analysis_id, current_user_id)
-        )
-        item = cur.fetchone()
+    try:
+        # Siempre en el primario: el cliente guarda la marca y no debe saltarse cambios
+        with transaction() as cur:
+            # Se pide una fila de más para saber si quedan cambios por descargar
+            rows = repository.history_changes(cur, current_user_id, since, limit + 1)
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        changes = []
+        tombstones = []
+        for row in rows:
+            if row["borrado"]:
+                tombstones.append(row["id_analisis"])
+                continue
+            changes.append({
+                "id_analisis": row["id_analisis"],
+                "url_imagen": row["url_imagen"],
+                "url_imagen_reverso": row["url_imagen_reverso"],
+                "url_miniatura": row["url_miniatura"],
+                "url_mediana": row["url_mediana"],
+                "url_miniatura_reverso": row["url_miniatura_reverso"],
+                "url_mediana_reverso": row["url_mediana_reverso"],
+                "resultado_prediccion": row["resultado_prediccion"],
+                "confianza": row["confianza"],
+                "fecha_analisis": row["fecha_analisis"].isoformat(),
+                "fecha_eliminado": row["fecha_eliminado"].isoformat() if row["fecha_eliminado"] else None
+            })
 
-        if not item:
-            cur.close()
-            conn.close()
+        return jsonify({
+            "watermark": rows[-1]["version"] if rows else since,
+            "hay_mas": has_more,
+            "cambios": changes,
+            "eliminados": tombstones
+        }), 200
+
+    except Exception as e:
+        return jsonify({"error": f"Ocurrió un error al sincronizar el historial: {str(e)}"}), 500
+
+def _detections_response(analysis_id, row):
+    return jsonify({
+        "id_analisis": analysis_id,
+        "modelo": row['modelo'],
+        "frente": unpack_detections(row['frente']),
+        "reverso": unpack_detections(row['reverso']),
+    }), 200
+
+
+@admission_controlled(inference_limiter, Config.INFLIGHT_RETRY_AFTER)
+def _recompute_detections(analysis_id, row, missing):
+    """
+    Predice las caras sin detecciones y las guarda. Ocupa un hueco de
+    inferencia como /analyze y no retiene ninguna conexión mientras espera
+    al modelo.
+    """
+    if inference_breaker.is_open():
+        return _service_unavailable(inference_breaker.retry_after())
+    futures = {side: io_executor.submit(_detect_image, url) for side, url in missing.items()}
+    row.update({side: future.result() for side, future in futures.items()})
+    row['modelo'] = row['modelo'] or app.config['ROBOFLOW_MODEL_ID']
+    with transaction() as cur:
+        repository.store_detections(cur, analysis_id, row['modelo'], row['frente'], row['reverso'])
+    metrics.increment("detections.recomputed", len(missing))
+    return _detections_response(analysis_id, row)
+
+
+@app.route('/history/<int:analysis_id>/detections', methods=['GET'])
+@token_required
+# Lectura y, si faltan detecciones, reserva y liberación del hueco de
+# inferencia (con INFLIGHT_BACKEND=postgres) y guardado
+@db_route("lectura", 4)
+def get_analysis_detections(current_user_id, analysis_id):
+    """
+    Devuelve las cajas detectadas en cada cara del análisis. Se piden aparte
+    (al abrir el detalle) para no cargar el historial con ellas. Los análisis
+    guardados antes de que existieran se predicen una sola vez y se guardan.
+    """
+    try:
+        with transaction(cursor_factory=RealDictCursor) as cur:
+            row = repository.analysis_detections(cur, analysis_id, current_user_id)
+        if row is None:
             return jsonify({"error": "Análisis no encontrado o no autorizado"}), 404
 
-        cur.execute(
-            "UPDATE analisis SET fecha_eliminado = NOW() AT TIME ZONE 'UTC' WHERE id_analisis = %s AND id_usuario = %s",
-            (analysis_id, current_user_id)
-        )
-        conn.commit()
-        cur.close()
-        conn.close()
+        missing = {
+            side: url for side, url in (("frente", row['url_imagen']), ("reverso", row['url_imagen_reverso']))
+            if url and row[side] is None
+        }
+        if missing:
+            return _recompute_detections(analysis_id, dict(row), missing)
+        return _detections_response(analysis_id, row)
+
+    except Exception as e:
+        if isinstance(e, CircuitOpenError):
+            return _service_unavailable(e.retry_after)
+        return jsonify({"error": f"Ocurrió un error al obtener las detecciones: {str(e)}"}), 500
+
+@app.route('/history/<int:analysis_id>', methods=['DELETE'])
+@token_required
+@db_route("escritura", 1)
+def delete_history_item(current_user_id, analysis_id):
+    try:
+        with transaction(current_user_id) as cur:
+            if not repository.trash_analysis(cur, analysis_id, current_user_id):
+                return jsonify({"error": "Análisis no encontrado o no autorizado"}), 404
 
         return jsonify({"message": "Análisis borrado exitosamente"}), 200
 
     except Exception as e:
         return jsonify({"error": f"Ocurrió un error al borrar el análisis: {str(e)}"}), 500
     
+
 @app.route('/admin/analysis/<int:analysis_id>', methods=['DELETE'])
 @admin_required
+@db_route("admin", 1)
 def admin_delete_analysis(current_user_id, analysis_id):
     """
     Permite a un administrador mover cualquier análisis a la papelera,
     sin importar quién sea el propietario.
     """
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        cur.execute(
-            "UPDATE analisis SET fecha_eliminado = NOW() AT TIME ZONE 'UTC' WHERE id_analisis = %s",
-            (analysis_id,)
-        )
-
-        if cur.rowcount == 0:
-            cur.close()
-            conn.close()
-            return jsonify({"error": "Análisis no encontrado"}), 404
-            
-        conn.commit()
-        cur.close()
-        conn.close()
+        with transaction(current_user_id) as cur:
+            if not repository.trash_analysis(cur, analysis_id):
+                return jsonify({"error": "Análisis no encontrado"}), 404
         
         return jsonify({"message": "Análisis borrado por el administrador exitosamente"}), 200
 
     except Exception as e:
         return jsonify({"error": f"Ocurrió un error al borrar el análisis: {str(e)}"}), 500
 
-
 @app.route('/history/trash', methods=['GET'])
 @token_required
+@db_route("lectura", 1)
 def get_trashed_history(current_user_id):
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        
-        cur.execute(
-            "SELECT * FROM analisis WHERE id_usuario = %s AND fecha_eliminado IS NOT NULL ORDER BY fecha_eliminado DESC", 
-            (current_user_id,)
-        )
-        
-        history = cur.fetchall()
+        with reading(current_user_id) as cur:
+            history = repository.user_trash(cur, current_user_id)
         results = [dict(row) for row in history]
         for r in results:
             if r.get('fecha_analisis'):
@@ -451,84 +956,52 @@ def get_trashed_history(current_user_id):
             if r.get('fecha_eliminado'):
                 r['fecha_eliminado'] = r['fecha_eliminado'].isoformat()
 
-        cur.close()
-        conn.close()
         return jsonify(results), 200
     except Exception as e:
         return jsonify({"error": f"Ocurrió un error al obtener la papelera: {str(e)}"}), 500
 
 @app.route('/history/<int:analysis_id>/restore', methods=['PUT'])
 @token_required
+@db_route("escritura", 1)
 def restore_history_item(current_user_id, analysis_id):
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute(
-            "UPDATE analisis SET fecha_eliminado = NULL WHERE id_analisis = %s AND id_usuario = %s",
-            (analysis_id, current_user_id)
-        )
-        conn.commit()
-        cur.close()
-        conn.close()
+        with transaction(current_user_id) as cur:
+            repository.restore_analysis(cur, analysis_id, current_user_id)
         return jsonify({"message": "Análisis restaurado exitosamente"}), 200
     except Exception as e:
         return jsonify({"error": f"Ocurrió un error al restaurar: {str(e)}"}), 500
     
+
 @app.route('/admin/analysis/restore/<int:analysis_id>', methods=['PUT'])
 @admin_required
+@db_route("admin", 1)
 def admin_restore_analysis(current_user_id, analysis_id):
     """
     Permite a un administrador restaurar cualquier análisis (quitarlo de la papelera),
     sin importar quién sea el propietario.
     """
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        cur.execute(
-            "UPDATE analisis SET fecha_eliminado = NULL WHERE id_analisis = %s",
-            (analysis_id,)
-        )
-        
-        if cur.rowcount == 0:
-            cur.close()
-            conn.close()
-            return jsonify({"error": "Análisis no encontrado"}), 404
-            
-        conn.commit()
-        cur.close()
-        conn.close()
+        with transaction(current_user_id) as cur:
+            if not repository.restore_analysis(cur, analysis_id):
+                return jsonify({"error": "Análisis no encontrado"}), 404
         
         return jsonify({"message": "Análisis restaurado por el administrador exitosamente"}), 200
 
     except Exception as e:
         return jsonify({"error": f"Ocurrió un error al restaurar el análisis: {str(e)}"}), 500
 
-
 @app.route('/admin/trash', methods=['GET'])
 @admin_required
+@db_route("admin", 1)
 def get_admin_trashed_items(current_user_id):
     """
     Obtiene todos los análisis que han sido movidos a la papelera (eliminado lógicamente)
     de todos los usuarios.
     """
     try:
-        conn = get_db_connection()
-    
-        cur = conn.cursor(cursor_factory=RealDictCursor) 
-        
         # Unimos la tabla de analisis con la de usuarios para obtener el email
-        cur.execute("""
-            SELECT a.*, u.email 
-            FROM analisis a
-            JOIN usuarios u ON a.id_usuario = u.id_usuario
-            WHERE a.fecha_eliminado IS NOT NULL
-            ORDER BY a.fecha_eliminado DESC
-        """)
-        
-        trashed_items = cur.fetchall()
-        cur.close()
-        conn.close()
+        with transaction(cursor_factory=RealDictCursor) as cur:
+            trashed_items = repository.all_trash(cur)
         
         results = [dict(row) for row in trashed_items]
         for r in results:
@@ -544,131 +1017,202 @@ def get_admin_trashed_items(current_user_id):
 
 @app.route('/history/<int:analysis_id>/permanent', methods=['DELETE'])
 @token_required
+@db_route("escritura", 2)
 def permanently_delete_item(current_user_id, analysis_id):
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-
-        cur.execute(
-            "SELECT url_imagen, url_imagen_reverso FROM analisis WHERE id_analisis = %s AND id_usuario = %s",
-            (analysis_id, current_user_id)
-        )
-        item_to_delete = cur.fetchone()
+        with transaction(current_user_id) as cur:
+            item_to_delete = repository.delete_analysis(cur, analysis_id, current_user_id)
 
-        if not item_to_delete:
-            cur.close()
-            conn.close()
-            return jsonify({"error": "Análisis no encontrado"}), 404
+            if not item_to_delete:
+                return jsonify({"error": "Análisis no encontrado"}), 404
 
-        cur.execute("DELETE FROM analisis WHERE id_analisis = %s", (analysis_id,))
-        conn.commit()
-        cur.close()
-        conn.close()
+            # Las imágenes compartidas con otros análisis duplicados se conservan
+            urls_to_delete = unreferenced_urls(cur, analysis_image_urls([item_to_delete]))
 
         # --- BORRAR AMBAS IMÁGENES DE FIREBASE ---
-        urls_to_delete = [item_to_delete['url_imagen'], item_to_delete['url_imagen_reverso']]
-
-        for image_url in urls_to_delete:
-            if image_url: 
-                try:
-                    path_part = image_url.split('?')[0]
-                    file_path = path_part.split('/o/')[-1].replace('%2F', '/')
-
-                    bucket = storage.bucket()
-                    blob = bucket.blob(file_path)
-
-                    if blob.exists():
-                        blob.delete()
-                        print(f"Imagen {file_path} borrada permanentemente de Firebase Storage.")
-                    else:
-                        print(f"Imagen {file_path} no encontrada en Firebase, posiblementa ya fue borrada.")
-                except Exception as e:
-                    print(f"ADVERTENCIA: No se pudo borrar la imagen {image_url} de Firebase Storage: {e}")
+        delete_images(urls_to_delete)
 
         return jsonify({"message": "Análisis borrado permanentemente"}), 200
 
     except Exception as e:
-        if 'conn' in locals() and conn:
-            cur.close()
-            conn.close()
         return jsonify({"error": f"Ocurrió un error en el borrado permanente: {str(e)}"}), 500
     
 
 @app.route('/history/trash/empty', methods=['DELETE'])
 @token_required
+@db_route("escritura", 2)
 def empty_trash(current_user_id):
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-
-        cur.execute(
-            "SELECT url_imagen, url_imagen_reverso FROM analisis WHERE id_usuario = %s AND fecha_eliminado IS NOT NULL",
-            (current_user_id,)
-        )
-        items_to_delete = cur.fetchall()
+        with transaction(current_user_id) as cur:
+            items_to_delete = repository.empty_trash(cur, current_user_id)
+            # Las imágenes compartidas con otros análisis duplicados se conservan
+            urls_to_delete = unreferenced_urls(cur, analysis_image_urls(items_to_delete))
 
         if items_to_delete:
-            print(f"Vaciando papelera para el usuario {current_user_id}. {len(items_to_delete)} items encontrados.")
-            bucket = storage.bucket()
-            for item in items_to_delete:
-                urls_to_process = [item['url_imagen'], item['url_imagen_reverso']]
-                for image_url in urls_to_process:
-                    if image_url: 
-                        try:
-                            path_part = image_url.split('?')[0]
-                            file_path = path_part.split('/o/')[-1].replace('%2F', '/')
-                            blob = bucket.blob(file_path)
-                            if blob.exists():
-                                blob.delete()
-                                print(f"Imagen {file_path} borrada de Firebase Storage al vaciar papelera.")
-                        except Exception as e:
-                            print(f"ADVERTENCIA: No se pudo borrar la imagen {image_url} de Firebase Storage: {e}")
-
-        cur.execute(
-            "DELETE FROM analisis WHERE id_usuario = %s AND fecha_eliminado IS NOT NULL",
-            (current_user_id,)
-        )
-        conn.commit()
-
-        cur.close()
-        conn.close()
+            log.info(
+                "Vaciando papelera para el usuario %s. %s items encontrados.", current_user_id, len(items_to_delete)
+            )
+            delete_images(urls_to_delete)
 
         return jsonify({"message": "La papelera ha sido vaciada exitosamente"}), 200
 
     except Exception as e:
-        if 'conn' in locals() and conn:
-            cur.close()
-            conn.close()
         return jsonify({"error": f"Ocurrió un error al vaciar la papelera: {str(e)}"}), 500
     
     
 
+def _bulk_trash_operation(data, owner_id, actor_id):
+    """
+    Aplica una acción de papelera (delete, restore o permanent) a una lista de
+    IDs o a los análisis que cumplan un filtro, con una sola sentencia SQL.
+    owner_id limita la operación a los análisis de ese usuario (None = admin);
+    actor_id es quien la pide, para que sus siguientes lecturas la vean.
+    Devuelve (respuesta, código HTTP).
+    """
+    data = data or {}
+    action = data.get('action')
+    ids = data.get('ids')
+    filtro = data.get('filter')
+    max_batch = app.config['BULK_MAX_BATCH']
+
+    if action not in repository.BULK_ACTIONS:
+        return {"error": "Acción no válida. Usa 'delete', 'restore' o 'permanent'."}, 400
+    if (ids is None) == (filtro is None):
+        return {"error": "Envía una lista de 'ids' o un 'filter', pero no ambos."}, 400
+
+    if ids is not None:
+        if not isinstance(ids, list) or not all(isinstance(i, int) for i in ids):
+            return {"error": "'ids' debe ser una lista de números enteros"}, 400
+        if len(ids) > max_batch:
+            return {"error": f"Se permiten como máximo {max_batch} análisis por petición"}, 400
+        if not ids:
+            return {"action": action, "procesados": 0, "resultados": []}, 200
+        filters = {}
+    else:
+        if not isinstance(filtro, dict):
+            return {"error": "'filter' debe ser un objeto"}, 400
+        filters = {"prediccion": filtro.get('resultado_prediccion'), "antes_de": filtro.get('antes_de')}
+
+    with transaction(actor_id) as cur:
+        rows = repository.bulk_trash(cur, action, owner_id, max_batch, ids, **filters)
+        affected = [row for row in rows if row['id_analisis'] is not None]
+        urls_to_delete = []
+        if action == "permanent" and affected:
+            # Las imágenes compartidas con otros análisis duplicados se conservan
+            urls_to_delete = unreferenced_urls(cur, analysis_image_urls(affected))
+
+    # Una única purga en bloque de todas las imágenes de los análisis borrados
+    images_deleted = delete_images(urls_to_delete) if urls_to_delete else 0
+
+    return {
+        "action": action,
+        "procesados": len(affected),
+        "imagenes_borradas": images_deleted,
+        "resultados": [
+            {
+                "id_analisis": row['id_solicitado'],
+                "estado": "ok" if row['id_analisis'] is not None else "no_encontrado",
+            }
+            for row in rows
+        ],
+    }, 200
+
+
+@app.route('/history/bulk', methods=['POST'])
+@token_required
+@db_route("escritura", 2)
+def bulk_history_operation(current_user_id):
+    """
+    Borra, restaura o elimina permanentemente varios análisis del usuario a la vez.
+    Cuerpo: {"action": "delete" | "restore" | "permanent", "ids": [...]}
+    o {"action": ..., "filter": {"resultado_prediccion": ..., "antes_de": ...}}.
+    """
+    try:
+        response, status = _bulk_trash_operation(request.get_json(), current_user_id, current_user_id)
+        return jsonify(response), status
+    except Exception as e:
+        return jsonify({"error": f"Ocurrió un error en la operación masiva: {str(e)}"}), 500
+
+
+@app.route('/admin/analyses/bulk', methods=['POST'])
+@admin_required
+@db_route("admin", 2)
+def admin_bulk_analysis_operation(current_user_id):
+    """
+    Versión de administrador de /history/bulk: actúa sobre los análisis de
+    cualquier usuario.
+    """
+    try:
+        response, status = _bulk_trash_operation(request.get_json(), None, current_user_id)
+        return jsonify(response), status
+    except Exception as e:
+        return jsonify({"error": f"Ocurrió un error en la operación masiva: {str(e)}"}), 500
+
+
+def _parse_plant_count(value):
+    """Convierte el número de plantas a entero positivo; lanza ValueError si no es válido."""
+    plant_count = int(value)
+    if plant_count <= 0:
+        raise ValueError("El número de plantas debe ser mayor que cero")
+    return plant_count
+
+
+def _calculate_dose_batch(data):
+    """
+    Modo por lotes de /calculate_dose. Cuerpo:
+    {"items": [{"treatment_id": 1, "plant_count": 200}, ...], "plant_count": 200}
+    El plant_count de primer nivel se usa en los elementos que no lo indican.
+    Devuelve (respuesta, código HTTP).
+    """
+    items = data.get('items')
+    max_items = app.config['DOSE_BATCH_MAX']
+    if not isinstance(items, list) or not items:
+        return {"error": "'items' debe ser una lista no vacía de tratamientos"}, 400
+    if len(items) > max_items:
+        return {"error": f"Se permiten como máximo {max_items} tratamientos por petición"}, 400
+
+    treatment_ids, plant_counts = [], []
+    try:
+        for item in items:
+            treatment_ids.append(int(item['treatment_id']))
+            plant_counts.append(_parse_plant_count(item.get('plant_count', data.get('plant_count'))))
+    except (KeyError, TypeError, ValueError):
+        return {"error": "Cada elemento necesita un 'treatment_id' y un número de plantas entero mayor que cero"}, 400
+
+    results, summary = calculate_plan(dose_table.get(), treatment_ids, plant_counts)
+    return {"resultados": results, "resumen_por_enfermedad": summary}, 200
+
+
 @app.route('/calculate_dose', methods=['POST'])
 @token_required
+# Comprobación de la versión de la tabla de dosis y, si cambió, su recarga
+@db_route("lectura", 2)
 def calculate_dose(current_user_id):
-    data = request.get_json()
+    data = request.get_json() or {}
+    if 'items' in data:
+        try:
+            response, status = _calculate_dose_batch(data)
+            return jsonify(response), status
+        except Exception as e:
+            return jsonify({"error": f"Ocurrió un error al calcular la dosis: {str(e)}"}), 500
+
     treatment_id = data.get('treatment_id')
     plant_count = data.get('plant_count')
 
     if not treatment_id or not plant_count:
         return jsonify({"error": "Faltan datos requeridos (ID de tratamiento y número de plantas)"}), 400
 
+    try:
+        treatment_id = int(treatment_id)
+    except (TypeError, ValueError):
+        return jsonify({"error": "El ID de tratamiento debe ser un número entero"}), 400
+
     try:
         plant_count = int(plant_count)
         if plant_count <= 0:
             return jsonify({"error": "El número de plantas debe ser mayor que cero"}), 400
 
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-
-        cur.execute(
-            "SELECT dosis_por_planta_ml, agua_por_planta_ml FROM tratamientos WHERE id_tratamiento = %s",
-            (treatment_id,)
-        )
-        treatment_data = cur.fetchone()
-        cur.close()
-        conn.close()
-
+        treatment_data = dose_table.get().rows.get(treatment_id)
         if not treatment_data:
             return jsonify({"error": "Tratamiento no encontrado"}), 404
         
@@ -697,20 +1241,18 @@ def calculate_dose(current_user_id):
 # Endpoint para obtener las enfermedades
 @app.route('/admin/diseases', methods=['GET'])
 @admin_required
+@db_route("admin", 1)
 def get_all_diseases(current_user_id):
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cur.execute("SELECT id_enfermedad, nombre_comun, roboflow_class FROM enfermedades ORDER BY nombre_comun ASC")
-        diseases = cur.fetchall()
-        cur.close()
-        conn.close()
+        with transaction() as cur:
+            diseases = repository.disease_list(cur)
         return jsonify([dict(row) for row in diseases]), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/admin/disease/<int:disease_id>', methods=['PUT'])
 @admin_required
+@db_route("admin", 1)
 def update_disease_details(current_user_id, disease_id):
     """
     Permite a un administrador actualizar los detalles de una enfermedad,
@@ -725,44 +1267,16 @@ def update_disease_details(current_user_id, disease_id):
     prevencion = data.get('prevencion')
     riesgo = data.get('riesgo')
 
+    if all(value is None for value in (imagen_url, tipo, prevencion, riesgo)):
+        return jsonify({"error": "No se enviaron campos válidos para actualizar"}), 400
+
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        query_parts = []
-        params = []
-        if imagen_url is not None:
-            query_parts.append("imagen_url = %s")
-            params.append(imagen_url)
-        if tipo is not None:
-            query_parts.append("tipo = %s")
-            params.append(tipo)
-        if prevencion is not None:
-            query_parts.append("prevencion = %s")
-            params.append(prevencion)
-        if riesgo is not None:
-            query_parts.append("riesgo = %s")
-            params.append(riesgo)
-
-        if not query_parts:
-            return jsonify({"error": "No se enviaron campos válidos para actualizar"}), 400
-
-        params.append(disease_id)
-        
-        query = f"UPDATE enfermedades SET {', '.join(query_parts)} WHERE id_enfermedad = %s RETURNING *;"
-        
-        cur.execute(query, tuple(params))
-        
-        updated_disease = cur.fetchone()
+        with transaction(current_user_id) as cur:
+            updated_disease = repository.update_disease(cur, disease_id, imagen_url, tipo, prevencion, riesgo)
         
         if updated_disease is None:
-            cur.close()
-            conn.close()
             return jsonify({"error": "Enfermedad no encontrada"}), 404
 
-        conn.commit()
-        cur.close()
-        conn.close()
-        
         return jsonify(dict(updated_disease)), 200
 
     except Exception as e:
@@ -782,27 +1296,19 @@ def delete_from_storage(current_user_id):
         return jsonify({"error": "No se proporcionó URL de la imagen"}), 400
 
     try:
-        path_part = image_url.split('?')[0]
-        file_path = path_part.split('/o/')[-1].replace('%2F', '/')
-        
-        bucket = storage.bucket()
-        blob = bucket.blob(file_path)
-
-        if blob.exists():
-            blob.delete()
-            print(f"Imagen {file_path} borrada permanentemente de Firebase Storage por un admin.")
+        if delete_image(image_url):
             return jsonify({"message": "Imagen eliminada exitosamente de Firebase Storage"}), 200
         else:
-            print(f"ADVERTENCIA: Se intentó borrar la imagen {file_path} pero no se encontró en Firebase.")
             return jsonify({"message": "La imagen no fue encontrada en Firebase, posiblemente ya fue borrada."}), 200
 
     except Exception as e:
-        print(f"ERROR: No se pudo borrar la imagen {image_url} de Firebase Storage: {e}")
+        log.error("No se pudo borrar la imagen %s de Firebase Storage: %s", image_url, e)
         return jsonify({"error": f"Ocurrió un error al intentar borrar la imagen de Firebase: {str(e)}"}), 500
 
 
 @app.route('/admin/treatments', methods=['POST'])
 @admin_required
+@db_route("admin", 1)
 def add_treatment(current_user_id):
     data = request.get_json()
     id_enfermedad = data.get('id_enfermedad')
@@ -817,19 +1323,11 @@ def add_treatment(current_user_id):
         return jsonify({"error": "Faltan datos requeridos"}), 400
 
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cur.execute(
-            """
-            INSERT INTO tratamientos (id_enfermedad, nombre_comercial, ingrediente_activo, tipo_tratamiento, dosis, frecuencia_aplicacion, notas_adicionales)
-            VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING *;
-            """,
-            (id_enfermedad, nombre_comercial, ingrediente_activo, tipo_tratamiento, dosis, frecuencia_aplicacion, notas_adicionales)
-        )
-        new_treatment = cur.fetchone()
-        conn.commit()
-        cur.close()
-        conn.close()
+        with transaction() as cur:
+            new_treatment = repository.create_treatment(
+                cur, id_enfermedad, nombre_comercial, ingrediente_activo, tipo_tratamiento, dosis,
+                frecuencia_aplicacion, notas_adicionales
+            )
         return jsonify(dict(new_treatment)), 201
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -837,34 +1335,18 @@ def add_treatment(current_user_id):
 
 @app.route('/admin/treatments/<int:treatment_id>', methods=['PUT'])
 @admin_required
+@db_route("admin", 1)
 def update_treatment(current_user_id, treatment_id):
     data = request.get_json()
 
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cur.execute(
-            """
-            UPDATE tratamientos SET
-                nombre_comercial = %s,
-                ingrediente_activo = %s,
-                tipo_tratamiento = %s,
-                dosis = %s,
-                frecuencia_aplicacion = %s,
-                notas_adicionales = %s
-            WHERE id_tratamiento = %s RETURNING *;
-            """,
-            (
+        with transaction() as cur:
+            updated_treatment = repository.update_treatment(
+                cur, treatment_id,
                 data.get('nombre_comercial'), data.get('ingrediente_activo'),
                 data.get('tipo_tratamiento'), data.get('dosis'),
-                data.get('frecuencia_aplicacion'), data.get('notas_adicionales'),
-                treatment_id
+                data.get('frecuencia_aplicacion'), data.get('notas_adicionales')
             )
-        )
-        updated_treatment = cur.fetchone()
-        conn.commit()
-        cur.close()
-        conn.close()
         if updated_treatment:
             return jsonify(dict(updated_treatment)), 200
         return jsonify({"error": "Tratamiento no encontrado"}), 404
@@ -874,43 +1356,28 @@ def update_treatment(current_user_id, treatment_id):
 
 @app.route('/admin/treatments/<int:treatment_id>', methods=['DELETE'])
 @admin_required
+@db_route("admin", 1)
 def delete_treatment(current_user_id, treatment_id):
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("DELETE FROM tratamientos WHERE id_tratamiento = %s", (treatment_id,))
-        conn.commit()
+        with transaction() as cur:
+            deleted = repository.delete_treatment(cur, treatment_id)
 
-        if cur.rowcount == 0:
-            cur.close()
-            conn.close()
+        if not deleted:
             return jsonify({"error": "Tratamiento no encontrado"}), 404
 
-        cur.close()
-        conn.close()
         return jsonify({"message": "Tratamiento eliminado exitosamente"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-
 @app.route('/admin/analyses', methods=['GET'])
 @admin_required
+@db_route("admin", 1)
 def get_all_analyses(current_user_id):
+    # ?duplicados=true devuelve solo los análisis marcados como duplicados
+    only_duplicates = request.args.get('duplicados', '').lower() in ('1', 'true')
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cur.execute(
-            """
-            SELECT a.*, u.email 
-            FROM analisis a
-            JOIN usuarios u ON a.id_usuario = u.id_usuario
-            WHERE a.fecha_eliminado IS NULL
-            ORDER BY a.fecha_analisis DESC
-            """
-        )
-        analyses = cur.fetchall()
-        cur.close()
-        conn.close()
+        with reading(current_user_id) as cur:
+            analyses = repository.all_analyses(cur, only_duplicates)
 
         result = []
         for row in analyses:
@@ -923,24 +1390,30 @@ def get_all_analyses(current_user_id):
         return jsonify({"error": str(e)}), 500
     
 
+@app.route('/admin/summary', methods=['GET'])
+@admin_required
+@db_route("admin", 1)
+def get_admin_summary(current_user_id):
+    """
+    Totales del panel (usuarios, análisis activos y en la papelera, recuento
+    por clase, actividad reciente e imágenes en Storage) sin descargar los
+    listados completos. Puede tener hasta ADMIN_SUMMARY_TTL segundos de
+    antigüedad (más lo que tarde en recalcularse); `edad_s` la indica.
+    """
+    try:
+        summary, age = admin_summary_cache.get()
+        return jsonify({**summary, "edad_s": round(age, 1)}), 200
+    except Exception as e:
+        return jsonify({"error": f"No se pudo obtener el resumen: {str(e)}"}), 500
+
+
 @app.route('/admin/users_with_analyses', methods=['GET'])
 @admin_required
+@db_route("admin", 1)
 def get_users_with_analyses(current_user_id):
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cur.execute(
-            """
-            SELECT DISTINCT ON (u.id_usuario) u.id_usuario, u.nombre_completo, u.email, u.profile_image_url,
-            (SELECT COUNT(*) FROM analisis a WHERE a.id_usuario = u.id_usuario AND a.fecha_eliminado IS NULL) as analysis_count
-            FROM usuarios u
-            LEFT JOIN analisis a ON u.id_usuario = a.id_usuario
-            ORDER BY u.id_usuario;
-            """
-        )
-        users = cur.fetchall()
-        cur.close()
-        conn.close()
+        with reading(current_user_id) as cur:
+            users = repository.users_with_analysis_count(cur)
         return jsonify([dict(row) for row in users]), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -948,22 +1421,11 @@ def get_users_with_analyses(current_user_id):
 
 @app.route('/admin/analyses/user/<int:user_id>', methods=['GET'])
 @admin_required
+@db_route("admin", 1)
 def get_analyses_for_user(current_user_id, user_id):
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cur.execute(
-            """
-            SELECT a.*, u.email 
-            FROM analisis a
-            JOIN usuarios u ON a.id_usuario = u.id_usuario
-            WHERE a.id_usuario = %s AND a.fecha_eliminado IS NULL
-            ORDER BY a.fecha_analisis DESC
-            """, (user_id,)
-        )
-        analyses = cur.fetchall()
-        cur.close()
-        conn.close()
+        with reading(current_user_id) as cur:
+            analyses = repository.user_analyses(cur, user_id)
 
         result = []
         for row in analyses:
@@ -977,88 +1439,103 @@ def get_analyses_for_user(current_user_id, user_id):
     
  
 
+@app.route('/admin/search', methods=['GET'])
+@admin_required
+@db_route("admin", 1)
+def admin_search(current_user_id):
+    """
+    Búsqueda en el servidor para las pantallas de administración.
+    Parámetros: q (texto, mínimo 2 caracteres), tipo ('analisis' o
+    'usuarios'), pagina, por_pagina y, opcionalmente, id_usuario para buscar
+    solo entre los análisis de un usuario. Los resultados se ordenan por
+    relevancia (texto completo + similitud de trigramas).
+    """
+    text = (request.args.get('q') or '').strip()
+    tipo = request.args.get('tipo', 'analisis')
+    if len(text) < 2:
+        return jsonify({"error": "La búsqueda necesita al menos 2 caracteres"}), 400
+    if tipo not in SEARCH_QUERIES:
+        return jsonify({"error": "Tipo no válido. Usa 'analisis' o 'usuarios'."}), 400
+    try:
+        page = max(1, int(request.args.get('pagina', 1)))
+        page_size = min(max(1, int(request.args.get('por_pagina', 20))), app.config['SEARCH_MAX_PAGE_SIZE'])
+        id_usuario = request.args.get('id_usuario', type=int)
+    except ValueError:
+        return jsonify({"error": "'pagina' y 'por_pagina' deben ser números enteros"}), 400
+
+    try:
+        with transaction(cursor_factory=RealDictCursor) as cur:
+            rows = repository.search(
+                cur, tipo, search_params(text, page, page_size, id_usuario, app.config['SEARCH_MAX_USER_MATCHES'])
+            )
+
+        total = rows[0]['total'] if rows else 0
+        results = []
+        for row in rows:
+            row = dict(row)
+            row.pop('total')
+            row['puntuacion'] = round(float(row['puntuacion']), 4)
+            for field in ('fecha_analisis', 'fecha_eliminado'):
+                if row.get(field):
+                    row[field] = row[field].isoformat()
+            results.append(row)
+
+        return jsonify({
+            "consulta": text,
+            "tipo": tipo,
+            "pagina": page,
+            "por_pagina": page_size,
+            "total": total,
+            "resultados": results,
+        }), 200
+    except Exception as e:
+        return jsonify({"error": f"Ocurrió un error en la búsqueda: {str(e)}"}), 500
+
+
 @app.route('/api/enfermedades', methods=['GET'])
 @token_required
+@db_route("lectura", 1)
 def get_enfermedades(current_user_id):
     """
     Endpoint para obtener todas las enfermedades de la base de datos.
     Ahora devuelve una lista completa de datos para la Guía de Tratamientos.
     """
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        
-        cur.execute("""
-            SELECT 
-                id_enfermedad as id, 
-                nombre_comun, 
-                roboflow_class,
-                imagen_url,
-                tipo,
-                prevencion,
-                riesgo
-            FROM enfermedades 
-            ORDER BY nombre_comun ASC
-        """)
-        
-        enfermedades = cur.fetchall()
-        cur.close()
-        conn.close()
+        with reading(current_user_id, cursor_factory=RealDictCursor) as cur:
+            enfermedades = repository.disease_guide(cur)
 
         return jsonify(enfermedades)
     except Exception as e:
-        print(f"Error al obtener enfermedades: {e}")
+        log.exception("Error al obtener enfermedades: %s", e)
         return jsonify({'error': 'Error interno al obtener las enfermedades.'}), 500
 
 
 @app.route('/api/tratamientos/<int:enfermedad_id>', methods=['GET'])
 @token_required
+@db_route("lectura", 1)
 def get_tratamientos_por_enfermedad(current_user_id, enfermedad_id):
     """
     Endpoint para obtener los tratamientos para una enfermedad específica.
     Recibe el ID de la enfermedad como parámetro en la URL.
     """
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        cur.execute("""
-            SELECT 
-                id_tratamiento as id, 
-                nombre_comercial, 
-                ingrediente_activo, 
-                tipo_tratamiento,
-                COALESCE(dosis_valor, 0.0) as dosis, -- <-- ¡CORRECCIÓN! Si es NULL, devuelve 0.0
-                COALESCE(dosis_unidad, '') as unidad_medida, -- <-- ¡CORRECCIÓN! Si es NULL, devuelve ''
-                CAST(NULL AS TEXT) as periodo_carencia
-            FROM tratamientos 
-            WHERE id_enfermedad = %s
-            ORDER BY nombre_comercial ASC
-        """, (enfermedad_id,))
-        
-        tratamientos = cur.fetchall()
-        cur.close()
-        conn.close()
+        with transaction(cursor_factory=RealDictCursor) as cur:
+            tratamientos = repository.treatment_guide(cur, enfermedad_id)
 
         return jsonify(tratamientos)
     except Exception as e:
-        print(f"Error al obtener tratamientos: {e}")
+        log.exception("Error al obtener tratamientos: %s", e)
         return jsonify({'error': 'Error interno al obtener los tratamientos.'}), 500
     
     
 @app.route('/profile', methods=['GET'])
 @token_required
+@db_route("lectura", 1)
 def get_profile(current_user_id):
     """Obtiene los datos del perfil del usuario logueado."""
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cur.execute(
-            "SELECT nombre_completo, email, ong, profile_image_url FROM usuarios WHERE id_usuario = %s",
-            (current_user_id,)
-        )
-        user = cur.fetchone()
-        cur.close()
-        conn.close()
+        with reading(current_user_id) as cur:
+            user = repository.profile(cur, current_user_id)
 
         if user is None:
             return jsonify({"error": "Usuario no encontrado"}), 404
@@ -1070,6 +1547,7 @@ def get_profile(current_user_id):
 
 @app.route('/profile/update', methods=['PUT'])
 @token_required
+@db_route("escritura", 1)
 def update_profile(current_user_id):
     """Actualiza el nombre y/o la foto de perfil del usuario."""
     data = request.get_json()
@@ -1080,28 +1558,9 @@ def update_profile(current_user_id):
         return jsonify({"error": "No hay datos para actualizar"}), 400
 
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        query_parts = []
-        params = []
-        if nombre_completo:
-            query_parts.append("nombre_completo = %s")
-            params.append(nombre_completo)
-        
-        if profile_image_url:
-            query_parts.append("profile_image_url = %s")
-            params.append(profile_image_url)
-
-        params.append(current_user_id)
-        
-        # Unir las partes de la consulta
-        query = f"UPDATE usuarios SET {', '.join(query_parts)} WHERE id_usuario = %s"
-        
-        cur.execute(query, tuple(params))
-
-        conn.commit()
-        cur.close()
-        conn.close()
+        # Los campos vacíos se dejan como están
+        with transaction(current_user_id) as cur:
+            repository.update_profile(cur, current_user_id, nombre_completo or None, profile_image_url or None)
         return jsonify({"message": "Perfil actualizado exitosamente"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -1109,6 +1568,7 @@ def update_profile(current_user_id):
 
 @app.route('/profile/change-password', methods=['POST'])
 @token_required
+@db_route("escritura", 2)
 def change_password(current_user_id):
     """Cambia la contraseña del usuario."""
     data = request.get_json()
@@ -1119,29 +1579,18 @@ def change_password(current_user_id):
         return jsonify({"error": "Faltan datos"}), 400
 
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cur.execute("SELECT password_hash FROM usuarios WHERE id_usuario = %s", (current_user_id,))
-        user = cur.fetchone()
+        with transaction() as cur:
+            user = repository.password_hash(cur, current_user_id)
         
         if not user:
-            cur.close()
-            conn.close()
             return jsonify({"error": "Usuario no encontrado"}), 404
             
         if not bcrypt.checkpw(current_password.encode('utf-8'), user['password_hash'].encode('utf-8')):
-            cur.close()
-            conn.close()
             return jsonify({"error": "La contraseña actual es incorrecta"}), 401
         
         new_hashed_password = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt())
-        cur.execute(
-            "UPDATE usuarios SET password_hash = %s WHERE id_usuario = %s",
-            (new_hashed_password.decode('utf-8'), current_user_id)
-        )
-        conn.commit()
-        cur.close()
-        conn.close()
+        with transaction() as cur:
+            repository.set_password_hash(cur, current_user_id, new_hashed_password.decode('utf-8'))
         
         return jsonify({"message": "Contraseña actualizada exitosamente"}), 200
     except Exception as e:
@@ -1150,6 +1599,7 @@ def change_password(current_user_id):
 
 @app.route('/admin/user/<int:user_id>', methods=['DELETE'])
 @admin_required
+@db_route("admin", 2)
 def admin_delete_user(current_user_id, user_id):
     """
     Permite a un administrador eliminar permanentemente a un usuario,
@@ -1158,84 +1608,32 @@ def admin_delete_user(current_user_id, user_id):
     if current_user_id == user_id:
         return jsonify({"error": "Un administrador no puede eliminarse a sí mismo."}), 403
 
-    conn = None
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor) 
-        cur.execute(
-            "SELECT url_imagen, url_imagen_reverso FROM analisis WHERE id_usuario = %s",
-            (user_id,)
-        )
-        analysis_images = cur.fetchall()
-        
-        #  Obtener la URL de la imagen de perfil del usuario
-        cur.execute(
-            "SELECT profile_image_url FROM usuarios WHERE id_usuario = %s",
-            (user_id,)
-        )
-        user_profile = cur.fetchone()
-
-        # Comprobar si el usuario a eliminar es un admin
-        cur.execute("SELECT es_admin FROM usuarios WHERE id_usuario = %s", (user_id,))
-        user_to_delete_is_admin = cur.fetchone()
-
-        if user_to_delete_is_admin and user_to_delete_is_admin['es_admin']:
-             cur.close()
-             conn.close()
-             return jsonify({"error": "No se puede eliminar a otro administrador."}), 403
+        with transaction(current_user_id) as cur:
+            result = repository.delete_user_with_data(cur, user_id, allow_admin=False)
 
+            if result['es_admin']:
+                cur.connection.rollback()
+                return jsonify({"error": "No se puede eliminar a otro administrador."}), 403
 
-        urls_to_delete = []
-        if user_profile and user_profile['profile_image_url']:
-            urls_to_delete.append(user_profile['profile_image_url'])
-        
-        for item in analysis_images:
-            if item['url_imagen']:
-                urls_to_delete.append(item['url_imagen'])
-            if item['url_imagen_reverso']:
-                urls_to_delete.append(item['url_imagen_reverso'])
-        cur.execute("DELETE FROM analisis WHERE id_usuario = %s", (user_id,))
-        cur.execute("DELETE FROM usuarios WHERE id_usuario = %s", (user_id,))
-        
-        if cur.rowcount == 0:
-            cur.close()
-            conn.close()
-            return jsonify({"error": "Usuario no encontrado"}), 404
-        conn.commit()
-
+            if not result['borrado']:
+                cur.connection.rollback()
+                return jsonify({"error": "Usuario no encontrado"}), 404
+            urls_to_delete = unreferenced_urls(cur, result['urls'])
 
+        # El borrado en Storage se hace en bloque, ya fuera de la transacción
         if urls_to_delete:
-            print(f"Iniciando borrado de {len(urls_to_delete)} imágenes de Firebase para el usuario {user_id}.")
-            bucket = storage.bucket()
-            for image_url in urls_to_delete:
-                if image_url:
-                    try:
-                        path_part = image_url.split('?')[0]
-                        file_path = path_part.split('/o/')[-1].replace('%2F', '/')
-                        
-                        blob = bucket.blob(file_path)
-                        if blob.exists():
-                            blob.delete()
-                            print(f"Imagen {file_path} borrada de Firebase Storage.")
-                        else:
-                            print(f"ADVERTENCIA: Se intentó borrar {file_path} pero no se encontró en Firebase.")
-                    except Exception as e:
-                        print(f"ADVERTENCIA: No se pudo borrar la imagen {image_url} de Firebase: {e}")
-        
-        cur.close()
-        conn.close()
+            log.info("Iniciando borrado de %s imágenes de Firebase para el usuario %s.", len(urls_to_delete), user_id)
+            delete_images(urls_to_delete)
         
         return jsonify({"message": "Usuario y todos sus datos han sido eliminados exitosamente"}), 200
 
     except Exception as e:
-        if conn:
-            conn.rollback() 
-            cur.close()
-            conn.close()
         return jsonify({"error": f"Ocurrió un error al eliminar el usuario: {str(e)}"}), 500
 
 @app.route('/admin/user/<int:user_id>/reset-password', methods=['PUT'])
 @admin_required
+@db_route("admin", 1)
 def admin_reset_password(current_user_id, user_id):
     """
     Permite a un administrador restablecer la contraseña de cualquier usuario.
@@ -1247,27 +1645,16 @@ def admin_reset_password(current_user_id, user_id):
         return jsonify({"error": "Se requiere la nueva contraseña"}), 400
 
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
         # Encriptamos la nueva contraseña
         new_hashed_password = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt())
         
         # Actualizamos la contraseña en la base de datos
-        cur.execute(
-            "UPDATE usuarios SET password_hash = %s WHERE id_usuario = %s",
-            (new_hashed_password.decode('utf-8'), user_id)
-        )
+        with transaction() as cur:
+            updated = repository.set_password_hash(cur, user_id, new_hashed_password.decode('utf-8'))
         
         # Verificamos si se actualizó alguna fila
-        if cur.rowcount == 0:
-            cur.close()
-            conn.close()
+        if not updated:
             return jsonify({"error": "Usuario no encontrado"}), 404
-            
-        conn.commit()
-        cur.close()
-        conn.close()
         
         return jsonify({"message": "Contraseña del usuario actualizada exitosamente"}), 200
 
@@ -1278,6 +1665,7 @@ def admin_reset_password(current_user_id, user_id):
 
 @app.route('/profile/delete', methods=['POST'])
 @token_required
+@db_route("escritura", 3)
 def delete_current_user(current_user_id):
     """
     Permite a un usuario eliminar su propia cuenta permanentemente.
@@ -1289,94 +1677,163 @@ def delete_current_user(current_user_id):
     if not current_password:
         return jsonify({"error": "Se requiere la contraseña actual para confirmar"}), 400
 
-    conn = None
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-
-        cur.execute("SELECT password_hash FROM usuarios WHERE id_usuario = %s", (current_user_id,))
-        user = cur.fetchone()
-        
-        if not user or not bcrypt.checkpw(current_password.encode('utf-8'), user['password_hash'].encode('utf-8')):
-            return jsonify({"error": "La contraseña actual es incorrecta"}), 401
-
-        cur.execute("SELECT url_imagen, url_imagen_reverso FROM analisis WHERE id_usuario = %s", (current_user_id,))
-        analysis_images = cur.fetchall()
-        
-        cur.execute("SELECT profile_image_url FROM usuarios WHERE id_usuario = %s", (current_user_id,))
-        user_profile = cur.fetchone()
+        with transaction() as cur:
+            user = repository.password_hash(cur, current_user_id)
+            
+            if not user or not bcrypt.checkpw(current_password.encode('utf-8'), user['password_hash'].encode('utf-8')):
+                return jsonify({"error": "La contraseña actual es incorrecta"}), 401
 
-        urls_to_delete = []
-        if user_profile and user_profile['profile_image_url']:
-            urls_to_delete.append(user_profile['profile_image_url'])
-        
-        for item in analysis_images:
-            if item['url_imagen']:
-                urls_to_delete.append(item['url_imagen'])
-            if item['url_imagen_reverso']:
-                urls_to_delete.append(item['url_imagen_reverso'])
-        cur.execute("DELETE FROM analisis WHERE id_usuario = %s", (current_user_id,))
-        cur.execute("DELETE FROM usuarios WHERE id_usuario = %s", (current_user_id,))
-        
-        conn.commit() 
+            result = repository.delete_user_with_data(cur, current_user_id, allow_admin=True)
+            urls_to_delete = unreferenced_urls(cur, result['urls'])
 
         if urls_to_delete:
-            bucket = storage.bucket()
-            for image_url in urls_to_delete:
-                if image_url:
-                    try:
-                        path_part = image_url.split('?')[0]
-                        file_path = path_part.split('/o/')[-1].replace('%2F', '/')
-                        blob = bucket.blob(file_path)
-                        if blob.exists():
-                            blob.delete()
-                    except Exception as e:
-                        print(f"ADVERTENCIA: No se pudo borrar la imagen {image_url} de Firebase: {e}")
+            delete_images(urls_to_delete)
 
-        cur.close()
-        conn.close()
-        
         return jsonify({"message": "Tu cuenta y todos tus datos han sido eliminados"}), 200
 
     except Exception as e:
-        if conn:
-            conn.rollback()
         return jsonify({"error": f"Ocurrió un error al eliminar la cuenta: {str(e)}"}), 500
-    finally:
-        if conn and not conn.closed:
-            cur.close()
-            conn.close()
 
 
 @app.route('/history/trash/restore-all', methods=['PUT'])
 @token_required
+@db_route("escritura", 1)
 def restore_all_trash(current_user_id):
     """
     Restaura todos los análisis de la papelera del usuario logueado.
     """
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-
-
-        cur.execute(
-            "UPDATE analisis SET fecha_eliminado = NULL WHERE id_usuario = %s AND fecha_eliminado IS NOT NULL",
-            (current_user_id,)
-        )
-        conn.commit()
-
-        restored_count = cur.rowcount
-        
-        cur.close()
-        conn.close()
+        with transaction(current_user_id) as cur:
+            restored_count = repository.restore_all(cur, current_user_id)
 
         return jsonify({"message": f"{restored_count} análisis han sido restaurados exitosamente"}), 200
 
     except Exception as e:
-        if 'conn' in locals() and conn:
-            cur.close()
-            conn.close()
         return jsonify({"error": f"Ocurrió un error al restaurar la papelera: {str(e)}"}), 500
 
+@app.route('/admin/metrics', methods=['GET'])
+@admin_required
+def get_metrics(current_user_id):
+    """
+    Devuelve las métricas en memoria del worker que atiende la petición
+    (reutilización de conexiones HTTP, tiempos de descarga e inferencia, etc.)
+    y el estado de las réplicas de lectura que conoce.
+    """
+    snapshot = metrics.snapshot()
+    snapshot["replicas"] = repository.router.status()
+    return jsonify(snapshot), 200
+
+@app.route('/admin/profile/stacks', methods=['GET'])
+@admin_required
+def profile_stacks(current_user_id):
+    """
+    Muestrea las pilas de todos los hilos del worker durante `segundos`
+    (cada `intervalo_ms`) y las devuelve en formato "collapsed", listo para
+    flamegraph.pl o speedscope. La petición espera a que acabe el muestreo.
+    """
+    try:
+        seconds = float(request.args.get('segundos', 10))
+        interval_ms = float(request.args.get('intervalo_ms', 10))
+    except ValueError:
+        return jsonify({"error": "segundos e intervalo_ms deben ser números"}), 400
+    if not 0 < seconds <= Config.PROFILE_MAX_SECONDS or not 1 <= interval_ms <= 1000:
+        return jsonify({
+            "error": f"segundos debe estar entre 0 y {Config.PROFILE_MAX_SECONDS:g} e intervalo_ms entre 1 y 1000"
+        }), 400
+
+    stacks = profiling.sample_stacks(seconds, interval_ms / 1000)
+    if stacks is None:
+        return jsonify({"error": "Ya hay un muestreo en curso en este worker"}), 409
+    response = app.response_class(profiling.collapsed(stacks), mimetype='text/plain')
+    response.headers['X-Worker-PID'] = str(os.getpid())
+    return response
+
+@app.route('/admin/profile/requests', methods=['GET', 'PUT'])
+@admin_required
+def profile_requests(current_user_id):
+    """
+    GET devuelve los últimos perfiles de cProfile de este worker. PUT cambia
+    la fracción de peticiones perfiladas (`tasa`, 0 las desactiva) y,
+    opcionalmente, limita el perfilado a un `endpoint` (p. ej. analyze_image).
+    """
+    if request.method == 'PUT':
+        data = request.get_json() or {}
+        try:
+            rate = float(data.get('tasa', 0))
+        except (TypeError, ValueError):
+            return jsonify({"error": "tasa debe ser un número entre 0 y 1"}), 400
+        endpoint = data.get('endpoint')
+        if endpoint and endpoint not in app.view_functions:
+            return jsonify({"error": f"El endpoint '{endpoint}' no existe"}), 400
+        request_profiler.configure(rate, endpoint)
+
+    return jsonify({
+        "pid": os.getpid(),
+        "tasa": request_profiler.rate,
+        "endpoint": request_profiler.endpoint,
+        "perfiles": list(request_profiler.results),
+    }), 200
+
+@app.route('/admin/profile/memory', methods=['GET', 'POST', 'DELETE'])
+@admin_required
+def profile_memory(current_user_id):
+    """
+    POST arranca tracemalloc y toma la instantánea base; GET devuelve las
+    pilas de asignación que más han crecido desde entonces (`archivo` filtra
+    por un módulo, p. ej. storage_utils.py para la descarga de imágenes);
+    DELETE lo detiene. Mientras está activo, cada asignación es más lenta.
+    """
+    if request.method == 'POST':
+        memory_tracer.start(Config.PROFILE_TRACEMALLOC_FRAMES)
+        return jsonify({"pid": os.getpid(), "activo": True}), 201
+    if request.method == 'DELETE':
+        memory_tracer.stop()
+        return jsonify({"pid": os.getpid(), "activo": False}), 200
+
+    try:
+        limit = int(request.args.get('limite', 20))
+    except ValueError:
+        return jsonify({"error": "limite debe ser un número entero"}), 400
+    result = memory_tracer.snapshot(limit, request.args.get('archivo'))
+    if result is None:
+        return jsonify({"error": "tracemalloc no está activo en este worker (POST para arrancarlo)"}), 409
+    result["pid"] = os.getpid()
+    return jsonify(result), 200
+
+@app.route('/health', methods=['GET'])
+@db_route("salud", 1)
+def health_check():
+    """
+    Comprobación de disponibilidad para el balanceador. Responde 503 si la
+    base de datos no contesta, ya que sin ella no funciona ninguna ruta. Si
+    el circuito de Roboflow o de Storage está abierto, el worker sigue
+    disponible (el historial funciona) y se informa como "degradado".
+    """
+    checks = {}
+    start = time.perf_counter()
+    try:
+        with transaction() as cur:
+            repository.ping(cur)
+        checks["base_de_datos"] = {"estado": "ok", "latencia_ms": round((time.perf_counter() - start) * 1000, 1)}
+    except Exception:
+        # Ruta sin autenticar: el mensaje del driver (host, usuario, base de
+        # datos) solo va al log
+        log.exception("La comprobación de salud no pudo consultar la base de datos")
+        checks["base_de_datos"] = {"estado": "error", "detalle": "La base de datos no responde"}
+
+    checks["inferencia"] = {"estado": inference_breaker.state, "en_curso": inference_limiter.inflight}
+    checks["almacenamiento"] = {"estado": storage_breaker.state}
+
+    if checks["base_de_datos"]["estado"] != "ok":
+        status = "error"
+    elif inference_breaker.is_open() or storage_breaker.is_open():
+        status = "degradado"
+    else:
+        status = "ok"
+
+    return jsonify({"estado": status, "pid": os.getpid(), "comprobaciones": checks}), 503 if status == "error" else 200
+
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5001, debug=True)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=Config.PORT, debug=True)
\ No newline at end of file
@@ -0,0 +1,134 @@
+# backend/backfill_hashes.py
+
+import argparse
+from datetime import datetime
+from multiprocessing import Pool
+import psycopg2
+import psycopg2.extras
+from config import Config
+from storage_utils import init_firebase, download_image
+from image_hash import BKTree, content_hash, perceptual_hash, register_images
+
+
+def _init_worker():
+    # Cada proceso necesita su propia app de Firebase y su propia conexión
+    init_firebase()
+
+
+def _process_chunk(rows):
+    """Calcula los hashes de un bloque de análisis. Devuelve (ok, fallidos)."""
+    ok, failed = 0, 0
+    conn = psycopg2.connect(Config.DATABASE_URI)
+    try:
+        cur = conn.cursor()
+        for id_analisis, url_imagen in rows:
+            try:
+                image_bytes = download_image(url_imagen)
+                image_hash = content_hash(image_bytes)
+                cur.execute(
+                    "UPDATE analisis SET hash_contenido = %s, phash = %s WHERE id_analisis = %s",
+                    (image_hash, perceptual_hash(image_bytes), id_analisis)
+                )
+                # Sin predicción: la guardada en analisis es la combinada de frente y reverso
+                register_images(cur, [(image_hash, url_imagen, None, None, None, None)])
+                conn.commit()
+                ok += 1
+            except Exception as e:
+                conn.rollback()
+                failed += 1
+                print(f"  - ERROR en el análisis {id_analisis}: {e}")
+        cur.close()
+    finally:
+        conn.close()
+    return ok, failed
+
+
+def flag_duplicates(conn, max_distance):
+    """
+    Recorre los análisis en orden de creación y marca cada uno como duplicado
+    del primer análisis anterior con una imagen parecida.
+    """
+    tree = BKTree()
+    updates = []
+    cur = conn.cursor(name="analisis_hashes")
+    cur.itersize = 5000
+    cur.execute(
+        "SELECT id_analisis, phash, duplicado_de FROM analisis WHERE phash IS NOT NULL ORDER BY id_analisis"
+    )
+    original_of = {}
+    for id_analisis, phash, duplicado_de in cur:
+        matches = tree.search(phash, max_distance)
+        original = original_of[matches[0][1]] if matches else None
+        original_of[id_analisis] = original or id_analisis
+        tree.add(phash, id_analisis)
+        if original != duplicado_de:
+            updates.append((id_analisis, original))
+    cur.close()
+
+    cur = conn.cursor()
+    psycopg2.extras.execute_values(
+        cur,
+        """
+        UPDATE analisis a SET duplicado_de = v.duplicado_de
+        FROM (VALUES %s) AS v (id_analisis, duplicado_de)
+        WHERE a.id_analisis = v.id_analisis
+        """,
+        updates,
+        template="(%s::int, %s::int)",
+        page_size=1000
+    )
+    conn.commit()
+    cur.close()
+    return len(updates)
+
+
+def backfill_hashes(workers, chunk_size):
+    """
+    Calcula el hash de contenido y el perceptual de los análisis que aún no
+    los tienen y después marca los duplicados. Es reanudable: solo procesa
+    filas con phash en NULL.
+    """
+    print(f"--- Iniciando backfill de hashes - {datetime.utcnow()} UTC ---")
+    conn = psycopg2.connect(Config.DATABASE_URI)
+    cur = conn.cursor()
+    last_id = 0
+    total_ok, total_failed = 0, 0
+
+    try:
+        with Pool(processes=workers, initializer=_init_worker) as pool:
+            while True:
+                cur.execute(
+                    """
+                    SELECT id_analisis, url_imagen
+                    FROM analisis
+                    WHERE phash IS NULL AND url_imagen IS NOT NULL AND id_analisis > %s
+                    ORDER BY id_analisis
+                    LIMIT %s
+                    """,
+                    (last_id, chunk_size * workers)
+                )
+                rows = cur.fetchall()
+                if not rows:
+                    break
+
+                last_id = rows[-1][0]
+                chunks = [rows[i:i + chunk_size] for i in range(0, len(rows), chunk_size)]
+                for ok, failed in pool.imap_unordered(_process_chunk, chunks):
+                    total_ok += ok
+                    total_failed += failed
+                print(f"Procesados hasta el análisis {last_id}: {total_ok} correctos, {total_failed} fallidos.")
+
+        updated = flag_duplicates(conn, Config.DUPLICATE_MAX_DISTANCE)
+        print(f"Marcas de duplicado actualizadas en {updated} análisis.")
+    finally:
+        cur.close()
+        conn.close()
+        print("--- Backfill de hashes finalizado ---")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Indexa los análisis existentes para detectar imágenes duplicadas.")
+    parser.add_argument('--workers', type=int, default=Config.BACKFILL_WORKERS)
+    parser.add_argument('--chunk-size', type=int, default=20)
+    args = parser.parse_args()
+    backfill_hashes(args.workers, args.chunk_size)
@@ -0,0 +1,82 @@
+# backend/backfill_variants.py
+
+import argparse
+from datetime import datetime
+from multiprocessing import Pool
+import psycopg2
+import psycopg2.extras
+from config import Config
+from storage_utils import init_firebase
+from image_variants import store_analysis_variants
+
+
+def _init_worker():
+    # Cada proceso necesita su propia app de Firebase y su propia conexión
+    init_firebase()
+
+
+def _process_chunk(rows):
+    """Genera las variantes de un bloque de análisis. Devuelve (ok, fallidos)."""
+    ok, failed = 0, 0
+    conn = psycopg2.connect(Config.DATABASE_URI)
+    try:
+        for id_analisis, url_imagen, url_imagen_reverso in rows:
+            try:
+                store_analysis_variants(conn, id_analisis, url_imagen, url_imagen_reverso)
+                ok += 1
+            except Exception as e:
+                conn.rollback()
+                failed += 1
+                print(f"  - ERROR en el análisis {id_analisis}: {e}")
+    finally:
+        conn.close()
+    return ok, failed
+
+
+def backfill_variants(workers, chunk_size):
+    """
+    Genera miniaturas y variantes medianas para los análisis que aún no las
+    tienen. Es reanudable: solo procesa filas con url_miniatura en NULL, así
+    que puede interrumpirse y volver a lanzarse sin repetir trabajo.
+    """
+    print(f"--- Iniciando backfill de variantes - {datetime.utcnow()} UTC ---")
+    conn = psycopg2.connect(Config.DATABASE_URI)
+    cur = conn.cursor()
+    last_id = 0
+    total_ok, total_failed = 0, 0
+
+    try:
+        with Pool(processes=workers, initializer=_init_worker) as pool:
+            while True:
+                cur.execute(
+                    """
+                    SELECT id_analisis, url_imagen, url_imagen_reverso
+                    FROM analisis
+                    WHERE url_miniatura IS NULL AND url_imagen IS NOT NULL AND id_analisis > %s
+                    ORDER BY id_analisis
+                    LIMIT %s
+                    """,
+                    (last_id, chunk_size * workers)
+                )
+                rows = cur.fetchall()
+                if not rows:
+                    break
+
+                last_id = rows[-1][0]
+                chunks = [rows[i:i + chunk_size] for i in range(0, len(rows), chunk_size)]
+                for ok, failed in pool.imap_unordered(_process_chunk, chunks):
+                    total_ok += ok
+                    total_failed += failed
+                print(f"Procesados hasta el análisis {last_id}: {total_ok} correctos, {total_failed} fallidos.")
+    finally:
+        cur.close()
+        conn.close()
+        print("--- Backfill de variantes finalizado ---")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Genera las variantes WebP de los análisis existentes.")
+    parser.add_argument('--workers', type=int, default=Config.BACKFILL_WORKERS)
+    parser.add_argument('--chunk-size', type=int, default=20)
+    args = parser.parse_args()
+    backfill_variants(args.workers, args.chunk_size)
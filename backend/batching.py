@@ -0,0 +1,127 @@
+# backend/batching.py
+
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+import metrics
+
+log = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """
+    Agrupa las llamadas que llegan a la vez en un mismo worker. submit()
+    encola un elemento y devuelve un Future; un hilo despachador espera al
+    primero, junta los que lleguen en los `window_seconds` siguientes (hasta
+    `max_batch_size`) y pasa el lote a `run_batch`, que debe devolver un
+    resultado por elemento y en el mismo orden. Hasta `concurrency` lotes se
+    ejecutan a la vez en un pool propio: nunca en io_executor, cuyos hilos
+    son los que esperan los resultados.
+
+    Un elemento que falla dentro del lote puede devolverse como una
+    instancia de Exception: solo su Future recibe el error. Si es el lote
+    entero el que falla y `retry_individually(error)` es cierto (p. ej. el
+    servidor rechazó una imagen dañada), cada elemento se reintenta solo
+    para que el error no arrastre a los demás. Los Future cancelados antes
+    de que empiece su lote (quien esperaba se cansó) no se envían.
+
+    El despachador se arranca en cada proceso la primera vez que se usa, así
+    que sobrevive al fork de los workers de gunicorn.
+    """
+
+    def __init__(self, name, run_batch, max_batch_size, window_seconds, concurrency=1, retry_individually=None):
+        self.name = name
+        self.max_batch_size = max_batch_size
+        self.window_seconds = window_seconds
+        self._run_batch = run_batch
+        self._retry_individually = retry_individually
+        self._concurrency = concurrency
+        self._start_lock = threading.Lock()
+        self._pid = None
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            self._executor = ThreadPoolExecutor(max_workers=self._concurrency, thread_name_prefix=f"lote-{self.name}")
+            # Un lote no se forma mientras todos los hilos del pool están ocupados:
+            # así los elementos que llegan mientras tanto van en el siguiente lote
+            self._slots = threading.BoundedSemaphore(self._concurrency)
+            threading.Thread(target=self._dispatch, name=f"lotes-{self.name}", daemon=True).start()
+            self._pid = os.getpid()
+
+    def submit(self, item):
+        self._ensure_started()
+        future = Future()
+        self._queue.put((item, future, time.perf_counter()))
+        return future
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.window_seconds
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _dispatch(self):
+        while True:
+            self._slots.acquire()
+            batch = self._collect()
+            self._executor.submit(self._run, batch)
+
+    def _run(self, batch):
+        try:
+            batch = [entry for entry in batch if entry[1].set_running_or_notify_cancel()]
+            if not batch:
+                return
+            start = time.perf_counter()
+            for _, _, queued_at in batch:
+                metrics.observe(f"{self.name}.batch.wait", start - queued_at)
+            metrics.increment(f"{self.name}.batch.calls")
+            metrics.increment(f"{self.name}.batch.items", len(batch))
+            metrics.set_gauge(f"{self.name}.batch.last_size", len(batch))
+            try:
+                results = self._call([item for item, _, _ in batch])
+            except Exception as e:
+                if len(batch) == 1 or not (self._retry_individually and self._retry_individually(e)):
+                    for _, future, _ in batch:
+                        future.set_exception(e)
+                    return
+                metrics.increment(f"{self.name}.batch.split")
+                log.warning("Falló un lote de %s (%s): se reintenta elemento a elemento", self.name, e)
+                results = []
+                for item, _, _ in batch:
+                    try:
+                        results.extend(self._call([item]))
+                    except Exception as item_error:
+                        results.append(item_error)
+            metrics.observe(f"{self.name}.batch.run", time.perf_counter() - start)
+            for (_, future, _), result in zip(batch, results):
+                if isinstance(result, Exception):
+                    metrics.increment(f"{self.name}.batch.item_errors")
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+        except Exception as e:
+            log.exception("Error inesperado al ejecutar un lote de %s: %s", self.name, e)
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self._slots.release()
+
+    def _call(self, items):
+        results = self._run_batch(items)
+        if len(results) != len(items):
+            raise RuntimeError(f"El lote de {len(items)} elementos devolvió {len(results)} resultados")
+        return results
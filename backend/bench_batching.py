@@ -0,0 +1,95 @@
+# backend/bench_batching.py
+
+import argparse
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from batching import MicroBatcher
+
+# Barre la ventana y el tamaño máximo de lote de MicroBatcher con un modelo
+# de prueba: cada llamada paga un coste fijo (`llamada_ms`, el viaje de red y
+# la preparación del modelo), el lote se calcula de una vez con numpy y el
+# modelo atiende como mucho `capacidad` llamadas a la vez. Varios hilos piden
+# predicciones sin pausa, como peticiones /analyze simultáneas.
+
+
+class FakeModel:
+    def __init__(self, call_ms, features, classes, capacity):
+        self.call_s = call_ms / 1000
+        self._capacity = threading.Semaphore(capacity)
+        rng = np.random.default_rng(0)
+        self.weights = rng.standard_normal((features, classes)).astype(np.float32)
+        self.calls = 0
+        self.items = 0
+        self._lock = threading.Lock()
+
+    def predict(self, images):
+        with self._lock:
+            self.calls += 1
+            self.items += len(images)
+        with self._capacity:
+            time.sleep(self.call_s)
+            scores = np.stack(images) @ self.weights
+        return list(scores.argmax(axis=1))
+
+
+def _run(predict, images, clients, per_client):
+    def client(index):
+        latencies = []
+        for i in range(per_client):
+            start = time.perf_counter()
+            predict(images[(index + i) % len(images)])
+            latencies.append((time.perf_counter() - start) * 1000)
+        return latencies
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        latencies = [value for result in pool.map(client, range(clients)) for value in result]
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return statistics.median(latencies), latencies[int(len(latencies) * 0.99) - 1], len(latencies) / elapsed
+
+
+def main(clients, per_client, windows_ms, sizes, concurrency, call_ms, features, capacity):
+    rng = np.random.default_rng(1)
+    images = [rng.standard_normal(features).astype(np.float32) for _ in range(64)]
+
+    print(f"{clients} clientes x {per_client} predicciones; {call_ms} ms por llamada; modelo con capacidad "
+          f"para {capacity} llamadas; {concurrency} lotes en curso como máximo\n")
+    print(f"{'ventana ms':>10}{'lote máx':>10}{'lote medio':>12}{'p50 ms':>9}{'p99 ms':>9}{'img/s':>9}")
+
+    model = FakeModel(call_ms, features, 10, capacity)
+    p50, p99, throughput = _run(lambda image: model.predict([image])[0], images, clients, per_client)
+    print(f"{'sin agrupar':>20}{1:>12.1f}{p50:>9.1f}{p99:>9.1f}{throughput:>9.0f}")
+
+    for window_ms in windows_ms:
+        for size in sizes:
+            model = FakeModel(call_ms, features, 10, capacity)
+            batcher = MicroBatcher("bench", model.predict, size, window_ms / 1000, concurrency)
+            p50, p99, throughput = _run(lambda image: batcher.submit(image).result(), images, clients, per_client)
+            print(f"{window_ms:>10g}{size:>10}{model.items / model.calls:>12.1f}{p50:>9.1f}{p99:>9.1f}{throughput:>9.0f}")
+
+
+def _numbers(value, cast):
+    return [cast(item) for item in value.split(",") if item.strip()]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Latencia y rendimiento de MicroBatcher según la ventana y el tamaño máximo de lote."
+    )
+    parser.add_argument('--clientes', type=int, default=16, help="Peticiones simultáneas")
+    parser.add_argument('--por-cliente', type=int, default=50)
+    parser.add_argument('--ventanas-ms', default="0,2,5,10,20")
+    parser.add_argument('--lotes', default="1,4,8,16")
+    parser.add_argument('--concurrencia', type=int, default=2, help="Lotes en curso a la vez")
+    parser.add_argument('--llamada-ms', type=float, default=30, help="Coste fijo de cada llamada al modelo")
+    parser.add_argument('--capacidad', type=int, default=2, help="Llamadas simultáneas que atiende el modelo")
+    parser.add_argument('--dimension', type=int, default=50000, help="Tamaño de cada imagen de prueba")
+    args = parser.parse_args()
+    main(
+        args.clientes, args.por_cliente, _numbers(args.ventanas_ms, float), _numbers(args.lotes, int),
+        args.concurrencia, args.llamada_ms, args.dimension, args.capacidad,
+    )
@@ -0,0 +1,147 @@
+# backend/bench_concurrency.py
+
+import argparse
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from storage_utils import _RequestExecutor
+
+# Mide cuántas peticiones atiende un worker gthread con `hilos` hilos antes y
+# después de mover la E/S de /analyze y del borrado de imágenes al pool
+# compartido (io_executor). Un servidor HTTP local imita a Firebase Storage y
+# a Roboflow con esperas fijas; cada "petición" descarga y predice el frente y
+# el reverso y después borra `borrados` imágenes, como el borrado de análisis.
+#   secuencial: todo en el hilo de la petición, una llamada tras otra (antes)
+#   pool:       las dos caras en paralelo en el pool y los borrados
+#               repartidos en como mucho `fanout` tareas (ahora)
+# El pool es de todo el worker: la E/S simultánea nunca supera IO_WORKERS.
+# Por defecto se dimensiona como en config.py (IO_FANOUT * WEB_THREADS);
+# con --io-workers se fija, p. ej. 8 para ver un pool que se queda corto.
+
+
+class FakeUpstream(BaseHTTPRequestHandler):
+    delays = {}
+    active = 0
+    peak = 0
+    lock = threading.Lock()
+
+    def _serve(self):
+        cls = type(self)
+        with cls.lock:
+            cls.active += 1
+            cls.peak = max(cls.peak, cls.active)
+        try:
+            time.sleep(cls.delays.get(self.path.strip("/"), 0))
+            self.send_response(200)
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"ok")
+        finally:
+            with cls.lock:
+                cls.active -= 1
+
+    do_GET = do_POST = do_DELETE = _serve
+
+    def log_message(self, *args):
+        pass
+
+
+def _call(session, base, method, path):
+    session.request(method, f"{base}/{path}").raise_for_status()
+
+
+def _sequential_request(session, base, deletes, _pool, _fanout):
+    for _ in ("frente", "reverso"):
+        _call(session, base, "GET", "descarga")
+        _call(session, base, "POST", "inferencia")
+    for _ in range(deletes):
+        _call(session, base, "DELETE", "borrado")
+
+
+def _pooled_request(session, base, deletes, pool, fanout):
+    def side():
+        _call(session, base, "GET", "descarga")
+        _call(session, base, "POST", "inferencia")
+
+    def delete_share(count):
+        for _ in range(count):
+            _call(session, base, "DELETE", "borrado")
+
+    for future in [pool.submit(side) for _ in ("frente", "reverso")]:
+        future.result()
+    # Como storage_utils.delete_images: como mucho `fanout` tareas por petición
+    tasks = min(fanout, deletes)
+    shares = [len(range(i, deletes, tasks)) for i in range(tasks)]
+    for future in [pool.submit(delete_share, count) for count in shares]:
+        future.result()
+
+
+def _run(request, session, base, threads, requests, deletes, io_workers, fanout):
+    FakeUpstream.peak = 0
+    pool = _RequestExecutor(max_workers=io_workers, thread_name_prefix="io")
+
+    def timed(_):
+        start = time.perf_counter()
+        request(session, base, deletes, pool, fanout)
+        return (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as workers:
+        latencies = sorted(workers.map(timed, range(requests)))
+    elapsed = time.perf_counter() - start
+    pool.shutdown()
+    return (
+        statistics.median(latencies), latencies[int(len(latencies) * 0.99) - 1],
+        requests / elapsed, FakeUpstream.peak,
+    )
+
+
+def main(threads_list, requests, deletes, io_workers, fanout, download_ms, inference_ms, delete_ms):
+    import requests as http
+
+    FakeUpstream.delays = {
+        "descarga": download_ms / 1000, "inferencia": inference_ms / 1000, "borrado": delete_ms / 1000,
+    }
+    # Con la cola de escucha por defecto (5) las conexiones sobrantes se
+    # reintentan al cabo de un segundo y ensucian el p99
+    ThreadingHTTPServer.request_queue_size = 256
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeUpstream)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    session = http.Session()
+    max_io_workers = io_workers or fanout * max(threads_list)
+    session.mount("http://", http.adapters.HTTPAdapter(pool_maxsize=max(threads_list) + max_io_workers))
+
+    print(f"{requests} peticiones por escenario: 2 caras ({download_ms} ms de descarga + {inference_ms} ms de "
+          f"inferencia) y {deletes} borrados de {delete_ms} ms; como mucho {fanout} tareas por petición\n")
+    print(f"{'hilos':>6} {'modo':<11}{'pool':>5}{'p50 ms':>9}{'p99 ms':>9}{'pet/s':>8}{'E/S simultánea':>16}")
+    for threads in threads_list:
+        workers = io_workers or fanout * threads
+        for name, request in (("secuencial", _sequential_request), ("pool", _pooled_request)):
+            p50, p99, throughput, peak = _run(request, session, base, threads, requests, deletes, workers, fanout)
+            print(f"{threads:>6} {name:<11}{workers if name == 'pool' else '-':>5}"
+                  f"{p50:>9.0f}{p99:>9.0f}{throughput:>8.1f}{peak:>16}")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Peticiones por segundo y E/S simultánea de un worker con la E/S en secuencia o en el pool."
+    )
+    parser.add_argument('--hilos', default="4,8,16", help="Hilos del worker (WEB_THREADS) a probar")
+    parser.add_argument('--peticiones', type=int, default=64)
+    parser.add_argument('--borrados', type=int, default=4, help="Imágenes borradas por petición")
+    parser.add_argument('--io-workers', type=int, default=None,
+                        help="Hilos del pool compartido (IO_WORKERS; por defecto fanout * hilos)")
+    parser.add_argument('--fanout', type=int, default=4, help="Tareas en el pool por petición (IO_FANOUT)")
+    parser.add_argument('--descarga-ms', type=float, default=150)
+    parser.add_argument('--inferencia-ms', type=float, default=600)
+    parser.add_argument('--borrado-ms', type=float, default=80)
+    args = parser.parse_args()
+    main(
+        [int(value) for value in args.hilos.split(",") if value.strip()], args.peticiones, args.borrados,
+        args.io_workers, args.fanout, args.descarga_ms, args.inferencia_ms, args.borrado_ms,
+    )
@@ -0,0 +1,129 @@
+# backend/bench_detections.py
+
+import argparse
+import json
+import random
+import statistics
+import time
+import uuid
+import psycopg2
+import psycopg2.extras
+from config import Config
+from detections import pack_detections, unpack_detections
+
+CLASES = ["Roya", "Minador", "Broca", "Cercospora", "Ojo de gallo"]
+
+
+def sample_response(count, width=1280, height=960):
+    """Respuesta con la misma forma que devuelve el modelo de Roboflow."""
+    predictions = []
+    for _ in range(count):
+        class_id = random.randrange(len(CLASES))
+        predictions.append({
+            "x": random.uniform(0, width),
+            "y": random.uniform(0, height),
+            "width": random.uniform(20, 300),
+            "height": random.uniform(20, 300),
+            "confidence": random.uniform(0.4, 1.0),
+            "class": CLASES[class_id],
+            "class_id": class_id,
+            "detection_id": str(uuid.uuid4()),
+        })
+    return {
+        "inference_id": str(uuid.uuid4()),
+        "time": random.uniform(0.05, 0.3),
+        "image": {"width": width, "height": height},
+        "predictions": predictions,
+    }
+
+
+def storage_report(cur, counts):
+    """
+    Tamaño en bytes por imagen de la lista de detecciones de Roboflow frente
+    al formato compacto: en JSON y, con PostgreSQL, ya guardado en JSONB.
+    """
+    print("Almacenamiento por imagen (bytes)")
+    print(f"{'detecciones':>11}{'json':>9}{'compacto':>10}{'jsonb':>9}{'compacto':>10}")
+    if cur is not None:
+        cur.execute("CREATE TEMP TABLE bench_tamanos (detecciones INTEGER, completo JSONB, compacto JSONB)")
+    for count in counts:
+        response = sample_response(count)
+        raw = json.dumps(response["predictions"])
+        packed = json.dumps(pack_detections(response))
+        line = f"{count:>11}{len(raw):>9}{len(packed):>10}"
+        if cur is not None:
+            # pg_column_size de la columna guardada incluye la compresión TOAST
+            cur.execute("INSERT INTO bench_tamanos VALUES (%s, %s, %s)", (count, raw, packed))
+            cur.execute(
+                "SELECT pg_column_size(completo), pg_column_size(compacto) FROM bench_tamanos WHERE detecciones = %s",
+                (count,)
+            )
+            line += "{:>9}{:>10}".format(*cur.fetchone())
+        print(line)
+
+
+def read_latency(cur, count, detections, repeat):
+    """Mediana en ms de leer y desempaquetar las detecciones de un análisis por su id."""
+    cur.execute(
+        "CREATE TEMP TABLE bench_detecciones (id_analisis INTEGER PRIMARY KEY, frente JSONB, reverso JSONB)"
+    )
+    psycopg2.extras.execute_values(
+        cur,
+        "INSERT INTO bench_detecciones VALUES %s",
+        [(i, json.dumps(pack_detections(sample_response(detections))), None) for i in range(count)],
+        page_size=1000
+    )
+    cur.execute("ANALYZE bench_detecciones")
+    timings = []
+    for _ in range(repeat):
+        id_analisis = random.randrange(count)
+        start = time.perf_counter()
+        cur.execute("SELECT frente, reverso FROM bench_detecciones WHERE id_analisis = %s", (id_analisis,))
+        frente, reverso = cur.fetchone()
+        unpack_detections(frente)
+        unpack_detections(reverso)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def inference_latency(url, repeat):
+    """Mediana en ms de descargar y volver a predecir una imagen (gasta llamadas al modelo)."""
+    from storage_utils import download_image
+    from app import _infer
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        pack_detections(_infer(download_image(url)))
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Mide el espacio que ocupan las detecciones guardadas y el tiempo de leerlas "
+                    "frente a volver a predecir la imagen."
+    )
+    parser.add_argument('--detecciones', type=int, nargs='*', default=[0, 1, 5, 20, 50])
+    parser.add_argument('--sin-bd', action='store_true', help="Solo tamaños en JSON, sin PostgreSQL")
+    parser.add_argument('--filas', type=int, default=10000, help="Filas de la tabla temporal de lectura")
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--url', help="Imagen guardada para medir la latencia de volver a predecirla")
+    parser.add_argument('--repeat-inferencia', type=int, default=5)
+    args = parser.parse_args()
+
+    conn = None if args.sin_bd else psycopg2.connect(Config.DATABASE_URI)
+    try:
+        cur = conn.cursor() if conn else None
+        storage_report(cur, args.detecciones)
+        if cur is not None:
+            detections = max(args.detecciones)
+            print(f"\nLectura por id ({args.filas} filas, {detections} detecciones): "
+                  f"{read_latency(cur, args.filas, detections, args.repeat):.2f} ms")
+    finally:
+        if conn:
+            # Las tablas temporales no se conservan
+            conn.rollback()
+            conn.close()
+    if args.url:
+        print(f"Descarga y nueva inferencia: {inference_latency(args.url, args.repeat_inferencia):.0f} ms")
@@ -0,0 +1,79 @@
+# backend/bench_encodings.py
+
+import argparse
+import gzip
+import json
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+from response_encoding import to_columnar, msgpack, brotli
+
+CLASES = ["Roya", "Minador", "Broca", "Cercospora", "Hoja sana", "Ojo de gallo"]
+
+
+def _firebase_url(folder):
+    return (
+        "https://firebasestorage.googleapis.com/v0/b/identificador-plagas-v2.firebasestorage.app/o/"
+        f"{folder}%2F{uuid.uuid4()}_800x800.jpg?alt=media&token={uuid.uuid4()}"
+    )
+
+
+def sample_rows(count):
+    """Filas con la misma forma que devuelve /admin/analyses."""
+    now = datetime.utcnow()
+    return [
+        {
+            "id_analisis": i,
+            "id_usuario": random.randint(1, 200),
+            "email": f"productor{random.randint(1, 200)}@cooperativa.org",
+            "url_imagen": _firebase_url("analisis"),
+            "url_imagen_reverso": _firebase_url("analisis") if i % 2 else None,
+            "url_miniatura": _firebase_url("analisis%2Fvariantes"),
+            "url_mediana": _firebase_url("analisis%2Fvariantes"),
+            "url_miniatura_reverso": None,
+            "url_mediana_reverso": None,
+            "resultado_prediccion": random.choice(CLASES),
+            "confianza": round(random.random(), 4),
+            "fecha_analisis": (now - timedelta(minutes=i)).isoformat(),
+            "fecha_eliminado": None,
+        }
+        for i in range(count)
+    ]
+
+
+def _timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return result, (time.perf_counter() - start) / repeat * 1000
+
+
+def main(count, repeat):
+    rows = sample_rows(count)
+    encoders = {
+        "json": lambda: json.dumps(rows).encode("utf-8"),
+        "json columnar": lambda: json.dumps(to_columnar(rows), ensure_ascii=False, separators=(",", ":")).encode("utf-8"),
+    }
+    if msgpack is not None:
+        encoders["msgpack"] = lambda: msgpack.packb(rows, use_bin_type=True)
+        encoders["msgpack columnar"] = lambda: msgpack.packb(to_columnar(rows), use_bin_type=True)
+
+    print(f"{count} filas, media de {repeat} repeticiones")
+    print(f"{'formato':<18}{'bytes':>10}{'ms':>8}{'gzip':>10}{'ms':>8}{'br':>10}{'ms':>8}")
+    for name, encode in encoders.items():
+        body, encode_ms = _timed(encode, repeat)
+        gz, gz_ms = _timed(lambda: gzip.compress(body, compresslevel=6), repeat)
+        line = f"{name:<18}{len(body):>10}{encode_ms:>8.2f}{len(gz):>10}{gz_ms:>8.2f}"
+        if brotli is not None:
+            br, br_ms = _timed(lambda: brotli.compress(body, quality=5), repeat)
+            line += f"{len(br):>10}{br_ms:>8.2f}"
+        print(line)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compara tamaño y coste de CPU de cada codificación de respuesta.")
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+    main(args.rows, args.repeat)
@@ -0,0 +1,110 @@
+# backend/bench_logging.py
+
+import argparse
+import logging
+import os
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from structured_logging import AsyncHandler, JsonFormatter, set_request_id
+
+# Mide la latencia que añade el registro a cada petición con varios hilos
+# escribiendo a la vez: print(), un handler JSON síncrono y el handler con
+# cola de structured_logging.py. Cada "petición" espera `trabajo_ms` (como si
+# esperara a Roboflow o a PostgreSQL) repartidos entre sus mensajes.
+
+
+class SlowSink:
+    """Salida que tarda `delay_us` por escritura, como un stdout conectado a un recolector de logs."""
+
+    def __init__(self, delay_us):
+        self.delay = delay_us / 1_000_000
+        self._out = open(os.devnull, "w")
+        self._lock = threading.Lock()
+
+    def write(self, text):
+        # Una tubería acepta una escritura cada vez
+        with self._lock:
+            if self.delay:
+                time.sleep(self.delay)
+            return self._out.write(text)
+
+    def flush(self):
+        self._out.flush()
+
+
+def _print_logger(sink):
+    def emit(message, *args, **kwargs):
+        print(message % args, file=sink)
+    return emit
+
+
+def _handler_logger(handler):
+    logger = logging.getLogger(f"bench.{id(handler)}")
+    logger.handlers = [handler]
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    return lambda message, *args, **kwargs: logger.info(message, *args, **kwargs)
+
+
+def _request(emit, messages, work_s):
+    set_request_id()
+    start = time.perf_counter()
+    for i in range(messages):
+        time.sleep(work_s / messages)
+        emit("Tiempo de descarga de imagen: %.2f segundos", 0.25, extra={"duracion_s": 0.25, "paso": i})
+    return (time.perf_counter() - start) * 1000
+
+
+def _run(emit, threads, requests, messages, work_s):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        latencies = list(pool.map(lambda _: _request(emit, messages, work_s), range(requests)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return statistics.median(latencies), latencies[int(len(latencies) * 0.99) - 1], requests / elapsed
+
+
+def main(threads, requests, messages, work_ms, delay_us):
+    work_s = work_ms / 1000
+    sync_handler = logging.StreamHandler(SlowSink(delay_us))
+    sync_handler.setFormatter(JsonFormatter())
+    async_target = logging.StreamHandler(SlowSink(delay_us))
+    async_target.setFormatter(JsonFormatter())
+    async_handler = AsyncHandler(async_target, maxsize=requests * messages)
+
+    modes = (
+        ("print()", _print_logger(SlowSink(delay_us))),
+        ("JSON síncrono", _handler_logger(sync_handler)),
+        ("JSON con cola", _handler_logger(async_handler)),
+    )
+    print(f"{threads} hilos, {requests} peticiones de {work_ms} ms con {messages} mensajes cada una; "
+          f"{delay_us} µs por escritura\n")
+    print(f"{'modo':<16}{'p50 ms':>9}{'p99 ms':>9}{'pet/s':>9}")
+    results = {}
+    for name, emit in modes:
+        results[name] = _run(emit, threads, requests, messages, work_s)
+        p50, p99, throughput = results[name]
+        print(f"{name:<16}{p50:>9.1f}{p99:>9.1f}{throughput:>9.0f}")
+    # Que el tiempo de vaciar la cola no se quede fuera de la comparación
+    start = time.perf_counter()
+    async_handler.close()
+    print(f"\nVaciado final de la cola: {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    base = results["JSON con cola"]
+    for name in ("print()", "JSON síncrono"):
+        print(f"Ahorro frente a {name}: p50 {results[name][0] - base[0]:.1f} ms, p99 {results[name][1] - base[1]:.1f} ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Compara la latencia por petición de print(), el registro JSON síncrono y el registro con cola."
+    )
+    parser.add_argument('--hilos', type=int, default=16)
+    parser.add_argument('--peticiones', type=int, default=400)
+    parser.add_argument('--mensajes', type=int, default=10, help="Mensajes por petición")
+    parser.add_argument('--trabajo-ms', type=float, default=50, help="Espera de E/S simulada por petición")
+    parser.add_argument('--escritura-us', type=int, default=200, help="Coste simulado de cada escritura en stdout")
+    args = parser.parse_args()
+    main(args.hilos, args.peticiones, args.mensajes, args.trabajo_ms, args.escritura_us)
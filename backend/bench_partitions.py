@@ -0,0 +1,161 @@
+# backend/bench_partitions.py
+
+import argparse
+import random
+import statistics
+import time
+import psycopg2
+from config import Config
+
+# Compara analisis sin particionar y particionada por mes de fecha_eliminado
+# con los mismos datos sintéticos, en un esquema temporal que se borra al final.
+SCHEMA = "bench_particiones"
+
+_COLUMNS = """
+    id_analisis INTEGER NOT NULL, id_usuario INTEGER NOT NULL, url_imagen TEXT,
+    resultado_prediccion TEXT, confianza DOUBLE PRECISION,
+    fecha_analisis TIMESTAMP, fecha_eliminado TIMESTAMP
+"""
+
+# Un 15 % de los análisis está en la papelera, repartido en `meses` meses
+_FILL_SQL = """
+    INSERT INTO {tabla}
+    SELECT g, 1 + g %% %(usuarios)s, 'https://example.org/' || md5(g::text) || '.jpg', 'Roya', random(),
+           NOW() - random() * INTERVAL '720 days',
+           CASE WHEN random() < 0.15 THEN NOW() - random() * make_interval(days => 30 * %(meses)s) END
+    FROM generate_series(1, %(filas)s) AS g
+"""
+
+_QUERIES = {
+    "historial": (
+        "SELECT id_analisis, url_imagen, resultado_prediccion, confianza, fecha_analisis FROM {tabla} "
+        "WHERE id_usuario = %s AND fecha_eliminado IS NULL ORDER BY fecha_analisis DESC"
+    ),
+    "papelera": (
+        "SELECT id_analisis, url_imagen, fecha_eliminado FROM {tabla} "
+        "WHERE id_usuario = %s AND fecha_eliminado IS NOT NULL ORDER BY fecha_eliminado DESC"
+    ),
+}
+
+
+def _create_tables(cur, rows, users, months):
+    cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    cur.execute(f"CREATE SCHEMA {SCHEMA}")
+    cur.execute(f"SET search_path = {SCHEMA}")
+
+    cur.execute(f"CREATE TABLE plana ({_COLUMNS})")
+    cur.execute(f"CREATE TABLE particionada ({_COLUMNS}) PARTITION BY RANGE (fecha_eliminado)")
+    cur.execute("CREATE TABLE particionada_activos PARTITION OF particionada DEFAULT")
+    cur.execute("ALTER TABLE particionada_activos ADD CHECK (fecha_eliminado IS NULL)")
+    cur.execute(
+        "SELECT date_trunc('month', NOW() - make_interval(months => %s))::date, date_trunc('month', NOW())::date",
+        (months + 1,)
+    )
+    month, last = cur.fetchone()
+    while month <= last:
+        upper = month.replace(year=month.year + month.month // 12, month=month.month % 12 + 1)
+        cur.execute(
+            f"CREATE TABLE particionada_{month:%Y_%m} PARTITION OF particionada FOR VALUES FROM (%s) TO (%s)",
+            (month, upper)
+        )
+        month = upper
+
+    cur.execute(_FILL_SQL.format(tabla="plana"), {"filas": rows, "usuarios": users, "meses": months})
+    cur.execute("INSERT INTO particionada SELECT * FROM plana")
+    for table in ("plana", "particionada"):
+        # Mismos índices que en producción (clave primaria e id_usuario)
+        if table == "plana":
+            cur.execute("ALTER TABLE plana ADD PRIMARY KEY (id_analisis)")
+        else:
+            cur.execute("SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                        "WHERE i.inhparent = 'particionada'::regclass")
+            for (partition,) in cur.fetchall():
+                cur.execute(f"ALTER TABLE {partition} ADD PRIMARY KEY (id_analisis)")
+        cur.execute(f"CREATE INDEX ON {table} (id_usuario)")
+        cur.execute(f"VACUUM ANALYZE {table}")
+
+
+def _query_latency(cur, table, query, users, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cur.execute(query.format(tabla=table), (random.randint(1, users),))
+        cur.fetchall()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def _timed(cur, statement, params=None):
+    start = time.perf_counter()
+    cur.execute(statement, params)
+    return (time.perf_counter() - start) * 1000
+
+
+def _cleanup_plain(cur):
+    """La limpieza de antes: DELETE de las filas caducadas y el VACUUM que deja pendiente."""
+    delete_ms = _timed(cur, "DELETE FROM plana WHERE fecha_eliminado < NOW() - INTERVAL '30 days'")
+    deleted = cur.rowcount
+    vacuum_ms = _timed(cur, "VACUUM plana")
+    return deleted, delete_ms, vacuum_ms
+
+
+def _cleanup_partitioned(cur):
+    """La limpieza nueva: DROP de las particiones caducadas y DELETE solo en la del mes límite."""
+    cur.execute(
+        """
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'particionada'::regclass AND c.relname <> 'particionada_activos'
+        """
+    )
+    start = time.perf_counter()
+    deleted = 0
+    for (partition,) in cur.fetchall():
+        month = time.strptime(partition[-7:], "%Y_%m")
+        cur.execute(
+            "SELECT make_date(%s, %s, 1) + INTERVAL '1 month' <= NOW() - INTERVAL '30 days'",
+            (month.tm_year, month.tm_mon)
+        )
+        if cur.fetchone()[0]:
+            cur.execute(f"SELECT COUNT(*) FROM {partition}")
+            deleted += cur.fetchone()[0]
+            cur.execute(f"DROP TABLE {partition}")
+    drop_ms = (time.perf_counter() - start) * 1000
+    delete_ms = _timed(cur, "DELETE FROM particionada WHERE fecha_eliminado < NOW() - INTERVAL '30 days'")
+    deleted += cur.rowcount
+    vacuum_ms = _timed(cur, "VACUUM particionada")
+    return deleted, drop_ms + delete_ms, vacuum_ms
+
+
+def main(rows, users, months, repeat):
+    conn = psycopg2.connect(Config.DATABASE_URI)
+    conn.autocommit = True
+    cur = conn.cursor()
+    try:
+        print(f"Generando {rows} análisis de {users} usuarios ({months} meses de papelera)...")
+        _create_tables(cur, rows, users, months)
+
+        print(f"\n{'consulta':<12}{'sin particionar':>17}{'particionada':>14}   (mediana de {repeat}, ms)")
+        for name, query in _QUERIES.items():
+            plain = _query_latency(cur, "plana", query, users, repeat)
+            partitioned = _query_latency(cur, "particionada", query, users, repeat)
+            print(f"{name:<12}{plain:>17.2f}{partitioned:>14.2f}")
+
+        print(f"\n{'limpieza':<16}{'filas':>9}{'borrado ms':>12}{'vacuum ms':>11}")
+        for name, cleanup in (("sin particionar", _cleanup_plain), ("particionada", _cleanup_partitioned)):
+            deleted, delete_ms, vacuum_ms = cleanup(cur)
+            print(f"{name:<16}{deleted:>9}{delete_ms:>12.1f}{vacuum_ms:>11.1f}")
+    finally:
+        cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Compara consultas y limpieza de la papelera con analisis sin particionar y particionada."
+    )
+    parser.add_argument('--filas', type=int, default=1000000)
+    parser.add_argument('--usuarios', type=int, default=5000)
+    parser.add_argument('--meses', type=int, default=12, help="Antigüedad máxima de la papelera en meses")
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+    main(args.filas, args.usuarios, args.meses, args.repeat)
@@ -0,0 +1,70 @@
+# backend/bench_startup.py
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from config import Config
+
+_MEASURE = "import time; start = time.perf_counter(); import app; print(time.perf_counter() - start)"
+
+
+def _import_seconds(env):
+    """Tiempo de 'import app' en un intérprete nuevo (sin módulos en caché)."""
+    result = subprocess.run(
+        [sys.executable, "-c", _MEASURE], env=env, capture_output=True, text=True, check=True
+    )
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def _slowest_modules(env, top):
+    """Los imports directos de app más lentos según python -X importtime."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"], env=env, capture_output=True, text=True
+    )
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # La sangría indica la profundidad: app tiene un espacio y sus
+        # imports directos, tres
+        if len(name) - len(name.lstrip()) == 3:
+            modules.append((int(cumulative), name.strip()))
+    return sorted(modules, reverse=True)[:top]
+
+
+def main(repeat, budget_ms, top, preload):
+    env = dict(os.environ, PRELOAD_HEAVY_MODULES="true" if preload else "false")
+    env.setdefault("DATABASE_URL", "postgresql://localhost/bench")  # no se conecta al importar
+
+    samples = [_import_seconds(env) * 1000 for _ in range(repeat)]
+    median_ms = statistics.median(samples)
+    print(f"import app: mediana {median_ms:.0f} ms, mínimo {min(samples):.0f} ms, "
+          f"máximo {max(samples):.0f} ms ({repeat} repeticiones, preload={'sí' if preload else 'no'})")
+
+    print("\nImports directos de app más lentos (acumulado):")
+    for cumulative_us, name in _slowest_modules(env, top):
+        print(f"  {cumulative_us / 1000:>8.1f} ms  {name}")
+
+    if preload:
+        # Con preload el coste se paga a propósito una vez en el maestro
+        return 0
+    if median_ms > budget_ms:
+        print(f"\n❌ El arranque ({median_ms:.0f} ms) supera el presupuesto de {budget_ms} ms")
+        return 1
+    print(f"\n✅ Dentro del presupuesto de {budget_ms} ms")
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Mide el tiempo de importación de la app y falla si supera el presupuesto."
+    )
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--budget-ms', type=int, default=Config.IMPORT_BUDGET_MS)
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--preload', action='store_true', help="Mide el arranque con PRELOAD_HEAVY_MODULES=true (solo informativo, sin presupuesto)")
+    args = parser.parse_args()
+    sys.exit(main(args.repeat, args.budget_ms, args.top, args.preload))
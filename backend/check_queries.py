@@ -0,0 +1,65 @@
+# backend/check_queries.py
+
+import sys
+import repository
+
+# Comprueba contra una base de datos de prueba cuántas consultas hacen las
+# operaciones que prometen un número fijo de viajes a PostgreSQL. Los datos
+# se crean dentro de una transacción que se deshace al final.
+
+
+def check_user_deletion(conn, analyses=5):
+    """Borrar un usuario con sus análisis debe ser una única consulta."""
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO usuarios (nombre_completo, email, password_hash)
+        VALUES ('Comprobación', 'check-queries@example.org', 'x')
+        RETURNING id_usuario
+    """)
+    user_id = cur.fetchone()[0]
+    cur.execute("""
+        INSERT INTO analisis (id_usuario, url_imagen, url_imagen_reverso, resultado_prediccion, confianza)
+        SELECT %s, 'https://example.org/f' || g || '.jpg', 'https://example.org/r' || g || '.jpg', 'Roya', 0.9
+        FROM generate_series(1, %s) g
+    """, (user_id, analyses))
+
+    with repository.count_queries() as stats:
+        result = repository.delete_user_with_data(cur, user_id, allow_admin=False)
+
+    cur.execute("SELECT COUNT(*) FROM analisis WHERE id_usuario = %s", (user_id,))
+    remaining = cur.fetchone()[0]
+    cur.close()
+    failures = []
+    if stats.count != 1:
+        failures.append(f"{stats.count} consultas en lugar de 1")
+    if not result[1] or remaining:
+        failures.append(f"el usuario no se borró del todo ({remaining} análisis restantes)")
+    if len(result[2]) != 2 * analyses:
+        failures.append(f"devolvió {len(result[2])} URLs en lugar de {2 * analyses}")
+    return failures
+
+
+CHECKS = {
+    "borrado de usuario": check_user_deletion,
+}
+
+
+def main():
+    conn = repository.connect_script()
+    failed = 0
+    try:
+        for name, check in CHECKS.items():
+            try:
+                failures = check(conn)
+            finally:
+                # Nunca se conservan los datos de prueba
+                conn.rollback()
+            print(f"{'❌' if failures else '✅'} {name}" + (": " + "; ".join(failures) if failures else ""))
+            failed += bool(failures)
+    finally:
+        conn.close()
+    return failed
+
+
+if __name__ == '__main__':
+    sys.exit(1 if main() else 0)
@@ -0,0 +1,119 @@
+# backend/check_read_your_writes.py
+
+import argparse
+import sys
+import time
+import psycopg2
+from config import Config
+from db_routing import PRIMARY, ReplicaRouter
+
+# Comprueba contra el primario y la primera réplica de REPLICA_DATABASE_URLS
+# que un usuario lee lo que acaba de escribir aunque la lectura la atienda
+# otro worker. Se crean dos ReplicaRouter (dos "workers"), se pausa la
+# aplicación del WAL en la réplica (pg_wal_replay_pause, hace falta un rol
+# con permiso) y se escribe con uno: el otro debe mandar la lectura de ese
+# usuario al primario y la de otro usuario a la réplica. Con
+# --backend memory la comprobación falla: la marca solo la ve el worker
+# que escribió. La réplica se reanuda y el usuario de prueba se borra al
+# terminar.
+
+_MAX_LAG_SECONDS = 3600
+
+
+def _router(backend):
+    # Sin el límite de retraso: la réplica pausada solo puede descartarse
+    # por no tener la escritura del usuario
+    return ReplicaRouter(
+        Config.DATABASE_URI, Config.REPLICA_DATABASE_URLS[:1], max_lag_seconds=_MAX_LAG_SECONDS,
+        status_seconds=0, connect_timeout=Config.REPLICA_CONNECT_TIMEOUT, write_marks_backend=backend,
+        read_your_writes_seconds=Config.READ_YOUR_WRITES_SECONDS, pool_size=2, pool_timeout=5,
+    )
+
+
+def _read_target(router, user_id):
+    conn = router.read_connection(user_id)
+    try:
+        return conn.target
+    finally:
+        conn.close()
+
+
+def _wait_for_replay(primary, replica, timeout=10):
+    """Espera a que la réplica aplique todo el WAL escrito hasta ahora en el primario."""
+    cur = primary.cursor()
+    cur.execute("SELECT pg_current_wal_lsn()")
+    lsn = cur.fetchone()[0]
+    cur.close()
+    cur = replica.cursor()
+    deadline = time.monotonic() + timeout
+    while True:
+        cur.execute("SELECT pg_last_wal_replay_lsn() >= %s::pg_lsn", (lsn,))
+        if cur.fetchone()[0]:
+            break
+        if time.monotonic() > deadline:
+            raise RuntimeError("La réplica no aplica el WAL del primario")
+        time.sleep(0.1)
+    cur.close()
+
+
+def check(backend):
+    writer, reader = _router(backend), _router(backend)
+    primary = psycopg2.connect(Config.DATABASE_URI)
+    replica = psycopg2.connect(Config.REPLICA_DATABASE_URLS[0])
+    replica.autocommit = True
+    user_id = None
+    failures = []
+    try:
+        cur = primary.cursor()
+        cur.execute("""
+            INSERT INTO usuarios (nombre_completo, email, password_hash)
+            VALUES ('Comprobación', 'check-read-your-writes@example.org', 'x')
+            RETURNING id_usuario
+        """)
+        user_id = cur.fetchone()[0]
+        primary.commit()
+        _wait_for_replay(primary, replica)
+
+        replica.cursor().execute("SELECT pg_wal_replay_pause()")
+        conn = writer.primary_connection()
+        try:
+            conn.cursor().execute(
+                "UPDATE usuarios SET nombre_completo = 'Comprobación 2' WHERE id_usuario = %s", (user_id,)
+            )
+            conn.commit()
+            writer.record_write(conn, user_id)
+        finally:
+            conn.close()
+
+        for name, router, reader_user, expected in (
+            ("el worker que escribió lee del primario", writer, user_id, PRIMARY),
+            ("otro worker lee del primario", reader, user_id, PRIMARY),
+            ("otro usuario lee de la réplica", reader, -1, "replica1"),
+        ):
+            target = _read_target(router, reader_user)
+            ok = target == expected
+            print(f"{'✅' if ok else '❌'} {name}" + ("" if ok else f": fue a {target}"))
+            if not ok:
+                failures.append(name)
+    finally:
+        replica.cursor().execute("SELECT pg_wal_replay_resume()")
+        replica.close()
+        if user_id is not None:
+            cur = primary.cursor()
+            cur.execute("DELETE FROM escrituras_recientes WHERE id_usuario = %s", (user_id,))
+            cur.execute("DELETE FROM usuarios WHERE id_usuario = %s", (user_id,))
+            primary.commit()
+        primary.close()
+    return failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Comprueba la lectura de lo propio escrito entre dos workers con la réplica pausada."
+    )
+    parser.add_argument('--backend', default=Config.READ_YOUR_WRITES_BACKEND, choices=("memory", "postgres"),
+                        help="Marcas de escritura a probar (por defecto READ_YOUR_WRITES_BACKEND)")
+    args = parser.parse_args()
+    if not Config.REPLICA_DATABASE_URLS:
+        parser.error("define REPLICA_DATABASE_URLS con al menos una réplica")
+    sys.exit(1 if check(args.backend) else 0)
@@ -0,0 +1,271 @@
+# backend/check_routes.py
+
+import io
+import os
+import sys
+import uuid
+from datetime import datetime, timedelta
+
+# Antes de importar la app: una ruta que se pasa de su presupuesto falla, y
+# la tabla de dosis comprueba su versión en cada petición (el caso más caro)
+os.environ["QUERY_BUDGET_STRICT"] = "true"
+os.environ["DOSE_TABLE_CHECK_SECONDS"] = "0"
+
+import jwt  # noqa: E402
+from PIL import Image  # noqa: E402
+import app as application  # noqa: E402
+import image_variants  # noqa: E402
+import metrics  # noqa: E402
+import repository  # noqa: E402
+from repository import QueryBudgetExceeded  # noqa: E402
+
+# Recorre con app.test_client() todas las rutas con @db_route contra una
+# base de datos de prueba, con QUERY_BUDGET_STRICT activado, y falla si
+# alguna hace más consultas de las que declara, responde con un error o se
+# queda sin comprobar (p. ej. una ruta nueva que falta en check()). Una ruta
+# sin @db_route también falla, salvo las de ROUTES_WITHOUT_DB. Firebase
+# Storage y Roboflow se sustituyen por respuestas fijas. Los usuarios, la
+# enfermedad y los análisis de prueba se crean al empezar y se borran al
+# terminar.
+
+PASSWORD = "clave-de-prueba-1"
+NEW_PASSWORD = "clave-de-prueba-2"
+
+# Rutas que no consultan la base de datos y por eso no llevan @db_route
+ROUTES_WITHOUT_DB = {
+    "static", "delete_from_storage", "get_metrics", "profile_stacks", "profile_requests", "profile_memory",
+}
+
+
+def _image_bytes(color):
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 64), color).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+def _stub_external_services():
+    images = {}
+
+    def upload_image(image_bytes, content_type, folder, extension):
+        url = f"https://example.org/check-routes/{folder}/{uuid.uuid4().hex}.{extension}"
+        images[url] = image_bytes
+        return url
+
+    def download_image(url):
+        return images.get(url) or _image_bytes("green")
+
+    def infer(image_bytes):
+        return {
+            "predictions": [{"class": "Roya", "confidence": 0.9, "x": 32, "y": 32, "width": 10, "height": 10}],
+            "image": {"width": 64, "height": 64},
+        }
+
+    for module in (application, image_variants):
+        module.upload_image = upload_image
+        module.download_image = download_image
+        module.delete_images = lambda urls: len(list(urls))
+    application.delete_image = lambda url: True
+    application._infer = infer
+
+
+class RouteChecker:
+    def __init__(self):
+        self.client = application.app.test_client()
+        self.results = {}
+        self.failures = []
+
+    def token(self, user_id, admin=False):
+        payload = {"user_id": user_id, "es_admin": admin, "exp": datetime.utcnow() + timedelta(hours=1)}
+        return {"x-access-token": jwt.encode(payload, application.app.config['SECRET_KEY'], algorithm="HS256")}
+
+    def call(self, endpoint, method, path, headers=None, expected=(200,), **kwargs):
+        """Hace la petición y anota cuántas consultas hizo la ruta. Devuelve el JSON de la respuesta."""
+        key = f"db.queries.{endpoint}"
+        before = metrics.snapshot()["counters"].get(key, 0)
+        try:
+            response = self.client.open(path, method=method, headers=headers, **kwargs)
+        except QueryBudgetExceeded as e:
+            self.failures.append(str(e))
+            return {}
+        count = metrics.snapshot()["counters"].get(key, 0) - before
+        budget = application.app.view_functions[endpoint].query_budget
+        used, _ = self.results.get(endpoint, (0, budget))
+        self.results[endpoint] = (max(used, count), budget)
+        if response.status_code not in expected:
+            self.failures.append(f"{method} {path} respondió {response.status_code}: {response.get_data(as_text=True)[:200]}")
+        return response.get_json(silent=True) or {}
+
+    def unchecked(self):
+        return sorted(
+            endpoint for endpoint, view in application.app.view_functions.items()
+            if hasattr(view, "query_budget") and endpoint not in self.results
+        )
+
+    def undeclared(self):
+        """Rutas sin @db_route (sin presupuesto ni statement_timeout) que no están en ROUTES_WITHOUT_DB."""
+        return sorted(
+            endpoint for endpoint, view in application.app.view_functions.items()
+            if not hasattr(view, "query_budget") and endpoint not in ROUTES_WITHOUT_DB
+        )
+
+
+def _setup(conn, tag):
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO usuarios (nombre_completo, email, password_hash, es_admin)
+        VALUES ('Comprobación admin', %s, 'x', TRUE) RETURNING id_usuario
+    """, (f"check-routes-admin-{tag}@example.org",))
+    admin_id = cur.fetchone()[0]
+    cur.execute("""
+        INSERT INTO enfermedades (nombre_comun, roboflow_class) VALUES ('Comprobación', %s)
+        RETURNING id_enfermedad
+    """, (f"check-routes-{tag}",))
+    disease_id = cur.fetchone()[0]
+    conn.commit()
+    cur.close()
+    return admin_id, disease_id
+
+
+def _cleanup(conn, tag, disease_id):
+    cur = conn.cursor()
+    cur.execute("SELECT id_usuario FROM usuarios WHERE email LIKE %s", (f"check-routes-%-{tag}@example.org",))
+    for (user_id,) in cur.fetchall():
+        repository.delete_user_with_data(cur, user_id, allow_admin=True)
+    if disease_id is not None:
+        cur.execute("DELETE FROM tratamientos WHERE id_enfermedad = %s", (disease_id,))
+        cur.execute("DELETE FROM enfermedades WHERE id_enfermedad = %s", (disease_id,))
+    conn.commit()
+    cur.close()
+
+
+def check(checker, conn, tag, admin_id, disease_id):
+    call = checker.call
+    admin = checker.token(admin_id, admin=True)
+    email = f"check-routes-user-{tag}@example.org"
+
+    call("health_check", "GET", "/health")
+    call("register", "POST", "/register", expected=(201,),
+         json={"nombre_completo": "Comprobación", "email": email, "password": PASSWORD, "ong": "Prueba"})
+    login = call("login", "POST", "/login", json={"email": email, "password": PASSWORD})
+    user_id = jwt.decode(login["token"], application.app.config['SECRET_KEY'], algorithms=["HS256"])["user_id"]
+    user = checker.token(user_id)
+
+    call("get_profile", "GET", "/profile", user)
+    call("update_profile", "PUT", "/profile/update", user, json={"nombre_completo": "Comprobación 2"})
+    call("change_password", "POST", "/profile/change-password", user,
+         json={"current_password": PASSWORD, "new_password": NEW_PASSWORD})
+
+    # Subida con las dos caras (el caso más caro) y por URL
+    analysis = call("analyze_image", "POST", "/analyze", user, content_type="multipart/form-data", data={
+        "image_front": (io.BytesIO(_image_bytes("red")), "frente.jpg"),
+        "image_back": (io.BytesIO(_image_bytes("blue")), "reverso.jpg"),
+    })
+    call("analyze_image", "POST", "/analyze", user, json={"image_url_front": analysis.get("url_imagen")})
+
+    ids = []
+    for _ in range(6):
+        saved = call("save_analysis", "POST", "/history/save", user, expected=(201,), json={
+            "url_imagen": analysis.get("url_imagen"), "url_imagen_reverso": analysis.get("url_imagen_reverso"),
+            "prediction": "Roya", "confidence": 0.9,
+            "hash_contenido": analysis.get("hash_contenido"),
+            "hash_contenido_reverso": analysis.get("hash_contenido_reverso"),
+        })
+        ids.append(saved.get("id_analisis"))
+
+    call("get_disease_details", "GET", f"/disease/check-routes-{tag}", user)
+    call("get_history", "GET", "/history", user)
+    call("sync_history", "GET", "/history/sync?since=0", user)
+    call("get_analysis_detections", "GET", f"/history/{ids[0]}/detections", user)
+    # Sin detecciones guardadas: se vuelven a predecir y se guardan
+    cur = conn.cursor()
+    cur.execute("DELETE FROM analisis_detecciones WHERE id_analisis = %s", (ids[5],))
+    conn.commit()
+    cur.close()
+    call("get_analysis_detections", "GET", f"/history/{ids[5]}/detections", user)
+
+    call("delete_history_item", "DELETE", f"/history/{ids[0]}", user)
+    call("get_trashed_history", "GET", "/history/trash", user)
+    call("restore_history_item", "PUT", f"/history/{ids[0]}/restore", user)
+    call("delete_history_item", "DELETE", f"/history/{ids[0]}", user)
+    call("permanently_delete_item", "DELETE", f"/history/{ids[0]}/permanent", user)
+    call("bulk_history_operation", "POST", "/history/bulk", user, json={"action": "delete", "ids": ids[1:3]})
+    call("restore_all_trash", "PUT", "/history/trash/restore-all", user)
+    call("bulk_history_operation", "POST", "/history/bulk", user, json={"action": "permanent", "ids": [ids[1]]})
+    call("delete_history_item", "DELETE", f"/history/{ids[2]}", user)
+    call("empty_trash", "DELETE", "/history/trash/empty", user)
+
+    call("get_all_analyses", "GET", "/admin/analyses", admin)
+    call("get_admin_summary", "GET", "/admin/summary", admin)
+    call("get_users_with_analyses", "GET", "/admin/users_with_analyses", admin)
+    call("get_analyses_for_user", "GET", f"/admin/analyses/user/{user_id}", admin)
+    call("admin_search", "GET", "/admin/search?q=Roya", admin)
+    call("admin_delete_analysis", "DELETE", f"/admin/analysis/{ids[3]}", admin)
+    call("get_admin_trashed_items", "GET", "/admin/trash", admin)
+    call("admin_restore_analysis", "PUT", f"/admin/analysis/restore/{ids[3]}", admin)
+    call("admin_bulk_analysis_operation", "POST", "/admin/analyses/bulk", admin,
+         json={"action": "permanent", "ids": [ids[3]]})
+
+    call("get_all_diseases", "GET", "/admin/diseases", admin)
+    call("update_disease_details", "PUT", f"/admin/disease/{disease_id}", admin,
+         json={"tipo": "Hongo", "prevencion": "-", "riesgo": "Bajo", "imagen_url": None})
+    treatment = call("add_treatment", "POST", "/admin/treatments", admin, expected=(201,), json={
+        "id_enfermedad": disease_id, "nombre_comercial": "Comprobación", "ingrediente_activo": "Cobre",
+    })
+    call("update_treatment", "PUT", f"/admin/treatments/{treatment.get('id_tratamiento')}", admin,
+         json={"nombre_comercial": "Comprobación 2", "ingrediente_activo": "Cobre"})
+    call("get_enfermedades", "GET", "/api/enfermedades", user)
+    call("get_tratamientos_por_enfermedad", "GET", f"/api/tratamientos/{disease_id}", user)
+    # La API de administración no fija las dosis por planta
+    cur = conn.cursor()
+    cur.execute(
+        "UPDATE tratamientos SET dosis_por_planta_ml = 2, agua_por_planta_ml = 500 WHERE id_tratamiento = %s",
+        (treatment.get('id_tratamiento'),)
+    )
+    conn.commit()
+    cur.close()
+    call("calculate_dose", "POST", "/calculate_dose", user,
+         json={"treatment_id": treatment.get('id_tratamiento'), "plant_count": 100})
+    call("calculate_dose", "POST", "/calculate_dose", user,
+         json={"items": [{"treatment_id": treatment.get('id_tratamiento')}, {"treatment_id": -1}], "plant_count": 100})
+    call("delete_treatment", "DELETE", f"/admin/treatments/{treatment.get('id_tratamiento')}", admin)
+
+    # Un segundo usuario para el borrado desde administración
+    other_email = f"check-routes-otro-{tag}@example.org"
+    call("register", "POST", "/register", expected=(201,),
+         json={"nombre_completo": "Comprobación", "email": other_email, "password": PASSWORD})
+    other = call("login", "POST", "/login", json={"email": other_email, "password": PASSWORD})
+    other_id = jwt.decode(other["token"], application.app.config['SECRET_KEY'], algorithms=["HS256"])["user_id"]
+    call("admin_reset_password", "PUT", f"/admin/user/{other_id}/reset-password", admin,
+         json={"new_password": NEW_PASSWORD})
+    call("admin_delete_user", "DELETE", f"/admin/user/{other_id}", admin)
+    call("delete_current_user", "POST", "/profile/delete", user, json={"current_password": NEW_PASSWORD})
+
+
+def main():
+    _stub_external_services()
+    # Las excepciones de las rutas (QueryBudgetExceeded) llegan al cliente de prueba
+    application.app.testing = True
+    tag = uuid.uuid4().hex[:8]
+    conn = repository.connect_script()
+    disease_id = None
+    checker = RouteChecker()
+    try:
+        admin_id, disease_id = _setup(conn, tag)
+        check(checker, conn, tag, admin_id, disease_id)
+    finally:
+        _cleanup(conn, tag, disease_id)
+        conn.close()
+
+    for endpoint, (used, budget) in sorted(checker.results.items()):
+        print(f"{'❌' if used > budget else '✅'} {endpoint}: {used}/{budget} consultas")
+    for endpoint in checker.unchecked():
+        checker.failures.append(f"{endpoint} no se ha comprobado")
+    for endpoint in checker.undeclared():
+        checker.failures.append(f"{endpoint} no tiene @db_route")
+    for failure in checker.failures:
+        print(f"❌ {failure}")
+    return len(checker.failures)
+
+
+if __name__ == '__main__':
+    sys.exit(1 if main() else 0)
@@ -0,0 +1,134 @@
+# backend/circuit_breaker.py
+
+import logging
+import threading
+import time
+from collections import deque
+import metrics
+
+log = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """Se lanza cuando el circuito está abierto y la llamada se rechaza al instante."""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"El servicio '{name}' no está disponible temporalmente")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker con ventana deslizante de tiempo. Se abre cuando, con al
+    menos `min_calls` llamadas en la ventana, la proporción de fallos o de
+    llamadas lentas supera su umbral. Tras `open_seconds` pasa a semiabierto
+    y deja pasar una llamada de prueba: si va bien se cierra y si no, vuelve
+    a abrirse.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, window_seconds=30, min_calls=5, failure_ratio=0.5,
+                 slow_call_seconds=10, slow_call_ratio=0.5, open_seconds=30,
+                 ignored_exceptions=()):
+        self.name = name
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_ratio = slow_call_ratio
+        self.open_seconds = open_seconds
+        # Excepciones que no indican un fallo del servicio (p. ej. NotFound)
+        self.ignored_exceptions = ignored_exceptions
+
+        self._lock = threading.Lock()
+        self._calls = deque()  # (instante, fallo, lenta)
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        metrics.set_gauge(f"circuit.{name}.state", self._state)
+
+    @property
+    def state(self):
+        with self._lock:
+            self._refresh_state(time.monotonic())
+            return self._state
+
+    def retry_after(self):
+        """Segundos que faltan para la próxima llamada de prueba."""
+        with self._lock:
+            return max(0.0, self._opened_at + self.open_seconds - time.monotonic())
+
+    def is_open(self):
+        """True si una llamada ahora mismo sería rechazada."""
+        with self._lock:
+            self._refresh_state(time.monotonic())
+            return self._state == self.OPEN or (self._state == self.HALF_OPEN and self._probe_in_flight)
+
+    def call(self, fn, *args, **kwargs):
+        self._before_call()
+        start = time.monotonic()
+        try:
+            result = fn(*args, **kwargs)
+        except self.ignored_exceptions:
+            self._record(failed=False, elapsed=time.monotonic() - start)
+            raise
+        except Exception:
+            self._record(failed=True, elapsed=time.monotonic() - start)
+            raise
+        self._record(failed=False, elapsed=time.monotonic() - start)
+        return result
+
+    def _before_call(self):
+        with self._lock:
+            now = time.monotonic()
+            self._refresh_state(now)
+            if self._state == self.OPEN or (self._state == self.HALF_OPEN and self._probe_in_flight):
+                metrics.increment(f"circuit.{self.name}.rejected")
+                raise CircuitOpenError(self.name, max(0.0, self._opened_at + self.open_seconds - now))
+            if self._state == self.HALF_OPEN:
+                self._probe_in_flight = True
+
+    def _record(self, failed, elapsed):
+        slow = elapsed >= self.slow_call_seconds
+        with self._lock:
+            now = time.monotonic()
+            if self._state == self.HALF_OPEN:
+                self._probe_in_flight = False
+                if failed or slow:
+                    self._transition(self.OPEN, now)
+                else:
+                    self._calls.clear()
+                    self._transition(self.CLOSED, now)
+                return
+
+            self._calls.append((now, failed, slow))
+            while self._calls and self._calls[0][0] < now - self.window_seconds:
+                self._calls.popleft()
+
+            total = len(self._calls)
+            if self._state == self.CLOSED and total >= self.min_calls:
+                failures = sum(1 for _, f, _ in self._calls if f)
+                slow_calls = sum(1 for _, _, s in self._calls if s)
+                if failures / total >= self.failure_ratio or slow_calls / total >= self.slow_call_ratio:
+                    self._transition(self.OPEN, now)
+
+    def _refresh_state(self, now):
+        if self._state == self.OPEN and now >= self._opened_at + self.open_seconds:
+            self._transition(self.HALF_OPEN, now)
+
+    def _transition(self, state, now):
+        if state == self._state:
+            return
+        log.warning(
+            "Circuito '%s': %s -> %s", self.name, self._state, state,
+            extra={"circuito": self.name, "estado": state}
+        )
+        self._state = state
+        if state == self.OPEN:
+            self._opened_at = now
+        metrics.increment(f"circuit.{self.name}.to_{state}")
+        metrics.set_gauge(f"circuit.{self.name}.state", state)
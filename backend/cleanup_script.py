@@ -1,80 +1,146 @@
 # backend/cleanup_script.py
 
-import psycopg2
+import logging
 import psycopg2.extras
 import os
 from datetime import datetime, timedelta
 from config import Config
-import firebase_admin
-from firebase_admin import credentials, storage
-from urllib.parse import unquote
+import repository
+from storage_utils import init_firebase, delete_images
+from image_variants import analysis_image_urls
+from image_hash import unreferenced_urls, expire_reservations
+from partitions import is_partitioned, ensure_partitions, trash_partitions, detach_trash_partition, drop_trash_partition
+from structured_logging import setup_logging, set_request_id
+
+log = logging.getLogger("cleanup_script")
 
 def cleanup_expired_items():
     """
     Encuentra y elimina permanentemente los registros de análisis y sus
     imágenes correspondientes de Firebase Storage que fueron movidos a la
     papelera hace más de 30 días.
+
+    Con analisis particionada por mes de borrado, las particiones que ya han
+    caducado enteras se eliminan de una vez (sin DELETE fila a fila ni
+    VACUUM posterior) y solo se borran filas sueltas de la del mes límite.
+    Cada partición se separa primero con un bloqueo breve y se elimina y
+    confirma por separado. También se crean por adelantado las particiones
+    de los próximos meses.
     """
-    print(f"--- Iniciando limpieza de la papelera - {datetime.utcnow()} UTC ---")
+    log.info("Iniciando limpieza de la papelera")
     conn = None
     cur = None
     
     try:
-        if not firebase_admin._apps:
-            cred = credentials.Certificate("serviceAccountKey.json")
-            firebase_admin.initialize_app(cred, {
-                'storageBucket': 'identificador-plagas-v2.firebasestorage.app'
-            })
-        bucket = storage.bucket()
-        conn = psycopg2.connect(Config.DATABASE_URI)
+        init_firebase()
+        conn = repository.connect_script()
         cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
 
         thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-        cur.execute(
-            "SELECT id_analisis, url_imagen FROM analisis WHERE fecha_eliminado IS NOT NULL AND fecha_eliminado < %s",
-            (thirty_days_ago,)
-        )
-        expired_items = cur.fetchall()
+        expired_items = []
+
+        if is_partitioned(cur):
+            created = ensure_partitions(cur, Config.ANALYSIS_PARTITIONS_AHEAD)
+            if created:
+                log.info("Se crearon %s particiones nuevas de la papelera.", created)
+            conn.commit()
+            for partition, upper in trash_partitions(cur):
+                if upper > thirty_days_ago:
+                    continue
+                if not detach_trash_partition(
+                    conn, partition, Config.ANALYSIS_DETACH_LOCK_TIMEOUT_MS, Config.ANALYSIS_DETACH_ATTEMPTS
+                ):
+                    log.warning("No se pudo separar la partición %s; se reintentará en la próxima ejecución.", partition)
+                    continue
+                rows = drop_trash_partition(cur, partition)
+                urls_to_delete = unreferenced_urls(cur, analysis_image_urls(rows))
+                conn.commit()
+                log.info("Se eliminó la partición %s (%s registros).", partition, len(rows))
+                delete_images(urls_to_delete)
+
+        expired_items.extend(repository.expired_trash(cur, thirty_days_ago))
         
         if not expired_items:
-            print("No se encontraron archivos expirados para eliminar.")
+            conn.commit()
+            log.info("No se encontraron archivos expirados para eliminar.")
             return
 
-        print(f"Se encontraron {len(expired_items)} archivos expirados para eliminar.")
-        
-        ids_to_delete = []
-        for item in expired_items:
-            image_url = item['url_imagen']
-            if image_url:
-                try:
-                    path_start = image_url.find("/o/") + 3
-                    path_end = image_url.find("?alt=media")
-                    if path_start > 2 and path_end != -1:
-                        file_path = unquote(image_url[path_start:path_end])
-                        blob = bucket.blob(file_path)
-                        if blob.exists():
-                            blob.delete()
-                            print(f"  - Imagen borrada de Firebase: {file_path}")
-                        else:
-                            print(f"  - La imagen no se encontró en Firebase (pudo ser borrada antes): {file_path}")
-                except Exception as e:
-                    print(f"  - ERROR: No se pudo borrar la imagen {image_url} de Firebase: {e}")
+        log.info("Se encontraron %s archivos expirados para eliminar.", len(expired_items))
 
-            ids_to_delete.append(item['id_analisis'])
-        
-        if ids_to_delete:
-            cur.execute("DELETE FROM analisis WHERE id_analisis = ANY(%s::int[])", (ids_to_delete,))
-            conn.commit()
-            print(f"Se eliminaron {len(ids_to_delete)} registros de la base de datos.")
+        # Las imágenes compartidas con análisis duplicados que siguen vivos se conservan
+        urls_to_delete = unreferenced_urls(cur, analysis_image_urls(expired_items))
+        conn.commit()
+        log.info("Se eliminaron %s registros de la base de datos.", len(expired_items))
+        delete_images(urls_to_delete)
 
     except Exception as e:
-        print(f"Ocurrió un error durante el proceso de limpieza: {e}")
+        log.exception("Ocurrió un error durante el proceso de limpieza: %s", e)
     finally:
         if cur:
             cur.close()
         if conn:
             conn.close()
-        print("--- Proceso de limpieza finalizado ---")
+        log.info("Proceso de limpieza finalizado")
+
+def retry_failed_deletions():
+    """
+    Reintenta los borrados de Firebase Storage que fallaron (p. ej. con el
+    circuito abierto) y quedaron en imagenes_por_borrar. Las imágenes que
+    algún análisis vuelve a usar se quitan de la cola sin borrarlas; las que
+    vuelven a fallar se reprograman con una espera mayor.
+    """
+    conn = None
+    try:
+        init_firebase()
+        conn = repository.connect_script()
+        cur = conn.cursor()
+        pending = repository.pending_image_deletions(cur, Config.DELETE_RETRY_BATCH)
+        if not pending:
+            conn.commit()
+            return
+        urls = [row[0] for row in pending]
+        urls_to_delete = unreferenced_urls(cur, urls)
+        conn.commit()
+        deleted = delete_images(urls_to_delete)
+        forgotten = repository.forget_image_deletions(cur, urls, pending[0][1])
+        conn.commit()
+        cur.close()
+        log.info(
+            "Reintento de borrados: %s pendientes, %s borrados, %s siguen en la cola.",
+            len(urls), deleted, len(urls) - forgotten
+        )
+    except Exception as e:
+        log.exception("Ocurrió un error al reintentar los borrados pendientes: %s", e)
+    finally:
+        if conn:
+            conn.close()
+
+def expire_image_reservations():
+    """
+    Quita las reservas caducadas de imágenes reutilizadas por /analyze y
+    borra de Firebase Storage las que ya no usa ningún análisis guardado.
+    """
+    conn = None
+    try:
+        init_firebase()
+        conn = repository.connect_script()
+        cur = conn.cursor()
+        urls_to_delete = expire_reservations(cur, Config.DELETE_RETRY_BATCH)
+        conn.commit()
+        cur.close()
+        deleted = delete_images(urls_to_delete)
+        log.info("Reservas de imágenes caducadas: %s imágenes sin usar, %s borradas.", len(urls_to_delete), deleted)
+    except Exception as e:
+        log.exception("Ocurrió un error al caducar las reservas de imágenes: %s", e)
+    finally:
+        if conn:
+            conn.close()
+
 
 if __name__ == '__main__':
-    cleanup_expired_items()
\ No newline at end of file
+    setup_logging()
+    # Un identificador por ejecución para agrupar sus mensajes
+    set_request_id()
+    cleanup_expired_items()
+    expire_image_reservations()
+    retry_failed_deletions()
\ No newline at end of file
@@ -39,4 +39,211 @@ class Config:
 
     # Claves para el servicio de Roboflow
     ROBOFLOW_API_KEY = os.environ.get('ROBOFLOW_API_KEY')
-    ROBOFLOW_MODEL_ID = os.environ.get('ROBOFLOW_MODEL_ID')
\ No newline at end of file
+    ROBOFLOW_MODEL_ID = os.environ.get('ROBOFLOW_MODEL_ID')
+    ROBOFLOW_API_URL = os.environ.get('ROBOFLOW_API_URL', 'https://detect.roboflow.com')
+    # Servidor de inferencia de Roboflow (propio o https://serverless.roboflow.com)
+    # para enviar lotes de imágenes; solo se usa con INFERENCE_BATCH_WINDOW_MS > 0
+    ROBOFLOW_INFERENCE_URL = os.environ.get('ROBOFLOW_INFERENCE_URL', '').rstrip('/')
+
+    # Sesión HTTP compartida (descargas de Firebase e inferencia de Roboflow)
+    HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 5))
+    HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', 30))
+    HTTP_RETRIES = int(os.environ.get('HTTP_RETRIES', 3))
+    HTTP_BACKOFF_FACTOR = float(os.environ.get('HTTP_BACKOFF_FACTOR', 0.5))
+    HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 16))
+
+    # Variantes WebP de las imágenes de análisis (lado mayor en píxeles)
+    THUMBNAIL_SIZE = int(os.environ.get('THUMBNAIL_SIZE', 256))
+    MEDIUM_SIZE = int(os.environ.get('MEDIUM_SIZE', 1024))
+    WEBP_QUALITY = int(os.environ.get('WEBP_QUALITY', 80))
+    BACKFILL_WORKERS = int(os.environ.get('BACKFILL_WORKERS', os.cpu_count() or 2))
+
+    # Máximo de análisis por petición en las operaciones masivas de papelera
+    BULK_MAX_BATCH = int(os.environ.get('BULK_MAX_BATCH', 500))
+
+    # Máximo de cambios por respuesta de /history/sync
+    SYNC_PAGE_SIZE = int(os.environ.get('SYNC_PAGE_SIZE', 500))
+
+    # Compresión de respuestas (solo por encima del umbral, en bytes)
+    COMPRESSION_MIN_BYTES = int(os.environ.get('COMPRESSION_MIN_BYTES', 1024))
+    GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', 6))
+    BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', 5))
+
+    # Límite de peticiones por usuario y ruta ('memory' por worker o 'postgres' compartido)
+    RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+    RATE_LIMIT_ANALYZE_BURST = int(os.environ.get('RATE_LIMIT_ANALYZE_BURST', 5))
+    RATE_LIMIT_ANALYZE_PER_MINUTE = float(os.environ.get('RATE_LIMIT_ANALYZE_PER_MINUTE', 10))
+
+    # Inferencias simultáneas por worker antes de rechazar con 429. Con
+    # INFLIGHT_BACKEND=postgres hay además un tope para todos los workers
+    # juntos; cada hueco se reserva por INFLIGHT_LEASE_SECONDS como mucho
+    MAX_INFLIGHT_INFERENCES = int(os.environ.get('MAX_INFLIGHT_INFERENCES', 4))
+    INFLIGHT_RETRY_AFTER = int(os.environ.get('INFLIGHT_RETRY_AFTER', 5))
+    INFLIGHT_BACKEND = os.environ.get('INFLIGHT_BACKEND', 'memory')
+    MAX_INFLIGHT_INFERENCES_GLOBAL = int(os.environ.get('MAX_INFLIGHT_INFERENCES_GLOBAL', 16))
+    INFLIGHT_LEASE_SECONDS = int(os.environ.get('INFLIGHT_LEASE_SECONDS', 180))
+
+    # Circuit breakers de Roboflow y Firebase Storage
+    BREAKER_WINDOW_SECONDS = int(os.environ.get('BREAKER_WINDOW_SECONDS', 60))
+    BREAKER_MIN_CALLS = int(os.environ.get('BREAKER_MIN_CALLS', 5))
+    BREAKER_FAILURE_RATIO = float(os.environ.get('BREAKER_FAILURE_RATIO', 0.5))
+    BREAKER_SLOW_CALL_RATIO = float(os.environ.get('BREAKER_SLOW_CALL_RATIO', 0.5))
+    BREAKER_OPEN_SECONDS = int(os.environ.get('BREAKER_OPEN_SECONDS', 30))
+    INFERENCE_SLOW_SECONDS = float(os.environ.get('INFERENCE_SLOW_SECONDS', 15))
+    STORAGE_SLOW_SECONDS = float(os.environ.get('STORAGE_SLOW_SECONDS', 10))
+    STORAGE_TIMEOUT = float(os.environ.get('STORAGE_TIMEOUT', 20))
+
+    # Deduplicación de imágenes: distancia de Hamming máxima entre dHash para
+    # considerar dos imágenes casi iguales, y cada cuánto se refresca el índice
+    DUPLICATE_MAX_DISTANCE = int(os.environ.get('DUPLICATE_MAX_DISTANCE', 6))
+    DUPLICATE_INDEX_REFRESH = int(os.environ.get('DUPLICATE_INDEX_REFRESH', 30))
+    # Segundos que una imagen reutilizada por /analyze queda reservada para
+    # el usuario (y a salvo del borrado) mientras no guarda el análisis
+    IMAGE_REUSE_LEASE_SECONDS = int(os.environ.get('IMAGE_REUSE_LEASE_SECONDS', 86400))
+
+    # Máximo de tratamientos por petición en el modo por lotes de /calculate_dose
+    DOSE_BATCH_MAX = int(os.environ.get('DOSE_BATCH_MAX', 200))
+    # Segundos que cada worker sirve la tabla de dosis sin comprobar su
+    # versión en la base de datos: lo que tarda como mucho en verse un cambio
+    # de tratamientos (0 = comprobar en cada petición)
+    DOSE_TABLE_CHECK_SECONDS = float(os.environ.get('DOSE_TABLE_CHECK_SECONDS', 5))
+
+    # Arranque: cargar los módulos pesados al importar la app (para el
+    # proceso maestro de gunicorn con preload_app) y presupuesto de tiempo de
+    # importación que comprueba bench_startup.py
+    PRELOAD_HEAVY_MODULES = os.environ.get('PRELOAD_HEAVY_MODULES', 'false').lower() in ('1', 'true', 'yes')
+    IMPORT_BUDGET_MS = int(os.environ.get('IMPORT_BUDGET_MS', 250))
+
+    # Servidor gunicorn (gunicorn.conf.py): procesos, hilos, reciclado de
+    # workers y tiempos de espera. Las peticiones de /analyze pueden tardar
+    # bastante, así que el apagado ordenado les deja tiempo de terminar.
+    PORT = int(os.environ.get('PORT', 5001))
+    WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', (os.cpu_count() or 1) + 1))
+    WEB_THREADS = int(os.environ.get('WEB_THREADS', max(8, 2 * MAX_INFLIGHT_INFERENCES)))
+    WEB_MAX_REQUESTS = int(os.environ.get('WEB_MAX_REQUESTS', 1000))
+    WEB_MAX_REQUESTS_JITTER = int(os.environ.get('WEB_MAX_REQUESTS_JITTER', 100))
+    WEB_MAX_RSS_MB = int(os.environ.get('WEB_MAX_RSS_MB', 512))
+    WEB_TIMEOUT = int(os.environ.get('WEB_TIMEOUT', 120))
+    WEB_GRACEFUL_TIMEOUT = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', 90))
+
+    # Hilos para el trabajo de E/S en paralelo (descargas, inferencia,
+    # Storage), compartidos por todos los hilos del worker. Una petición
+    # tiene como mucho IO_FANOUT tareas a la vez en el pool (/analyze con dos
+    # imágenes subidas: subida y predicción de cada cara; los borrados de
+    # imágenes se reparten en IO_FANOUT tareas), así que con IO_WORKERS =
+    # IO_FANOUT * WEB_THREADS ninguna espera a las de otras peticiones aunque
+    # estén todos los hilos ocupados. Medido con bench_concurrency.py
+    IO_FANOUT = int(os.environ.get('IO_FANOUT', 4))
+    IO_WORKERS = int(os.environ.get('IO_WORKERS', IO_FANOUT * WEB_THREADS))
+
+    # /health: tiempo máximo de la consulta de comprobación a la base de datos
+    HEALTH_DB_TIMEOUT_MS = int(os.environ.get('HEALTH_DB_TIMEOUT_MS', 2000))
+
+    # /admin/search: máximo de resultados por página
+    SEARCH_MAX_PAGE_SIZE = int(os.environ.get('SEARCH_MAX_PAGE_SIZE', 100))
+    # Usuarios más parecidos cuyos análisis se incluyen al buscar análisis
+    SEARCH_MAX_USER_MATCHES = int(os.environ.get('SEARCH_MAX_USER_MATCHES', 500))
+
+    # Política de decisión de los análisis con frente y reverso ('completa',
+    # 'anticipada' o 'secuencial', ver decision_policy.py) y confianza a partir
+    # de la cual una plaga en el frente decide sin esperar al reverso (0 la
+    # desactiva; validar con replay_decisions.py antes de activarla)
+    DECISION_POLICY = os.environ.get('DECISION_POLICY', 'anticipada')
+    DECISION_FRONT_MIN_CONFIDENCE = float(os.environ.get('DECISION_FRONT_MIN_CONFIDENCE', 0))
+
+    # analisis particionada por mes de borrado: meses de papelera que se
+    # crean por adelantado (cleanup_script.py y partition_analisis.py)
+    ANALYSIS_PARTITIONS_AHEAD = int(os.environ.get('ANALYSIS_PARTITIONS_AHEAD', 3))
+    # Al eliminar una partición caducada, espera máxima del bloqueo breve que
+    # la separa de analisis y cuántas veces se intenta antes de dejarla para
+    # la siguiente ejecución
+    ANALYSIS_DETACH_LOCK_TIMEOUT_MS = int(os.environ.get('ANALYSIS_DETACH_LOCK_TIMEOUT_MS', 2000))
+    ANALYSIS_DETACH_ATTEMPTS = int(os.environ.get('ANALYSIS_DETACH_ATTEMPTS', 3))
+
+    # Réplicas de lectura (streaming replication) para las rutas de solo
+    # lectura, separadas por comas; vacío = todo va al primario (ver
+    # db_routing.py). Una réplica con más retraso que el máximo se descarta;
+    # su estado se comprueba como mucho cada REPLICA_STATUS_SECONDS.
+    REPLICA_DATABASE_URLS = [
+        url.strip().replace("postgres://", "postgresql://", 1)
+        for url in os.environ.get('REPLICA_DATABASE_URLS', '').split(',') if url.strip()
+    ]
+    REPLICA_MAX_LAG_SECONDS = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', 5))
+    REPLICA_STATUS_SECONDS = float(os.environ.get('REPLICA_STATUS_SECONDS', 1))
+    REPLICA_CONNECT_TIMEOUT = int(os.environ.get('REPLICA_CONNECT_TIMEOUT', 2))
+    # Lectura de lo propio escrito: durante READ_YOUR_WRITES_SECONDS tras una
+    # escritura, el usuario solo lee de réplicas que ya la tienen. 'postgres'
+    # comparte las marcas entre workers en la tabla escrituras_recientes (una
+    # consulta más al primario por lectura); 'memory' las guarda por worker y
+    # solo vale con un worker (gunicorn.conf.py no arranca con más).
+    # Comprobación: check_read_your_writes.py
+    READ_YOUR_WRITES_BACKEND = os.environ.get('READ_YOUR_WRITES_BACKEND', 'postgres')
+    READ_YOUR_WRITES_SECONDS = float(os.environ.get('READ_YOUR_WRITES_SECONDS', 30))
+
+    # Evaluación en sombra (shadow.py): con SHADOW_MODEL_ID, una fracción
+    # SHADOW_SAMPLE_RATE de las imágenes de /analyze se predice también con
+    # ese modelo candidato después de responder; como mucho SHADOW_QUEUE_SIZE
+    # imágenes esperan (el resto se descarta) y SHADOW_WORKERS hilos por worker
+    # las procesan. Se compara con shadow_report.py
+    SHADOW_MODEL_ID = os.environ.get('SHADOW_MODEL_ID', '')
+    SHADOW_SAMPLE_RATE = float(os.environ.get('SHADOW_SAMPLE_RATE', 0.1))
+    SHADOW_QUEUE_SIZE = int(os.environ.get('SHADOW_QUEUE_SIZE', 50))
+    SHADOW_WORKERS = int(os.environ.get('SHADOW_WORKERS', 1))
+
+    # Acceso a datos (repository.py): conexiones reutilizables por destino
+    # (una por hilo de petición, de io_executor y de la evaluación en sombra,
+    # que así nunca deja a una petición esperando), espera máxima por una
+    # libre y segundos sin uso tras los que se comprueba que sigue viva antes
+    # de prestarla; statement_timeout por clase de ruta en ms (0 = sin límite); con
+    # QUERY_BUDGET_STRICT=true una ruta que hace más consultas que su
+    # presupuesto falla en lugar de solo avisar (para las pruebas)
+    DB_POOL_SIZE = int(os.environ.get(
+        'DB_POOL_SIZE', WEB_THREADS + IO_WORKERS + (SHADOW_WORKERS if SHADOW_MODEL_ID else 0)
+    ))
+    DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 5))
+    DB_POOL_PING_SECONDS = float(os.environ.get('DB_POOL_PING_SECONDS', 5))
+    QUERY_TIMEOUT_READ_MS = int(os.environ.get('QUERY_TIMEOUT_READ_MS', 3000))
+    QUERY_TIMEOUT_WRITE_MS = int(os.environ.get('QUERY_TIMEOUT_WRITE_MS', 5000))
+    QUERY_TIMEOUT_ADMIN_MS = int(os.environ.get('QUERY_TIMEOUT_ADMIN_MS', 15000))
+    QUERY_TIMEOUT_BACKGROUND_MS = int(os.environ.get('QUERY_TIMEOUT_BACKGROUND_MS', 30000))
+    QUERY_TIMEOUT_MAINTENANCE_MS = int(os.environ.get('QUERY_TIMEOUT_MAINTENANCE_MS', 0))
+    QUERY_BUDGET_STRICT = os.environ.get('QUERY_BUDGET_STRICT', 'false').lower() in ('1', 'true', 'yes')
+
+    # Registro estructurado (structured_logging.py): una línea JSON por
+    # mensaje ('texto' para leerlo en local), escrita desde un hilo aparte a
+    # través de una cola de LOG_QUEUE_SIZE mensajes. LOG_SAMPLE_RATES fija qué
+    # fracción de los INFO de cada logger se conserva (logger=fracción,
+    # separados por comas), p. ej. el borrado de cada imagen en Storage
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
+    LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+    LOG_SAMPLE_RATES = os.environ.get('LOG_SAMPLE_RATES', 'storage_utils.borrado=0.1')
+
+    # Perfilado bajo demanda (profiling.py, rutas /admin/profile/*): duración
+    # máxima de un muestreo de pilas, fracción inicial de peticiones perfiladas
+    # con cProfile (0 = ninguna; se cambia en caliente por worker), cuántos
+    # perfiles se guardan y profundidad de pila de tracemalloc
+    PROFILE_MAX_SECONDS = float(os.environ.get('PROFILE_MAX_SECONDS', 60))
+    PROFILE_REQUEST_RATE = float(os.environ.get('PROFILE_REQUEST_RATE', 0))
+    PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', 20))
+    PROFILE_TRACEMALLOC_FRAMES = int(os.environ.get('PROFILE_TRACEMALLOC_FRAMES', 10))
+
+    # Resumen del panel de administración (/admin/summary): segundos que se
+    # sirve desde memoria antes de recalcularlo en segundo plano
+    ADMIN_SUMMARY_TTL = float(os.environ.get('ADMIN_SUMMARY_TTL', 30))
+
+    # Agrupamiento de inferencias (batching.py): las imágenes que llegan al
+    # worker en una ventana de INFERENCE_BATCH_WINDOW_MS (0 = desactivado,
+    # una llamada por imagen) se envían juntas, hasta INFERENCE_BATCH_MAX_SIZE
+    # por lote y con INFERENCE_BATCH_CONCURRENCY lotes en curso a la vez.
+    # INFERENCE_BATCH_TIMEOUT: segundos que una petición espera su resultado
+    # (cola, lote y reintentos por imagen) antes de fallar. Ajustar con
+    # bench_batching.py
+    INFERENCE_BATCH_WINDOW_MS = float(os.environ.get('INFERENCE_BATCH_WINDOW_MS', 0))
+    INFERENCE_BATCH_MAX_SIZE = int(os.environ.get('INFERENCE_BATCH_MAX_SIZE', 8))
+    INFERENCE_BATCH_CONCURRENCY = int(os.environ.get('INFERENCE_BATCH_CONCURRENCY', 2))
+    INFERENCE_BATCH_TIMEOUT = float(os.environ.get('INFERENCE_BATCH_TIMEOUT', 60))
+
+    # Borrados de Firebase Storage que fallaron (imagenes_por_borrar):
+    # cuántos reintenta cleanup_script.py en cada ejecución
+    DELETE_RETRY_BATCH = int(os.environ.get('DELETE_RETRY_BATCH', 1000))
@@ -0,0 +1,397 @@
+# backend/db_routing.py
+
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import deque
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+import metrics
+
+log = logging.getLogger(__name__)
+
+# Las rutas de solo lectura pueden ir a una réplica (streaming replication)
+# en lugar de al primario. Para cada lectura:
+#   - si el usuario escribió hace poco, solo vale una réplica que ya haya
+#     aplicado su escritura (lectura de lo propio escrito); si no, primario
+#   - una réplica con más retraso que el máximo, o que no responde, se
+#     descarta hasta la siguiente comprobación
+#   - si no queda ninguna réplica válida, se lee del primario
+# El estado de cada réplica (retraso y posición de WAL aplicada) se
+# consulta como mucho una vez cada `status_seconds` por worker. Las
+# conexiones de cada destino se reutilizan (ConnectionPool), de modo que las
+# sentencias preparadas en el servidor sobreviven entre peticiones.
+PRIMARY = "primario"
+
+_STATUS_SQL = """
+    SELECT
+        CASE WHEN pg_is_in_recovery() THEN pg_last_wal_replay_lsn() ELSE pg_current_wal_lsn() END::text,
+        CASE
+            WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE EXTRACT(EPOCH FROM clock_timestamp() - pg_last_xact_replay_timestamp())
+        END
+"""
+
+
+def lsn_to_int(lsn):
+    """Convierte una posición de WAL ('16/B374D848') en un entero comparable."""
+    if lsn is None:
+        return None
+    high, low = lsn.split("/")
+    return (int(high, 16) << 32) + int(low, 16)
+
+
+class PooledConnection:
+    """
+    Préstamo de una conexión de ConnectionPool. close() la devuelve al pool
+    en lugar de cerrarla y registra el tiempo que ha estado en uso contra su
+    destino. Cada préstamo tiene su número (`lease`): quien guarda la
+    conexión para cerrarla más tarde solo debe hacerlo si el número no ha
+    cambiado, porque entretanto otro hilo puede haberla pedido al pool.
+
+    No depende de libpq: RoutedConnection la combina con la conexión de
+    psycopg2 y las pruebas con una conexión falsa.
+    """
+
+    target = PRIMARY
+    pool = None
+    opened_at = None
+    lease = 0
+    # Momento (time.monotonic) en que volvió al pool
+    idle_since = 0.0
+    # Se cierra al devolverla en lugar de reutilizarla
+    discard = False
+
+    def close(self):
+        if self.opened_at is None:
+            # Ya devuelta al pool (o nunca prestada): cerrarla otra vez no hace nada
+            if self.pool is None:
+                super().close()
+            return
+        metrics.observe(f"db.read.{self.target}", time.perf_counter() - self.opened_at)
+        self.opened_at = None
+        if self.pool is not None:
+            self.pool.put(self)
+        else:
+            super().close()
+
+
+class RoutedConnection(PooledConnection, psycopg2.extensions.connection):
+    """Conexión de psycopg2 que se presta desde un ConnectionPool."""
+
+    def internal_cursor(self):
+        """Cursor para las consultas propias del enrutado, que no cuentan como consultas de la ruta."""
+        return psycopg2.extensions.connection.cursor(self)
+
+
+class ConnectionPool:
+    """
+    Conexiones reutilizables a un destino. Si están todas en uso, get()
+    espera hasta `timeout` segundos y después lanza PoolError.
+
+    Una conexión que lleva más de `ping_seconds` sin usarse se comprueba
+    (SELECT 1) antes de prestarla: si el servidor la cerró (reinicio,
+    failover, corte por inactividad) se descarta y se prueba la siguiente o
+    se abre una nueva, en lugar de que falle la ruta. Las usadas hace menos
+    se prestan sin comprobar; si fallan, put() ya no las devuelve al pool.
+    """
+
+    def __init__(self, target, dsn, size, timeout, connection_factory=RoutedConnection, ping_seconds=None,
+                 **connect_kwargs):
+        self.target = target
+        self.dsn = dsn
+        self.timeout = timeout
+        self.ping_seconds = ping_seconds
+        self._connection_factory = connection_factory
+        self._connect_kwargs = connect_kwargs
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._idle = deque()
+        self._pid = os.getpid()
+        # Conexiones heredadas del proceso padre (gunicorn con preload_app):
+        # no se usan ni se cierran, porque el socket es del padre
+        self._inherited = []
+
+    def get(self):
+        if os.getpid() != self._pid:
+            with self._lock:
+                self._inherited.extend(self._idle)
+                self._idle.clear()
+                self._pid = os.getpid()
+        if not self._slots.acquire(timeout=self.timeout):
+            metrics.increment(f"db.pool.{self.target}.agotado")
+            raise psycopg2.pool.PoolError(f"No hay conexiones libres con {self.target}")
+        try:
+            conn = self._idle_connection()
+            if conn is None:
+                start = time.perf_counter()
+                conn = psycopg2.connect(self.dsn, connection_factory=self._connection_factory, **self._connect_kwargs)
+                metrics.observe(f"db.connect.{self.target}", time.perf_counter() - start)
+                conn.target = self.target
+                conn.pool = self
+        except BaseException:
+            self._slots.release()
+            raise
+        # Antes que opened_at: quien vea la conexión prestada ve ya el préstamo nuevo
+        conn.lease += 1
+        conn.opened_at = time.perf_counter()
+        return conn
+
+    def _idle_connection(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None
+                conn = self._idle.pop()
+            if self.ping_seconds is None or time.monotonic() - conn.idle_since < self.ping_seconds:
+                return conn
+            try:
+                # En autocommit el SELECT no deja una transacción abierta
+                conn.autocommit = True
+                cur = conn.internal_cursor()
+                cur.execute("SELECT 1")
+                cur.close()
+                conn.autocommit = False
+                return conn
+            except psycopg2.Error as e:
+                metrics.increment(f"db.pool.{self.target}.descartada")
+                log.warning("Conexión con %s cerrada por el servidor; se descarta: %s", self.target, e)
+                conn.pool = None
+                conn.close()
+
+    def put(self, conn):
+        reusable = not conn.closed and not conn.discard
+        if reusable:
+            try:
+                if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                if conn.autocommit:
+                    conn.autocommit = False
+            except psycopg2.Error:
+                reusable = False
+        if reusable:
+            conn.idle_since = time.monotonic()
+            with self._lock:
+                self._idle.append(conn)
+        else:
+            conn.pool = None
+            conn.close()
+        self._slots.release()
+
+
+class MemoryWriteMarks:
+    """Últimas escrituras de cada usuario en memoria del proceso: cada worker lleva las suyas."""
+
+    def __init__(self, window_seconds):
+        self.window_seconds = window_seconds
+        self._lock = threading.Lock()
+        self._marks = {}
+
+    def mark(self, conn, user_id):
+        cur = conn.internal_cursor()
+        cur.execute("SELECT pg_current_wal_insert_lsn()::text")
+        lsn = lsn_to_int(cur.fetchone()[0])
+        cur.close()
+        now = time.monotonic()
+        with self._lock:
+            self._marks[user_id] = (lsn, now)
+            # Pasada la ventana cualquier réplica válida ya tiene la escritura
+            if len(self._marks) > 1000:
+                self._marks = {
+                    key: (value, marked) for key, (value, marked) in self._marks.items()
+                    if now - marked < self.window_seconds
+                }
+        return lsn
+
+    def required_lsn(self, user_id):
+        with self._lock:
+            lsn, marked = self._marks.get(user_id, (None, 0.0))
+        if lsn is None or time.monotonic() - marked >= self.window_seconds:
+            return None
+        return lsn
+
+
+class PostgresWriteMarks:
+    """
+    Últimas escrituras de cada usuario compartidas por todos los workers, en
+    la tabla UNLOGGED escrituras_recientes del primario (no se replica ni
+    genera WAL). Cuesta una consulta al primario por lectura.
+    """
+
+    def __init__(self, connection_factory, window_seconds):
+        self._connection_factory = connection_factory
+        self.window_seconds = window_seconds
+
+    def mark(self, conn, user_id):
+        cur = conn.internal_cursor()
+        cur.execute(
+            """
+            INSERT INTO escrituras_recientes (id_usuario, lsn, fecha)
+            VALUES (%s, pg_current_wal_insert_lsn(), clock_timestamp())
+            ON CONFLICT (id_usuario) DO UPDATE SET lsn = EXCLUDED.lsn, fecha = EXCLUDED.fecha
+            RETURNING lsn::text
+            """,
+            (user_id,)
+        )
+        lsn = lsn_to_int(cur.fetchone()[0])
+        conn.commit()
+        cur.close()
+        return lsn
+
+    def required_lsn(self, user_id):
+        conn = self._connection_factory()
+        try:
+            cur = conn.internal_cursor()
+            cur.execute(
+                "SELECT lsn::text FROM escrituras_recientes "
+                "WHERE id_usuario = %s AND fecha > clock_timestamp() - make_interval(secs => %s)",
+                (user_id, self.window_seconds)
+            )
+            row = cur.fetchone()
+            cur.close()
+        finally:
+            conn.close()
+        return lsn_to_int(row[0]) if row else None
+
+
+class ReplicaRouter:
+    """Reparte las lecturas entre las réplicas y el primario."""
+
+    def __init__(self, primary_dsn, replica_dsns, max_lag_seconds, status_seconds,
+                 connect_timeout, write_marks_backend="memory", read_your_writes_seconds=30,
+                 pool_size=10, pool_timeout=5, connection_factory=RoutedConnection, pool_ping_seconds=None):
+        self.primary_dsn = primary_dsn
+        # Las métricas usan "replica1", "replica2"... para no exponer las DSN
+        self.replicas = [(f"replica{i}", dsn) for i, dsn in enumerate(replica_dsns, start=1)]
+        self._pools = {
+            PRIMARY: ConnectionPool(PRIMARY, primary_dsn, pool_size, pool_timeout, connection_factory, pool_ping_seconds)
+        }
+        for name, dsn in self.replicas:
+            self._pools[name] = ConnectionPool(
+                name, dsn, pool_size, pool_timeout, connection_factory, pool_ping_seconds,
+                connect_timeout=connect_timeout
+            )
+        self.max_lag_seconds = max_lag_seconds
+        self.status_seconds = status_seconds
+        self.connect_timeout = connect_timeout
+        if write_marks_backend == "postgres":
+            self.write_marks = PostgresWriteMarks(self._connect_primary, read_your_writes_seconds)
+        else:
+            self.write_marks = MemoryWriteMarks(read_your_writes_seconds)
+        self._lock = threading.Lock()
+        # nombre -> (lsn aplicada, retraso en segundos, disponible, momento de la comprobación)
+        self._status = {}
+        self._next = itertools.count()
+
+    def _connect_primary(self):
+        return self._pools[PRIMARY].get()
+
+    def primary_connection(self):
+        """Conexión al primario, para escrituras y lecturas que no pueden ir a una réplica."""
+        return self._connect_primary()
+
+    def _set_status(self, name, lsn, lag, available):
+        with self._lock:
+            self._status[name] = (lsn, lag, available, time.monotonic())
+        if lag is not None and lag != float("inf"):
+            metrics.set_gauge(f"db.{name}.lag_s", round(lag, 3))
+
+    def _refresh_status(self, name, conn):
+        cur = conn.internal_cursor()
+        cur.execute(_STATUS_SQL)
+        lsn, lag = cur.fetchone()
+        cur.close()
+        # La ruta empieza después en su propia transacción
+        conn.rollback()
+        # Sin transacciones aplicadas aún no se puede medir el retraso
+        lag = float(lag) if lag is not None else float("inf")
+        lsn = lsn_to_int(lsn)
+        self._set_status(name, lsn, lag, lag <= self.max_lag_seconds)
+        return lsn, lag
+
+    def _try_replica(self, name, required_lsn):
+        with self._lock:
+            status = self._status.get(name)
+        fresh = status is not None and time.monotonic() - status[3] < self.status_seconds
+        if fresh and not status[2]:
+            return None, "retraso" if status[1] is not None else "caida"
+
+        try:
+            conn = self._pools[name].get()
+        except psycopg2.pool.PoolError:
+            return None, "ocupada"
+        except psycopg2.OperationalError as e:
+            log.warning("Réplica %s no disponible: %s", name, e)
+            self._set_status(name, None, None, False)
+            return None, "caida"
+
+        try:
+            lsn = status[0] if fresh else None
+            if not fresh or (required_lsn is not None and (lsn is None or lsn < required_lsn)):
+                lsn, lag = self._refresh_status(name, conn)
+                if lag > self.max_lag_seconds:
+                    conn.close()
+                    return None, "retraso"
+            if required_lsn is not None and (lsn is None or lsn < required_lsn):
+                conn.close()
+                return None, "lectura_propia"
+        except psycopg2.Error as e:
+            log.warning("Error al comprobar la réplica %s: %s", name, e)
+            conn.discard = True
+            conn.close()
+            self._set_status(name, None, None, False)
+            return None, "caida"
+        return conn, None
+
+    def read_connection(self, user_id=None):
+        """
+        Conexión para una ruta de solo lectura. Con `user_id`, garantiza que
+        se ven las escrituras recientes de ese usuario.
+        """
+        if not self.replicas:
+            metrics.increment(f"db.route.{PRIMARY}")
+            return self._connect_primary()
+
+        required_lsn = self.write_marks.required_lsn(user_id) if user_id is not None else None
+        first = next(self._next)
+        for offset in range(len(self.replicas)):
+            name, _ = self.replicas[(first + offset) % len(self.replicas)]
+            conn, reason = self._try_replica(name, required_lsn)
+            if conn is not None:
+                metrics.increment(f"db.route.{name}")
+                return conn
+            metrics.increment(f"db.route.descartada.{reason}")
+
+        metrics.increment(f"db.route.{PRIMARY}")
+        return self._connect_primary()
+
+    def record_write(self, conn, user_id):
+        """
+        Anota la posición de WAL del primario tras el commit de una escritura
+        del usuario, para que sus próximas lecturas la vean.
+        """
+        if not self.replicas or user_id is None:
+            return
+        try:
+            self.write_marks.mark(conn, user_id)
+        except psycopg2.Error as e:
+            # Sin marca, la lectura puede ir a una réplica algo atrasada, pero
+            # la escritura ya está confirmada
+            log.warning("No se pudo anotar la escritura del usuario %s: %s", user_id, e)
+            conn.rollback()
+
+    def status(self):
+        """Estado conocido de cada réplica, para /admin/metrics."""
+        with self._lock:
+            now = time.monotonic()
+            return {
+                name: {
+                    "retraso_s": None if lag is None or lag == float("inf") else round(lag, 3),
+                    "disponible": available,
+                    "comprobada_hace_s": round(now - checked, 1),
+                }
+                for name, (lsn, lag, available, checked) in self._status.items()
+            }
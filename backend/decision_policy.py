@@ -0,0 +1,116 @@
+# backend/decision_policy.py
+
+import threading
+from concurrent.futures import FIRST_COMPLETED, wait
+
+NO_DETECTION = "No se detectó ninguna plaga"
+HEALTHY_PREDICTIONS = (NO_DETECTION, "Hoja sana")
+MIN_CONFIDENCE_FOR_VALID_LEAF = 0.30
+
+# 'completa': se analizan siempre las dos caras.
+# 'anticipada': las dos caras en paralelo; si la primera en terminar ya
+#     decide el resultado, se cancela la inferencia de la otra y no se la espera.
+# 'secuencial': primero el reverso; el frente solo se analiza si hace falta.
+POLICIES = ("completa", "anticipada", "secuencial")
+
+# Rutas de decisión que se devuelven en `ruta_decision`
+ROUTE_FRONT_ONLY = "solo_frente"
+ROUTE_BOTH = "ambas_caras"
+ROUTE_BACK_DISEASE = "reverso_con_plaga"
+ROUTE_FRONT_CONFIDENT = "frente_confiable"
+
+
+def is_disease(result):
+    return result["prediction"] not in HEALTHY_PREDICTIONS
+
+
+def merge_sides(result_front, result_back):
+    """
+    Combina las predicciones de las dos caras: manda la cara que muestra una
+    plaga (el reverso si son las dos) y, si ninguna la muestra, la de mayor
+    confianza.
+    """
+    if is_disease(result_back):
+        return result_back
+    if is_disease(result_front):
+        return result_front
+    return result_front if result_front["confidence"] >= result_back["confidence"] else result_back
+
+
+def displayed_prediction(result):
+    """Texto que se muestra al usuario y si la imagen parece una hoja válida."""
+    if result["prediction"] == NO_DETECTION or result["confidence"] < MIN_CONFIDENCE_FOR_VALID_LEAF:
+        return "Imagen no reconocida", False
+    return result["prediction"], True
+
+
+def deciding_route(side, result, front_min_confidence=0.0):
+    """
+    Devuelve la ruta de decisión si el resultado de una sola cara ya
+    determina el resultado final, o None si hace falta la otra cara.
+
+    Una plaga en el reverso siempre gana en merge_sides, así que decidir con
+    ella no cambia nunca la predicción. Decidir con el frente (plaga con
+    confianza >= front_min_confidence) sí puede cambiarla cuando el reverso
+    muestra otra plaga: por eso está desactivado con 0 y conviene validar el
+    umbral con replay_decisions.py antes de activarlo.
+    """
+    if result is None or not is_disease(result):
+        return None
+    if side == "reverso":
+        return ROUTE_BACK_DISEASE
+    if front_min_confidence and result["confidence"] >= front_min_confidence:
+        return ROUTE_FRONT_CONFIDENT
+    return None
+
+
+def resolve(policy, start_front, start_back=None, front_min_confidence=0.0):
+    """
+    Obtiene la predicción final de un análisis según la política indicada.
+
+    `start_front` y `start_back` lanzan la predicción de cada cara y devuelven
+    un Future; reciben `cancel`, un threading.Event que la predicción consulta
+    antes de llamar al modelo (si está activado, devuelve None sin llamarlo).
+
+    Devuelve (resultado_final, resultado_frente, resultado_reverso, ruta). El
+    resultado de una cara que no llegó a usarse es None.
+    """
+    if start_back is None:
+        result_front = start_front(cancel=None).result()
+        return result_front, result_front, None, ROUTE_FRONT_ONLY
+
+    if policy == "secuencial":
+        result_back = start_back(cancel=None).result()
+        if deciding_route("reverso", result_back):
+            return result_back, None, result_back, ROUTE_BACK_DISEASE
+        result_front = start_front(cancel=None).result()
+        return merge_sides(result_front, result_back), result_front, result_back, ROUTE_BOTH
+
+    cancel = {"frente": threading.Event(), "reverso": threading.Event()}
+    futures = {
+        start_front(cancel=cancel["frente"]): "frente",
+        start_back(cancel=cancel["reverso"]): "reverso",
+    }
+
+    if policy == "anticipada":
+        done, pending = wait(futures, return_when=FIRST_COMPLETED)
+        # Solo se decide con una cara mientras la otra sigue en curso; si
+        # terminaron las dos, se combinan como siempre.
+        if pending:
+            (future,) = done
+            side = futures[future]
+            route = deciding_route(side, future.result(), front_min_confidence)
+            if route:
+                (other,) = pending
+                cancel[futures[other]].set()
+                other.cancel()
+                result = future.result()
+                if side == "frente":
+                    return result, result, None, route
+                return result, None, result, route
+
+    results = {side: future.result() for future, side in futures.items()}
+    return (
+        merge_sides(results["frente"], results["reverso"]),
+        results["frente"], results["reverso"], ROUTE_BOTH
+    )
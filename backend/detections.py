@@ -0,0 +1,70 @@
+# backend/detections.py
+
+import base64
+import struct
+
+# Formato compacto de las detecciones de Roboflow que se guarda en JSONB.
+# En lugar de una lista de objetos con claves repetidas (y un detection_id
+# por caja), cada columna numérica va empaquetada como enteros sin signo de
+# 16 bits (little-endian) en base64; en JSONB cada número suelto ocuparía
+# bastante más:
+#   {"v": 1, "img": [ancho, alto], "clases": [...],
+#    "c": índice de clase de cada caja, "p": confianza en milésimas,
+#    "b": x, y, ancho, alto de cada caja}
+# Las cajas se redondean a píxeles enteros (centro, ancho y alto, como las
+# devuelve Roboflow) y la confianza a tres decimales.
+FORMAT_VERSION = 1
+_UINT16_MAX = 0xFFFF
+
+
+def _pack(values):
+    values = [min(max(int(round(value)), 0), _UINT16_MAX) for value in values]
+    return base64.b64encode(struct.pack(f"<{len(values)}H", *values)).decode("ascii")
+
+
+def _unpack(text):
+    data = base64.b64decode(text)
+    return struct.unpack(f"<{len(data) // 2}H", data)
+
+
+def pack_detections(prediction_result):
+    """Convierte la respuesta de Roboflow al formato compacto."""
+    predictions = prediction_result.get('predictions') or []
+    image = prediction_result.get('image') or {}
+    classes = []
+    class_index, confidences, boxes = [], [], []
+    for prediction in predictions:
+        if prediction['class'] not in classes:
+            classes.append(prediction['class'])
+        class_index.append(classes.index(prediction['class']))
+        confidences.append(prediction['confidence'] * 1000)
+        boxes.extend(prediction.get(key, 0) for key in ('x', 'y', 'width', 'height'))
+    return {
+        "v": FORMAT_VERSION,
+        "img": [round(float(image.get('width') or 0)), round(float(image.get('height') or 0))],
+        "clases": classes,
+        "c": _pack(class_index),
+        "p": _pack(confidences),
+        "b": _pack(boxes),
+    }
+
+
+def unpack_detections(packed):
+    """Devuelve el tamaño de la imagen y la lista de detecciones con los nombres de Roboflow."""
+    if packed is None:
+        return None
+    boxes = _unpack(packed["b"])
+    return {
+        "imagen": {"width": packed["img"][0], "height": packed["img"][1]},
+        "detecciones": [
+            {
+                "class": packed["clases"][class_index],
+                "confidence": confidence / 1000,
+                "x": boxes[4 * i],
+                "y": boxes[4 * i + 1],
+                "width": boxes[4 * i + 2],
+                "height": boxes[4 * i + 3],
+            }
+            for i, (class_index, confidence) in enumerate(zip(_unpack(packed["c"]), _unpack(packed["p"])))
+        ],
+    }
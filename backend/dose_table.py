@@ -0,0 +1,155 @@
+# backend/dose_table.py
+
+import math
+import threading
+import time
+import metrics
+
+
+class DoseSnapshot:
+    """
+    Copia inmutable de los parámetros de dosis de todos los tratamientos.
+    Guarda cada fila tal cual (con los Decimal de la base de datos) y además
+    columnas numpy para el cálculo vectorizado de varios tratamientos.
+    """
+
+    def __init__(self, rows, version):
+        # Importación diferida: numpy solo se carga con la primera consulta de dosis
+        import numpy as np
+        self.version = version
+        self.rows = {row['id_tratamiento']: row for row in rows}
+        self.position = {row['id_tratamiento']: i for i, row in enumerate(rows)}
+        self.product_ml = np.array([_as_float(row['dosis_por_planta_ml']) for row in rows], dtype=np.float64)
+        self.water_ml = np.array([_as_float(row['agua_por_planta_ml']) for row in rows], dtype=np.float64)
+        self.disease_ids = np.array([row['id_enfermedad'] or 0 for row in rows], dtype=np.int64)
+        self.disease_names = {row['id_enfermedad']: row['nombre_enfermedad'] for row in rows}
+
+
+def _as_float(value):
+    return math.nan if value is None else float(value)
+
+
+class DoseTable:
+    """
+    Tabla en memoria (por worker) con los parámetros de dosis. Su versión
+    se compara con la de versiones_cache, que un trigger sube con cada
+    cambio en tratamientos o enfermedades (ver
+    migrations/014_version_dosis.sql), como mucho una vez cada
+    `check_seconds`: entre comprobaciones la copia se sirve sin abrir
+    ninguna conexión, y un cambio confirmado desde cualquier worker se ve en
+    todos en menos de `check_seconds` (0 = comprobar en cada petición). Un
+    tratamiento que no aparece en la copia no obliga a recargar.
+    """
+
+    def __init__(self, connection_factory, check_seconds=0):
+        self._connection_factory = connection_factory
+        self.check_seconds = check_seconds
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._checked_at = None
+
+    def get(self):
+        with self._lock:
+            snapshot, checked_at = self._snapshot, self._checked_at
+        if snapshot is not None and time.monotonic() - checked_at < self.check_seconds:
+            metrics.increment("dose_table.hits")
+            return snapshot
+
+        checked_at = time.monotonic()
+        conn = self._connection_factory()
+        try:
+            cur = conn.cursor()
+            # La versión se lee antes que las filas: si entre medias se
+            # confirma un cambio, las filas son más nuevas que la versión y
+            # la siguiente petición solo recarga de más.
+            cur.execute("SELECT version FROM versiones_cache WHERE nombre = 'dosis'")
+            version = cur.fetchone()[0]
+            with self._lock:
+                snapshot = self._snapshot
+            if snapshot is not None and snapshot.version == version:
+                metrics.increment("dose_table.checks")
+                cur.close()
+                with self._lock:
+                    if self._snapshot is snapshot:
+                        self._checked_at = checked_at
+                return snapshot
+
+            metrics.increment("dose_table.loads")
+            rows = self._load(cur)
+            cur.close()
+        finally:
+            conn.close()
+
+        snapshot = DoseSnapshot(rows, version)
+        with self._lock:
+            # Una petición más lenta no sustituye una copia más nueva
+            if self._snapshot is None or self._snapshot.version <= version:
+                self._snapshot = snapshot
+                self._checked_at = checked_at
+        return snapshot
+
+    def _load(self, cur):
+        cur.execute(
+            """
+            SELECT t.id_tratamiento, t.id_enfermedad, t.nombre_comercial,
+                   t.dosis_por_planta_ml, t.agua_por_planta_ml,
+                   e.nombre_comun AS nombre_enfermedad
+            FROM tratamientos t
+            LEFT JOIN enfermedades e ON e.id_enfermedad = t.id_enfermedad
+            ORDER BY t.id_tratamiento
+            """
+        )
+        columns = [column[0] for column in cur.description]
+        return [dict(zip(columns, row)) for row in cur.fetchall()]
+
+
+def calculate_plan(snapshot, treatment_ids, plant_counts):
+    """
+    Calcula las dosis de varios tratamientos a la vez. Devuelve (resultados,
+    resumen_por_enfermedad). Los tratamientos que no existen o que no tienen
+    dosis completas se informan en su resultado y no cuentan en el resumen.
+    """
+    import numpy as np
+
+    known = np.array([tid in snapshot.position for tid in treatment_ids], dtype=bool)
+    positions = np.array([snapshot.position.get(tid, 0) for tid in treatment_ids], dtype=np.int64)
+    counts = np.asarray(plant_counts, dtype=np.float64)
+
+    product_ml = snapshot.product_ml[positions] * counts if len(positions) else np.empty(0)
+    water_l = snapshot.water_ml[positions] * counts / 1000 if len(positions) else np.empty(0)
+    complete = known & ~np.isnan(product_ml) & ~np.isnan(water_l)
+
+    results = []
+    for i, tid in enumerate(treatment_ids):
+        entry = {"treatment_id": tid, "plant_count": int(counts[i])}
+        if not known[i]:
+            entry["estado"] = "no_encontrado"
+        elif not complete[i]:
+            entry["estado"] = "dosis_incompleta"
+        else:
+            entry.update({
+                "estado": "ok",
+                "nombre_comercial": snapshot.rows[tid]['nombre_comercial'],
+                "id_enfermedad": snapshot.rows[tid]['id_enfermedad'],
+                "total_producto_ml": round(float(product_ml[i]), 2),
+                "total_agua_litros": round(float(water_l[i]), 2),
+            })
+        results.append(entry)
+
+    summary = []
+    if complete.any():
+        diseases = snapshot.disease_ids[positions[complete]]
+        unique, inverse = np.unique(diseases, return_inverse=True)
+        product_totals = np.bincount(inverse, weights=product_ml[complete])
+        water_totals = np.bincount(inverse, weights=water_l[complete])
+        treatments = np.bincount(inverse)
+        for j, disease_id in enumerate(unique):
+            disease_id = int(disease_id) or None
+            summary.append({
+                "id_enfermedad": disease_id,
+                "nombre_enfermedad": snapshot.disease_names.get(disease_id),
+                "tratamientos": int(treatments[j]),
+                "total_producto_ml": round(float(product_totals[j]), 2),
+                "total_agua_litros": round(float(water_totals[j]), 2),
+            })
+    return results, summary
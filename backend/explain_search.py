@@ -0,0 +1,106 @@
+# backend/explain_search.py
+
+import argparse
+import json
+import sys
+import psycopg2
+from config import Config
+from admin_search import SEARCH_QUERIES, search_params
+
+# Tablas que nunca deberían recorrerse enteras en una búsqueda
+_INDEXED_TABLES = {"usuarios", "analisis"}
+
+# Nombres, emails y ONGs variados, y predicciones con una distribución
+# sesgada (unas pocas clases son muy frecuentes), como en producción
+_SEED_SQL = """
+    INSERT INTO usuarios (nombre_completo, email, password_hash, ong)
+    SELECT nombre || ' ' || apellido || ' ' || apellido2,
+           lower(nombre || '.' || apellido) || i || '@' || dominio,
+           'x', ong
+    FROM generate_series(1, %(usuarios)s) AS i,
+    LATERAL (SELECT
+        (ARRAY['Ana', 'Luis', 'María', 'José', 'Carmen', 'Juan', 'Rosa', 'Pedro', 'Lucía', 'Miguel',
+               'Elena', 'Carlos', 'Sofía', 'Jorge', 'Marta', 'Diego', 'Paula', 'Andrés', 'Julia', 'Raúl'])
+            [1 + abs(hashint4(i)) %% 20] AS nombre,
+        (ARRAY['García', 'Rodríguez', 'López', 'Martínez', 'Hernández', 'Pérez', 'Gómez', 'Sánchez',
+               'Ramírez', 'Cruz', 'Flores', 'Morales', 'Ortiz', 'Castillo', 'Reyes', 'Vargas'])
+            [1 + abs(hashint4(i + 1)) %% 16] AS apellido,
+        (ARRAY['Mejía', 'Ruiz', 'Díaz', 'Torres', 'Rivera', 'Mendoza', 'Aguilar', 'Chávez'])
+            [1 + abs(hashint4(i + 2)) %% 8] AS apellido2,
+        (ARRAY['gmail.com', 'hotmail.com', 'yahoo.com', 'cooperativa.org', 'outlook.com'])
+            [1 + abs(hashint4(i + 3)) %% 5] AS dominio,
+        'Cooperativa ' || (ARRAY['Los Andes', 'El Progreso', 'Cafetalera', 'San Juan', 'La Esperanza',
+                                 'Montaña Verde', 'Las Flores', 'Santa Rosa'])[1 + abs(hashint4(i + 4)) %% 8]
+            || ' ' || (abs(hashint4(i + 5)) %% 40) AS ong
+    ) AS datos;
+
+    INSERT INTO analisis (id_usuario, url_imagen, resultado_prediccion, confianza, fecha_analisis)
+    SELECT u.id_usuario, 'https://example.org/' || md5(random()::text) || '.jpg',
+           (ARRAY['Roya', 'Hoja sana', 'Minador', 'Broca', 'Cercospora', 'Ojo de gallo',
+                  'Mancha de hierro', 'Antracnosis'])[1 + floor(8 * power(random(), 3))::int],
+           random(), NOW() - random() * INTERVAL '365 days'
+    FROM usuarios u, generate_series(1, %(por_usuario)s);
+
+    ANALYZE usuarios;
+    ANALYZE analisis;
+"""
+
+
+def _seq_scans(plan):
+    """Devuelve las tablas indexadas que el plan recorre con Seq Scan."""
+    found = []
+    if plan.get("Node Type") == "Seq Scan" and plan.get("Relation Name") in _INDEXED_TABLES:
+        found.append(plan["Relation Name"])
+    for child in plan.get("Plans", []):
+        found.extend(_seq_scans(child))
+    return found
+
+
+def explain_search(terms, seed_users, analyses_per_user):
+    """
+    Ejecuta EXPLAIN ANALYZE de cada consulta de /admin/search y comprueba que
+    ninguna recorre usuarios o analisis con un Seq Scan. Con --seed genera
+    datos sintéticos dentro de una transacción que se deshace al final.
+    Devuelve el número de planes que no usan índices.
+    """
+    conn = psycopg2.connect(Config.DATABASE_URI)
+    failures = 0
+    try:
+        cur = conn.cursor()
+        if seed_users:
+            print(f"Generando {seed_users} usuarios y {seed_users * analyses_per_user} análisis de prueba...")
+            cur.execute(_SEED_SQL, {"usuarios": seed_users, "por_usuario": analyses_per_user})
+
+        for tipo, query in SEARCH_QUERIES.items():
+            for term in terms:
+                cur.execute(
+                    "EXPLAIN (ANALYZE, FORMAT JSON) " + query,
+                    search_params(term, page=1, page_size=20, max_users=Config.SEARCH_MAX_USER_MATCHES)
+                )
+                result = cur.fetchone()[0]
+                plan = (result if isinstance(result, list) else json.loads(result))[0]
+                seq_scans = _seq_scans(plan["Plan"])
+                status = "❌ Seq Scan en " + ", ".join(sorted(set(seq_scans))) if seq_scans else "✅ índices"
+                print(f"{tipo:<10} {term!r:<22} {plan['Execution Time']:>9.1f} ms  {status}")
+                if seq_scans:
+                    failures += 1
+        cur.close()
+    finally:
+        # Nunca se conservan los datos sintéticos
+        conn.rollback()
+        conn.close()
+    return failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Comprueba con EXPLAIN que /admin/search usa los índices de trigramas y texto completo."
+    )
+    # Términos selectivos por defecto; un término que coincide con una gran
+    # parte de la tabla (p. ej. la enfermedad más común) puede justificar
+    # un Seq Scan.
+    parser.add_argument('terms', nargs='*', default=["antracnosis", "lucia.vargas12", "mendosa", "esperanza 17"])
+    parser.add_argument('--seed', type=int, default=0, help="Usuarios sintéticos a generar (se deshacen al final)")
+    parser.add_argument('--analyses-per-user', type=int, default=20)
+    args = parser.parse_args()
+    sys.exit(1 if explain_search(args.terms, args.seed, args.analyses_per_user) else 0)
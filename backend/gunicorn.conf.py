@@ -0,0 +1,83 @@
+# backend/gunicorn.conf.py
+# Configuración de producción: gunicorn la carga automáticamente al lanzar
+# `gunicorn app:app` desde la carpeta backend.
+
+import os
+import resource
+
+# Con preload_app el maestro importa la app una vez; precargamos también los
+# módulos pesados para que los workers los hereden al hacer fork.
+os.environ.setdefault("PRELOAD_HEAVY_MODULES", "true")
+
+from config import Config  # noqa: E402
+
+bind = f"0.0.0.0:{Config.PORT}"
+
+# Las rutas pasan casi todo el tiempo esperando a Roboflow, Firebase Storage
+# y PostgreSQL, así que usamos hilos: pocos procesos (uno por núcleo, más
+# uno) y varios hilos por proceso. Los hilos superan el tope de inferencias
+# simultáneas para que el resto de rutas siga atendiéndose mientras tanto.
+worker_class = "gthread"
+workers = Config.WEB_CONCURRENCY
+threads = Config.WEB_THREADS
+
+# Con réplicas, las marcas de lectura de lo propio escrito en memoria no se
+# ven desde los demás workers: una lectura atendida por otro worker podría
+# ir a una réplica sin la escritura
+if Config.REPLICA_DATABASE_URLS and Config.READ_YOUR_WRITES_BACKEND == "memory" and workers > 1:
+    raise RuntimeError(
+        "READ_YOUR_WRITES_BACKEND=memory no garantiza la lectura de lo propio escrito con "
+        f"{workers} workers; usa READ_YOUR_WRITES_BACKEND=postgres o WEB_CONCURRENCY=1"
+    )
+
+preload_app = True
+
+# Reciclado de workers: tras N peticiones (con jitter para que no se
+# reinicien todos a la vez) o al superar WEB_MAX_RSS_MB de memoria residente.
+max_requests = Config.WEB_MAX_REQUESTS
+max_requests_jitter = Config.WEB_MAX_REQUESTS_JITTER
+
+# Con gthread, timeout vigila el latido del worker y no la duración de cada
+# petición. graceful_timeout deja terminar los /analyze en curso al reciclar
+# o apagar un worker.
+timeout = Config.WEB_TIMEOUT
+graceful_timeout = Config.WEB_GRACEFUL_TIMEOUT
+keepalive = 5
+
+# El latido en memoria evita bloqueos del disco en contenedores
+worker_tmp_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+accesslog = "-"
+errorlog = "-"
+
+_RSS_CHECK_EVERY = 20
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def _rss_mb():
+    """Memoria residente actual del proceso en MB."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * _PAGE_SIZE / (1024 * 1024)
+    except OSError:
+        # Sin /proc (macOS): el pico de memoria es la mejor aproximación
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def post_fork(server, worker):
+    worker.requests_handled = 0
+
+
+def post_request(worker, req, environ, resp):
+    if not Config.WEB_MAX_RSS_MB:
+        return
+    worker.requests_handled = getattr(worker, "requests_handled", 0) + 1
+    if worker.requests_handled % _RSS_CHECK_EVERY:
+        return
+    rss = _rss_mb()
+    if rss > Config.WEB_MAX_RSS_MB:
+        # El worker termina las peticiones en curso y el maestro lo sustituye
+        worker.log.info(
+            "Worker %s usa %.0f MB (límite %s MB): se recicla", worker.pid, rss, Config.WEB_MAX_RSS_MB
+        )
+        worker.alive = False
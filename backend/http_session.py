@@ -0,0 +1,105 @@
+# backend/http_session.py
+
+import os
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+from config import Config
+import metrics
+
+
+class _InstrumentedConnectionMixin:
+    """Mide el tiempo de conexión (TCP + TLS) y cuenta las reutilizaciones."""
+
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        metrics.observe("http.handshake", time.perf_counter() - start)
+        metrics.increment("http.connections_opened")
+        self._requests_served = 0
+
+    def request(self, *args, **kwargs):
+        served = getattr(self, "_requests_served", 0)
+        if served:
+            metrics.increment("http.connections_reused")
+        self._requests_served = served + 1
+        metrics.increment("http.requests")
+        return super().request(*args, **kwargs)
+
+
+class _InstrumentedHTTPConnection(_InstrumentedConnectionMixin, HTTPConnection):
+    pass
+
+
+class _InstrumentedHTTPSConnection(_InstrumentedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _InstrumentedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _InstrumentedHTTPConnection
+
+
+class _InstrumentedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _InstrumentedHTTPSConnection
+
+
+class _PooledAdapter(HTTPAdapter):
+    """Adaptador con conexiones instrumentadas y timeouts por defecto."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _InstrumentedHTTPConnectionPool,
+            "https": _InstrumentedHTTPSConnectionPool,
+        }
+
+    def send(self, request, **kwargs):
+        # requests no tiene timeout por defecto: una descarga bloqueada
+        # retendría el worker indefinidamente.
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = (Config.HTTP_CONNECT_TIMEOUT, Config.HTTP_READ_TIMEOUT)
+        return super().send(request, **kwargs)
+
+
+def _build_session():
+    retry = Retry(
+        total=Config.HTTP_RETRIES,
+        backoff_factor=Config.HTTP_BACKOFF_FACTOR,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset({"GET", "HEAD", "POST", "DELETE"}),
+        raise_on_status=False,
+    )
+    adapter = _PooledAdapter(
+        pool_connections=10,
+        pool_maxsize=Config.HTTP_POOL_SIZE,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Devuelve la sesión HTTP compartida del worker actual. Se crea de forma
+    perezosa y se vuelve a crear tras un fork, para que los workers nunca
+    compartan sockets con el proceso maestro.
+    """
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _session_lock:
+            if _session is None or _session_pid != pid:
+                _session = _build_session()
+                _session_pid = pid
+    return _session
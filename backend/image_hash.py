@@ -0,0 +1,356 @@
+# backend/image_hash.py
+
+import hashlib
+import io
+import threading
+import time
+import psycopg2.extras
+
+_MASK_64 = (1 << 64) - 1
+
+
+def content_hash(image_bytes):
+    """Hash SHA-256 del contenido: identifica copias exactas de una imagen."""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def perceptual_hash(image_bytes):
+    """
+    dHash de 64 bits: compara el brillo de píxeles vecinos en una versión de
+    9x8 en escala de grises, así que sobrevive a recompresiones y cambios de
+    tamaño. Se devuelve con signo para guardarlo en una columna BIGINT.
+    """
+    # Importaciones diferidas: solo se pagan al procesar la primera imagen
+    import numpy as np
+    from PIL import Image, ImageOps
+
+    image = Image.open(io.BytesIO(image_bytes))
+    image.draft("L", (64, 64))
+    image = ImageOps.exif_transpose(image).convert("L").resize((9, 8), Image.LANCZOS)
+    pixels = np.asarray(image, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    value = int.from_bytes(np.packbits(bits).tobytes(), "big")
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def hamming(a, b):
+    return ((a ^ b) & _MASK_64).bit_count()
+
+
+class BKTree:
+    """Árbol BK sobre la distancia de Hamming para buscar hashes parecidos."""
+
+    def __init__(self):
+        self._root = None
+        self.size = 0
+
+    def add(self, key, value):
+        node = (key, value, {})
+        self.size += 1
+        if self._root is None:
+            self._root = node
+            return
+        current = self._root
+        while True:
+            distance = hamming(key, current[0])
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def search(self, key, max_distance):
+        """Devuelve [(distancia, valor)] a como mucho `max_distance`, de más a menos parecido."""
+        if self._root is None:
+            return []
+        results = []
+        pending = [self._root]
+        while pending:
+            node_key, value, children = pending.pop()
+            distance = hamming(key, node_key)
+            if distance <= max_distance:
+                results.append((distance, value))
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    pending.append(child)
+        return sorted(results)
+
+
+class DuplicateIndex:
+    """
+    Índice en memoria (por worker) de los hashes perceptuales de analisis.
+    Se carga de forma perezosa y se actualiza de forma incremental usando la
+    columna version, que cambia cada vez que se escribe una fila; las
+    lápidas de analisis_eliminados quitan los análisis borrados. Como en
+    /history/sync, solo se leen versiones ya confirmadas en orden (ver
+    migrations/010_version_transaccion.sql).
+
+    El árbol BK no admite borrados: las entradas retiradas se filtran al
+    buscar y el árbol se reconstruye cuando son muchas. La consulta a la base
+    de datos se hace sin el candado, mientras las búsquedas siguen usando el
+    índice anterior.
+    """
+
+    _CHANGES_SQL = """
+        SELECT id_analisis, phash, version FROM analisis
+        WHERE version > %(version)s
+          AND (version_xid IS NULL OR version_xid < pg_snapshot_xmin(pg_current_snapshot()))
+        UNION ALL
+        SELECT id_analisis, NULL, version FROM analisis_eliminados
+        WHERE version > %(version)s
+          AND (version_xid IS NULL OR version_xid < pg_snapshot_xmin(pg_current_snapshot()))
+        ORDER BY version
+    """
+
+    def __init__(self, connection_factory, refresh_seconds=30):
+        self._connection_factory = connection_factory
+        self._refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._tree = BKTree()
+        # id_analisis -> phash vigente; el árbol puede tener entradas retiradas
+        self._entries = {}
+        self._stale = 0
+        self._last_version = 0
+        self._last_refresh = 0.0
+        self._refreshing = False
+
+    def add(self, id_analisis, phash):
+        with self._lock:
+            self._add(id_analisis, phash)
+
+    def _add(self, id_analisis, phash):
+        current = self._entries.get(id_analisis)
+        if current == phash:
+            return
+        if current is not None:
+            self._stale += 1
+        self._entries[id_analisis] = phash
+        self._tree.add(phash, (id_analisis, phash))
+
+    def _remove(self, id_analisis):
+        if self._entries.pop(id_analisis, None) is not None:
+            self._stale += 1
+
+    def _rebuild_if_stale(self):
+        if self._stale <= max(100, len(self._entries) // 4):
+            return
+        tree = BKTree()
+        for id_analisis, phash in self._entries.items():
+            tree.add(phash, (id_analisis, phash))
+        self._tree = tree
+        self._stale = 0
+
+    def _fetch_changes(self, since):
+        conn = self._connection_factory()
+        try:
+            cur = conn.cursor()
+            cur.execute(self._CHANGES_SQL, {"version": since})
+            rows = cur.fetchall()
+            cur.close()
+        finally:
+            conn.close()
+        return rows
+
+    def _refresh(self):
+        with self._lock:
+            if self._refreshing or time.monotonic() - self._last_refresh <= self._refresh_seconds:
+                return
+            self._refreshing = True
+            since = self._last_version
+        try:
+            rows = self._fetch_changes(since)
+            with self._lock:
+                for id_analisis, phash, version in rows:
+                    if phash is None:
+                        self._remove(id_analisis)
+                    else:
+                        self._add(id_analisis, phash)
+                    self._last_version = version
+                self._rebuild_if_stale()
+                self._last_refresh = time.monotonic()
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def find_similar(self, phash, max_distance, exclude_id=None):
+        """IDs de análisis con imágenes parecidas, ordenados del más parecido al menos."""
+        self._refresh()
+        with self._lock:
+            matches = self._tree.search(phash, max_distance)
+            return [
+                id_analisis for _, (id_analisis, key) in matches
+                if id_analisis != exclude_id and self._entries.get(id_analisis) == key
+            ]
+
+
+def unreferenced_urls(cur, urls):
+    """
+    Filtra las URLs originales que ya no usa ningún análisis. Como una misma
+    imagen puede compartirse entre análisis duplicados, debe llamarse después
+    del DELETE y antes de borrar los archivos de Firebase Storage.
+    """
+    urls = [url for url in dict.fromkeys(urls) if url]
+    if not urls:
+        return []
+    cur.execute(
+        """
+        SELECT u.url FROM unnest(%s::text[]) AS u(url)
+        WHERE NOT EXISTS (SELECT 1 FROM analisis WHERE url_imagen = u.url)
+          AND NOT EXISTS (SELECT 1 FROM analisis WHERE url_imagen_reverso = u.url)
+          AND NOT EXISTS (SELECT 1 FROM imagenes_reservadas r WHERE r.url = u.url AND r.hasta > NOW())
+        """,
+        (urls,)
+    )
+    return [row[0] for row in cur.fetchall()]
+
+
+def expire_reservations(cur, limit):
+    """
+    Borra hasta `limit` reservas caducadas de imagenes_reservadas y devuelve
+    las URLs que ya no usa ningún análisis ni otra reserva vigente: son
+    imágenes que se reutilizaron para un análisis que nunca se guardó después
+    de borrar el original, y hay que borrarlas de Firebase Storage.
+    """
+    cur.execute(
+        """
+        DELETE FROM imagenes_reservadas
+        WHERE ctid IN (SELECT ctid FROM imagenes_reservadas WHERE hasta <= NOW() LIMIT %s)
+        RETURNING url
+        """,
+        (limit,)
+    )
+    return unreferenced_urls(cur, list({row[0] for row in cur.fetchall()}))
+
+
+def lookup_image(cur, image_hash, reserve_for=None, lease_seconds=None):
+    """
+    Busca una imagen ya analizada por su hash de contenido. La URL solo se
+    devuelve si algún análisis guardado (o una reserva vigente) la sigue
+    usando, para no reutilizar archivos que ya podrían haberse borrado.
+
+    Con `reserve_for` (un id_usuario) la URL devuelta queda reservada para
+    ese usuario durante `lease_seconds`: hasta que guarde su análisis nada
+    más la referencia, y unreferenced_urls() no la dejará borrar. La fila
+    del análisis que la usa se bloquea (FOR SHARE) para que un borrado
+    definitivo en curso termine antes, o espere a que la reserva exista.
+    La reserva se confirma con la transacción del cursor.
+    """
+    if reserve_for is None:
+        cur.execute(
+            """
+            SELECT modelo, resultado_prediccion, confianza,
+                   CASE WHEN EXISTS (SELECT 1 FROM analisis WHERE url_imagen = h.url_imagen)
+                          OR EXISTS (SELECT 1 FROM analisis WHERE url_imagen_reverso = h.url_imagen)
+                        THEN h.url_imagen END AS url_imagen
+            FROM imagenes_hash h
+            WHERE hash_contenido = %s
+            """,
+            (image_hash,)
+        )
+    else:
+        cur.execute(
+            """
+            WITH h AS (
+                SELECT modelo, resultado_prediccion, confianza, url_imagen
+                FROM imagenes_hash WHERE hash_contenido = %(hash)s
+            ),
+            en_uso AS (
+                SELECT h.url_imagen FROM h
+                WHERE EXISTS (
+                    SELECT 1 FROM analisis a
+                    WHERE a.url_imagen = h.url_imagen OR a.url_imagen_reverso = h.url_imagen
+                    LIMIT 1
+                    FOR SHARE OF a
+                ) OR EXISTS (
+                    SELECT 1 FROM imagenes_reservadas r WHERE r.url = h.url_imagen AND r.hasta > NOW()
+                )
+            ),
+            reserva AS (
+                INSERT INTO imagenes_reservadas (url, id_usuario, hasta)
+                SELECT url_imagen, %(user_id)s, NOW() + make_interval(secs => %(lease)s) FROM en_uso
+                ON CONFLICT (url, id_usuario) DO UPDATE SET hasta = EXCLUDED.hasta
+                RETURNING url
+            )
+            SELECT h.modelo, h.resultado_prediccion, h.confianza, (SELECT url FROM reserva) AS url_imagen
+            FROM h
+            """,
+            {"hash": image_hash, "user_id": reserve_for, "lease": lease_seconds}
+        )
+    row = cur.fetchone()
+    if row is None:
+        return None
+    modelo, prediccion, confianza, url_imagen = row
+    return {"modelo": modelo, "prediction": prediccion, "confidence": confianza, "url_imagen": url_imagen}
+
+
+def register_images(cur, images):
+    """
+    Guarda o actualiza [(hash, url, modelo, predicción, confianza, detecciones)]
+    en imagenes_hash. Las detecciones van en el formato de detections.py.
+    """
+    images = [
+        (*image[:5], psycopg2.extras.Json(image[5]) if image[5] is not None else None)
+        for image in images
+    ]
+    psycopg2.extras.execute_values(
+        cur,
+        """
+        INSERT INTO imagenes_hash (hash_contenido, url_imagen, modelo, resultado_prediccion, confianza, detecciones)
+        VALUES %s
+        ON CONFLICT (hash_contenido) DO UPDATE SET
+            -- Una URL que algún análisis sigue usando no se sustituye
+            url_imagen = CASE
+                WHEN EXISTS (SELECT 1 FROM analisis WHERE url_imagen = imagenes_hash.url_imagen)
+                  OR EXISTS (SELECT 1 FROM analisis WHERE url_imagen_reverso = imagenes_hash.url_imagen)
+                THEN imagenes_hash.url_imagen
+                ELSE COALESCE(EXCLUDED.url_imagen, imagenes_hash.url_imagen)
+            END,
+            modelo = COALESCE(EXCLUDED.modelo, imagenes_hash.modelo),
+            resultado_prediccion = COALESCE(EXCLUDED.resultado_prediccion, imagenes_hash.resultado_prediccion),
+            confianza = COALESCE(EXCLUDED.confianza, imagenes_hash.confianza),
+            detecciones = COALESCE(EXCLUDED.detecciones, imagenes_hash.detecciones)
+        """,
+        images
+    )
+
+
+def index_analysis(conn, duplicate_index, id_analisis, url_imagen, image_bytes, max_distance):
+    """
+    Calcula los hashes de la imagen del frente de un análisis y lo marca como
+    duplicado del análisis anterior más parecido, si lo hay. Si ese análisis
+    ya era un duplicado, se apunta al original. La URL guardada queda
+    registrada en imagenes_hash para que otras subidas de la misma imagen la
+    reutilicen.
+    """
+    image_hash = content_hash(image_bytes)
+    phash = perceptual_hash(image_bytes)
+    similar = [
+        candidate for candidate in duplicate_index.find_similar(phash, max_distance)
+        if candidate < id_analisis
+    ]
+    cur = conn.cursor()
+    cur.execute(
+        """
+        UPDATE analisis SET
+            hash_contenido = %(hash)s,
+            phash = %(phash)s,
+            duplicado_de = (
+                SELECT COALESCE(duplicado_de, id_analisis) FROM analisis
+                WHERE id_analisis = ANY(%(similar)s::int[])
+                ORDER BY array_position(%(similar)s::int[], id_analisis)
+                LIMIT 1
+            )
+        WHERE id_analisis = %(id)s
+        RETURNING duplicado_de
+        """,
+        {"hash": image_hash, "phash": phash, "similar": similar, "id": id_analisis}
+    )
+    row = cur.fetchone()
+    if row is not None:
+        register_images(cur, [(image_hash, url_imagen, None, None, None, None)])
+    conn.commit()
+    cur.close()
+    if row is not None:
+        duplicate_index.add(id_analisis, phash)
+        return row[0]
+    return None
@@ -0,0 +1,87 @@
+# backend/image_variants.py
+
+import io
+from config import Config
+from storage_utils import download_image, upload_image, delete_images
+
+# Tamaño máximo (lado mayor, en píxeles) de cada variante
+VARIANT_SIZES = {
+    "miniatura": Config.THUMBNAIL_SIZE,
+    "mediana": Config.MEDIUM_SIZE,
+}
+
+# Todas las columnas de analisis que apuntan a archivos de Firebase Storage
+ANALYSIS_IMAGE_COLUMNS = (
+    "url_imagen", "url_imagen_reverso",
+    "url_miniatura", "url_mediana",
+    "url_miniatura_reverso", "url_mediana_reverso",
+)
+
+
+def analysis_image_urls(rows):
+    """Devuelve todas las URLs de imágenes (originales y variantes) de unas filas de analisis."""
+    return [
+        row[column] for row in rows
+        for column in ANALYSIS_IMAGE_COLUMNS
+        if row.get(column)
+    ]
+
+
+def build_variants(image_bytes):
+    """Genera las variantes WebP de una imagen. Devuelve {nombre: bytes}."""
+    # Importación diferida: solo se paga al procesar la primera imagen
+    from PIL import Image, ImageOps
+
+    image = Image.open(io.BytesIO(image_bytes))
+    # Para JPEG, decodificamos directamente a una resolución reducida
+    image.draft("RGB", (max(VARIANT_SIZES.values()),) * 2)
+    image = ImageOps.exif_transpose(image).convert("RGB")
+
+    variants = {}
+    for name, size in VARIANT_SIZES.items():
+        variant = image.copy()
+        variant.thumbnail((size, size), Image.LANCZOS)
+        buffered = io.BytesIO()
+        variant.save(buffered, format="WEBP", quality=Config.WEBP_QUALITY, method=4)
+        variants[name] = buffered.getvalue()
+    return variants
+
+
+def create_variants(image_url, image_bytes=None):
+    """
+    Genera las variantes de una imagen y las sube. Devuelve {nombre: url}.
+    Si ya se tienen los bytes de la imagen, no se vuelve a descargar.
+    """
+    if image_bytes is None:
+        image_bytes = download_image(image_url)
+    return {
+        name: upload_image(data, "image/webp", "analisis/variantes", "webp")
+        for name, data in build_variants(image_bytes).items()
+    }
+
+
+def store_analysis_variants(conn, id_analisis, url_imagen, url_imagen_reverso, front_bytes=None):
+    """
+    Genera las variantes del frente y del reverso de un análisis y guarda sus
+    URLs en la fila correspondiente.
+    """
+    front = create_variants(url_imagen, front_bytes)
+    back = create_variants(url_imagen_reverso) if url_imagen_reverso else {}
+
+    cur = conn.cursor()
+    cur.execute(
+        """
+        UPDATE analisis SET
+            url_miniatura = %s, url_mediana = %s,
+            url_miniatura_reverso = %s, url_mediana_reverso = %s
+        WHERE id_analisis = %s
+        """,
+        (front["miniatura"], front["mediana"], back.get("miniatura"), back.get("mediana"), id_analisis)
+    )
+    updated = cur.rowcount
+    conn.commit()
+    cur.close()
+
+    if updated == 0:
+        # El análisis se borró mientras se generaban las variantes
+        delete_images(list(front.values()) + list(back.values()))
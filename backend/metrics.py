@@ -0,0 +1,43 @@
+# backend/metrics.py
+
+import threading
+
+# Métricas en memoria del proceso (cada worker lleva las suyas).
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_timings = {}
+
+
+def increment(name, value=1):
+    """Suma `value` al contador `name`."""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def set_gauge(name, value):
+    """Fija el valor actual del indicador `name`."""
+    with _lock:
+        _gauges[name] = value
+
+
+def observe(name, seconds):
+    """Registra una duración (en segundos) para la métrica `name`."""
+    with _lock:
+        count, total, maximum = _timings.get(name, (0, 0.0, 0.0))
+        _timings[name] = (count + 1, total + seconds, max(maximum, seconds))
+
+
+def snapshot():
+    """Devuelve una copia de todas las métricas lista para serializar a JSON."""
+    with _lock:
+        timings = {
+            name: {
+                "count": count,
+                "total_s": round(total, 4),
+                "avg_s": round(total / count, 4) if count else 0.0,
+                "max_s": round(maximum, 4),
+            }
+            for name, (count, total, maximum) in _timings.items()
+        }
+        return {"counters": dict(_counters), "gauges": dict(_gauges), "timings": timings}
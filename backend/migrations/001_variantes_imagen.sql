@@ -0,0 +1,14 @@
+-- backend/migrations/001_variantes_imagen.sql
+-- Variantes WebP (miniatura y mediana) de las imágenes de cada análisis.
+
+ALTER TABLE analisis
+    ADD COLUMN IF NOT EXISTS url_miniatura TEXT,
+    ADD COLUMN IF NOT EXISTS url_mediana TEXT,
+    ADD COLUMN IF NOT EXISTS url_miniatura_reverso TEXT,
+    ADD COLUMN IF NOT EXISTS url_mediana_reverso TEXT;
+
+-- Permite al script de backfill encontrar rápidamente los análisis pendientes
+-- y retomar el trabajo donde lo dejó.
+CREATE INDEX IF NOT EXISTS idx_analisis_sin_variantes
+    ON analisis (id_analisis)
+    WHERE url_miniatura IS NULL;
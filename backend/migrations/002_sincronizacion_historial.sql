@@ -0,0 +1,54 @@
+-- backend/migrations/002_sincronizacion_historial.sql
+-- Seguimiento de cambios de analisis para la sincronización incremental
+-- (/history/sync). Cada inserción o modificación recibe un número de versión
+-- creciente, y los borrados definitivos dejan una "lápida" con su versión.
+
+CREATE SEQUENCE IF NOT EXISTS analisis_version_seq;
+
+ALTER TABLE analisis ADD COLUMN IF NOT EXISTS version BIGINT;
+UPDATE analisis SET version = nextval('analisis_version_seq') WHERE version IS NULL;
+ALTER TABLE analisis ALTER COLUMN version SET DEFAULT nextval('analisis_version_seq');
+ALTER TABLE analisis ALTER COLUMN version SET NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_analisis_usuario_version ON analisis (id_usuario, version);
+
+CREATE TABLE IF NOT EXISTS analisis_eliminados (
+    id_analisis INTEGER PRIMARY KEY,
+    id_usuario INTEGER NOT NULL,
+    version BIGINT NOT NULL DEFAULT nextval('analisis_version_seq'),
+    fecha_eliminacion TIMESTAMP NOT NULL DEFAULT (NOW() AT TIME ZONE 'UTC')
+);
+
+CREATE INDEX IF NOT EXISTS idx_analisis_eliminados_usuario_version
+    ON analisis_eliminados (id_usuario, version);
+
+-- Cualquier UPDATE (papelera, restauración, variantes...) genera una versión nueva
+CREATE OR REPLACE FUNCTION analisis_nueva_version() RETURNS trigger AS $$
+BEGIN
+    NEW.version := nextval('analisis_version_seq');
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_analisis_version ON analisis;
+CREATE TRIGGER trg_analisis_version
+    BEFORE UPDATE ON analisis
+    FOR EACH ROW EXECUTE FUNCTION analisis_nueva_version();
+
+-- Los borrados definitivos (rutas, operaciones masivas, cleanup_script,
+-- borrado de usuarios) quedan registrados como lápidas
+CREATE OR REPLACE FUNCTION analisis_registrar_lapida() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO analisis_eliminados (id_analisis, id_usuario)
+    VALUES (OLD.id_analisis, OLD.id_usuario)
+    ON CONFLICT (id_analisis) DO UPDATE
+        SET version = nextval('analisis_version_seq'),
+            fecha_eliminacion = NOW() AT TIME ZONE 'UTC';
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_analisis_lapida ON analisis;
+CREATE TRIGGER trg_analisis_lapida
+    AFTER DELETE ON analisis
+    FOR EACH ROW EXECUTE FUNCTION analisis_registrar_lapida();
@@ -0,0 +1,10 @@
+-- backend/migrations/003_limites_tasa.sql
+-- Estado de los token buckets compartidos entre workers (RATE_LIMIT_BACKEND=postgres).
+-- Es UNLOGGED: perder su contenido tras una caída solo reinicia los límites.
+
+CREATE UNLOGGED TABLE IF NOT EXISTS limites_tasa (
+    clave TEXT PRIMARY KEY,
+    tokens DOUBLE PRECISION NOT NULL,
+    permitido BOOLEAN NOT NULL,
+    actualizado TIMESTAMPTZ NOT NULL
+);
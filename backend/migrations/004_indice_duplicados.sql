@@ -0,0 +1,30 @@
+-- backend/migrations/004_indice_duplicados.sql
+-- Índice de duplicados: hash de contenido (SHA-256) y perceptual (dHash)
+-- de cada imagen, para reutilizar predicciones y archivos ya subidos.
+
+-- Una fila por imagen distinta que ha pasado por /analyze
+CREATE TABLE IF NOT EXISTS imagenes_hash (
+    hash_contenido CHAR(64) PRIMARY KEY,
+    url_imagen TEXT,
+    modelo TEXT,
+    resultado_prediccion TEXT,
+    confianza DOUBLE PRECISION,
+    fecha_registro TIMESTAMP NOT NULL DEFAULT (NOW() AT TIME ZONE 'UTC')
+);
+
+ALTER TABLE analisis
+    ADD COLUMN IF NOT EXISTS hash_contenido CHAR(64),
+    ADD COLUMN IF NOT EXISTS phash BIGINT,
+    ADD COLUMN IF NOT EXISTS duplicado_de INTEGER;
+
+CREATE INDEX IF NOT EXISTS idx_analisis_hash_contenido ON analisis (hash_contenido);
+
+-- Antes de borrar una imagen de Firebase Storage se comprueba que ningún
+-- otro análisis la siga usando.
+CREATE INDEX IF NOT EXISTS idx_analisis_url_imagen ON analisis (url_imagen);
+CREATE INDEX IF NOT EXISTS idx_analisis_url_imagen_reverso ON analisis (url_imagen_reverso);
+
+-- Permite al script de backfill encontrar los análisis sin indexar
+CREATE INDEX IF NOT EXISTS idx_analisis_sin_hash
+    ON analisis (id_analisis)
+    WHERE phash IS NULL;
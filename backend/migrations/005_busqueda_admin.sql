@@ -0,0 +1,22 @@
+-- backend/migrations/005_busqueda_admin.sql
+-- Índices para /admin/search: trigramas (búsquedas parciales y con errores
+-- de escritura) y texto completo sobre usuarios y análisis.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS idx_usuarios_nombre_trgm ON usuarios USING gin (nombre_completo gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_usuarios_email_trgm ON usuarios USING gin (email gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_usuarios_ong_trgm ON usuarios USING gin (ong gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_analisis_prediccion_trgm ON analisis USING gin (resultado_prediccion gin_trgm_ops);
+
+-- Las expresiones deben coincidir exactamente con USER_TSVECTOR y
+-- ANALYSIS_TSVECTOR de admin_search.py para que el planificador las use.
+CREATE INDEX IF NOT EXISTS idx_usuarios_busqueda ON usuarios USING gin (
+    to_tsvector('simple', coalesce(nombre_completo, '') || ' ' || coalesce(email, '') || ' ' || coalesce(ong, ''))
+);
+CREATE INDEX IF NOT EXISTS idx_analisis_busqueda ON analisis USING gin (
+    to_tsvector('spanish', coalesce(resultado_prediccion, ''))
+);
+
+-- Análisis de los usuarios encontrados por nombre o email
+CREATE INDEX IF NOT EXISTS idx_analisis_usuario ON analisis (id_usuario);
@@ -0,0 +1,17 @@
+-- backend/migrations/006_detecciones.sql
+-- Detecciones completas (cajas, clases y confianzas) de cada imagen en el
+-- formato compacto de detections.py, para no volver a llamar al modelo
+-- cuando se necesitan las cajas de un análisis.
+
+-- Detecciones de cada imagen analizada, también de las que aún no se han
+-- guardado como análisis: /history/save las copia desde aquí
+ALTER TABLE imagenes_hash ADD COLUMN IF NOT EXISTS detecciones JSONB;
+
+-- En una tabla aparte para que las consultas del historial (a.*) no las
+-- arrastren: solo se leen con /history/<id>/detections
+CREATE TABLE IF NOT EXISTS analisis_detecciones (
+    id_analisis INTEGER PRIMARY KEY REFERENCES analisis (id_analisis) ON DELETE CASCADE,
+    modelo TEXT,
+    frente JSONB,
+    reverso JSONB
+);
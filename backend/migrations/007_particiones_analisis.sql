@@ -0,0 +1,75 @@
+-- backend/migrations/007_particiones_analisis.sql
+-- Preparación para particionar analisis por mes de fecha_eliminado. La
+-- conversión de la tabla la hace partition_analisis.py, copiando en lotes
+-- sin detener el servicio; este archivo puede aplicarse antes y después.
+--
+-- Estructura final:
+--   analisis                     particionada por RANGE (fecha_eliminado)
+--   ├─ analisis_activos          DEFAULT, solo filas con fecha_eliminado NULL
+--   └─ analisis_papelera_AAAA_MM una por mes de borrado
+-- La limpieza de la papelera borra particiones enteras en lugar de filas.
+
+-- En la tabla particionada, mover un análisis a la papelera o restaurarlo
+-- lo cambia de partición y PostgreSQL lo ejecuta como DELETE + INSERT, con
+-- sus triggers AFTER DELETE. Solo es un borrado definitivo si el análisis ya
+-- no existe.
+CREATE OR REPLACE FUNCTION analisis_registrar_lapida() RETURNS trigger AS $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM analisis WHERE id_analisis = OLD.id_analisis) THEN
+        RETURN NULL;
+    END IF;
+    INSERT INTO analisis_eliminados (id_analisis, id_usuario)
+    VALUES (OLD.id_analisis, OLD.id_usuario)
+    ON CONFLICT (id_analisis) DO UPDATE
+        SET version = nextval('analisis_version_seq'),
+            fecha_eliminacion = NOW() AT TIME ZONE 'UTC';
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Una clave foránea no puede apuntar a una tabla particionada sin clave
+-- primaria global, así que las detecciones se borran con un trigger
+CREATE OR REPLACE FUNCTION analisis_borrar_detecciones() RETURNS trigger AS $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM analisis WHERE id_analisis = OLD.id_analisis) THEN
+        DELETE FROM analisis_detecciones WHERE id_analisis = OLD.id_analisis;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_analisis_detecciones ON analisis;
+CREATE TRIGGER trg_analisis_detecciones
+    AFTER DELETE ON analisis
+    FOR EACH ROW EXECUTE FUNCTION analisis_borrar_detecciones();
+
+-- Crea las particiones mensuales de la papelera que falten entre los meses
+-- de `desde` y `hasta` (ambos incluidos). Devuelve cuántas ha creado. No
+-- hace nada si la tabla aún no está particionada.
+CREATE OR REPLACE FUNCTION analisis_crear_particiones(desde DATE, hasta DATE, tabla TEXT DEFAULT 'analisis')
+RETURNS INTEGER AS $$
+DECLARE
+    mes DATE := date_trunc('month', desde)::date;
+    nombre TEXT;
+    creadas INTEGER := 0;
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(tabla)) THEN
+        RETURN 0;
+    END IF;
+    WHILE mes <= hasta LOOP
+        nombre := 'analisis_papelera_' || to_char(mes, 'YYYY_MM');
+        IF to_regclass(nombre) IS NULL THEN
+            -- La restricción CHECK de analisis_activos evita recorrerla al
+            -- crear la partición
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                nombre, tabla, mes, (mes + INTERVAL '1 month')::date
+            );
+            EXECUTE format('ALTER TABLE %I ADD PRIMARY KEY (id_analisis)', nombre);
+            creadas := creadas + 1;
+        END IF;
+        mes := (mes + INTERVAL '1 month')::date;
+    END LOOP;
+    RETURN creadas;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,10 @@
+-- backend/migrations/008_escrituras_recientes.sql
+-- Última escritura de cada usuario en el primario, para la lectura de lo
+-- propio escrito con READ_YOUR_WRITES_BACKEND=postgres (ver db_routing.py).
+-- UNLOGGED: no genera WAL ni se replica, y perderla tras una caída solo
+-- hace que algunas lecturas vayan a una réplica algo atrasada.
+CREATE UNLOGGED TABLE IF NOT EXISTS escrituras_recientes (
+    id_usuario INTEGER PRIMARY KEY,
+    lsn PG_LSN NOT NULL,
+    fecha TIMESTAMP NOT NULL
+);
@@ -0,0 +1,25 @@
+-- backend/migrations/009_evaluacion_sombra.sql
+-- Evaluación en sombra de un modelo candidato (SHADOW_MODEL_ID, ver
+-- shadow.py): por cada imagen de /analyze muestreada, la predicción y la
+-- latencia del modelo de producción junto a las del candidato. Las lee
+-- shadow_report.py.
+CREATE TABLE IF NOT EXISTS evaluaciones_sombra (
+    id BIGSERIAL PRIMARY KEY,
+    fecha TIMESTAMP NOT NULL DEFAULT NOW(),
+    request_id TEXT,
+    hash_contenido CHAR(64),
+    modelo_produccion TEXT NOT NULL,
+    clase_produccion TEXT,
+    confianza_produccion DOUBLE PRECISION,
+    -- NULL si la predicción de producción se reutilizó de imagenes_hash
+    latencia_produccion_ms DOUBLE PRECISION,
+    modelo_candidato TEXT NOT NULL,
+    clase_candidato TEXT,
+    confianza_candidato DOUBLE PRECISION,
+    latencia_candidato_ms DOUBLE PRECISION,
+    -- Error del candidato (sin clase ni confianza)
+    error TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_evaluaciones_sombra_candidato
+    ON evaluaciones_sombra (modelo_candidato, fecha);
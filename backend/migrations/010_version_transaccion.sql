@@ -0,0 +1,39 @@
+-- backend/migrations/010_version_transaccion.sql
+-- Transacción que escribió cada versión de analisis y de sus lápidas. Las
+-- versiones salen de una secuencia, así que no llegan en orden de commit:
+-- una transacción abierta puede confirmar más tarde una versión menor que
+-- otra ya confirmada. /history/sync solo devuelve las versiones escritas por
+-- transacciones anteriores a la más antigua que sigue en curso
+-- (pg_snapshot_xmin), de modo que la marca nunca salta un cambio pendiente.
+--
+-- Sin valor por defecto al añadirlas para no reescribir la tabla; las filas
+-- anteriores quedan con NULL y se tratan como confirmadas.
+ALTER TABLE analisis ADD COLUMN IF NOT EXISTS version_xid XID8;
+ALTER TABLE analisis ALTER COLUMN version_xid SET DEFAULT pg_current_xact_id();
+
+ALTER TABLE analisis_eliminados ADD COLUMN IF NOT EXISTS version_xid XID8;
+ALTER TABLE analisis_eliminados ALTER COLUMN version_xid SET DEFAULT pg_current_xact_id();
+
+CREATE OR REPLACE FUNCTION analisis_nueva_version() RETURNS trigger AS $$
+BEGIN
+    NEW.version_xid := pg_current_xact_id();
+    NEW.version := nextval('analisis_version_seq');
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Igual que en 007, registrando también la transacción de la lápida
+CREATE OR REPLACE FUNCTION analisis_registrar_lapida() RETURNS trigger AS $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM analisis WHERE id_analisis = OLD.id_analisis) THEN
+        RETURN NULL;
+    END IF;
+    INSERT INTO analisis_eliminados (id_analisis, id_usuario)
+    VALUES (OLD.id_analisis, OLD.id_usuario)
+    ON CONFLICT (id_analisis) DO UPDATE
+        SET version = nextval('analisis_version_seq'),
+            version_xid = pg_current_xact_id(),
+            fecha_eliminacion = NOW() AT TIME ZONE 'UTC';
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
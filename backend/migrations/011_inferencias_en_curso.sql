@@ -0,0 +1,9 @@
+-- backend/migrations/011_inferencias_en_curso.sql
+-- Huecos del tope global de inferencias simultáneas (INFLIGHT_BACKEND=postgres,
+-- ver rate_limit.py). Cada inferencia ocupa un hueco hasta que termina o
+-- vence ocupado_hasta. UNLOGGED: tras una caída todos los huecos quedan libres.
+CREATE UNLOGGED TABLE IF NOT EXISTS inferencias_en_curso (
+    hueco INTEGER PRIMARY KEY,
+    token UUID,
+    ocupado_hasta TIMESTAMPTZ NOT NULL DEFAULT '-infinity'
+);
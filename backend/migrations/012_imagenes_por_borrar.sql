@@ -0,0 +1,13 @@
+-- backend/migrations/012_imagenes_por_borrar.sql
+-- Imágenes de Firebase Storage cuyo borrado falló (circuito abierto, 5xx,
+-- timeouts) después de borrar ya sus filas. cleanup_script.py las reintenta
+-- cuando llega proximo_intento; cada fallo aleja el siguiente intento.
+CREATE TABLE IF NOT EXISTS imagenes_por_borrar (
+    url TEXT PRIMARY KEY,
+    intentos INTEGER NOT NULL DEFAULT 1,
+    ultimo_error TEXT,
+    fecha TIMESTAMP NOT NULL DEFAULT NOW(),
+    proximo_intento TIMESTAMP NOT NULL DEFAULT NOW() + INTERVAL '10 minutes'
+);
+
+CREATE INDEX IF NOT EXISTS idx_imagenes_por_borrar_proximo ON imagenes_por_borrar (proximo_intento);
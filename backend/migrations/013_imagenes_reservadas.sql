@@ -0,0 +1,14 @@
+-- backend/migrations/013_imagenes_reservadas.sql
+-- Imágenes ya subidas que /analyze reutiliza para otro análisis todavía sin
+-- guardar. Mientras la reserva esté vigente, unreferenced_urls() trata la URL
+-- como usada y el borrado definitivo del análisis original no borra el
+-- archivo. Al caducar, cleanup_script.py borra las reservas y las imágenes
+-- que ningún análisis guardado llegó a usar.
+CREATE TABLE IF NOT EXISTS imagenes_reservadas (
+    url TEXT NOT NULL,
+    id_usuario INTEGER NOT NULL,
+    hasta TIMESTAMPTZ NOT NULL,
+    PRIMARY KEY (url, id_usuario)
+);
+
+CREATE INDEX IF NOT EXISTS idx_imagenes_reservadas_hasta ON imagenes_reservadas (hasta);
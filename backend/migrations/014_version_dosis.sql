@@ -0,0 +1,29 @@
+-- backend/migrations/014_version_dosis.sql
+-- Versión de los datos de dosis (tratamientos y nombres de enfermedades).
+-- Cada worker compara la de su tabla en memoria (dose_table.py) antes de
+-- usarla, así que un cambio hecho desde cualquier worker se ve en todos en
+-- la siguiente petición. Es una fila y no una secuencia porque el cambio
+-- solo debe verse cuando la transacción que lo hizo se confirma.
+CREATE TABLE IF NOT EXISTS versiones_cache (
+    nombre TEXT PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT INTO versiones_cache (nombre) VALUES ('dosis') ON CONFLICT DO NOTHING;
+
+CREATE OR REPLACE FUNCTION dosis_nueva_version() RETURNS trigger AS $$
+BEGIN
+    UPDATE versiones_cache SET version = version + 1 WHERE nombre = 'dosis';
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS tratamientos_version_dosis ON tratamientos;
+CREATE TRIGGER tratamientos_version_dosis
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON tratamientos
+    FOR EACH STATEMENT EXECUTE FUNCTION dosis_nueva_version();
+
+DROP TRIGGER IF EXISTS enfermedades_version_dosis ON enfermedades;
+CREATE TRIGGER enfermedades_version_dosis
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON enfermedades
+    FOR EACH STATEMENT EXECUTE FUNCTION dosis_nueva_version();
@@ -0,0 +1,275 @@
+# backend/partition_analisis.py
+
+import argparse
+import time
+from datetime import datetime
+import psycopg2
+from psycopg2 import sql
+from config import Config
+from partitions import ACTIVE_PARTITION, is_partitioned
+
+# Convierte analisis en una tabla particionada por mes de fecha_eliminado
+# sin detener el servicio (requiere migrations/007_particiones_analisis.sql):
+#   1. Crea analisis_nueva (particionada) con los mismos índices y claves
+#      foráneas, y un trigger en analisis que replica cada escritura.
+#   2. Copia las filas existentes en lotes por id_analisis. Es reanudable.
+#   3. Con un bloqueo breve, comprueba que no falta nada e intercambia las
+#      tablas. La antigua queda como analisis_sin_particionar hasta que se
+#      borre con --eliminar-antigua.
+NEW_TABLE = "analisis_nueva"
+OLD_TABLE = "analisis_sin_particionar"
+# Sufijo temporal de los índices nuevos (los nombres son únicos por esquema)
+_INDEX_SUFFIX = "_part"
+
+_MIRROR_FUNCTION = """
+    CREATE OR REPLACE FUNCTION analisis_espejo() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            DELETE FROM analisis_nueva WHERE id_analisis = OLD.id_analisis;
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            INSERT INTO analisis_nueva SELECT NEW.*;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+"""
+
+
+def _table_exists(cur, name):
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL", (name,))
+    return cur.fetchone()[0]
+
+
+def prepare(conn, months_ahead):
+    """Crea la tabla particionada vacía y empieza a replicar las escrituras."""
+    cur = conn.cursor()
+    if _table_exists(cur, NEW_TABLE):
+        print(f"{NEW_TABLE} ya existe: se continúa con la copia.")
+        return
+
+    cur.execute(
+        sql.SQL(
+            "CREATE TABLE {} (LIKE analisis INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING STORAGE) "
+            "PARTITION BY RANGE (fecha_eliminado)"
+        ).format(sql.Identifier(NEW_TABLE))
+    )
+    # Los análisis vivos (fecha_eliminado NULL) van a la partición por
+    # defecto. Su CHECK evita que PostgreSQL la recorra entera cada vez que
+    # se crea la partición de un mes nuevo.
+    cur.execute(
+        sql.SQL("CREATE TABLE {} PARTITION OF {} DEFAULT").format(
+            sql.Identifier(ACTIVE_PARTITION), sql.Identifier(NEW_TABLE)
+        )
+    )
+    cur.execute(
+        sql.SQL("ALTER TABLE {} ADD CONSTRAINT analisis_activos_sin_eliminar CHECK (fecha_eliminado IS NULL), "
+                "ADD PRIMARY KEY (id_analisis)").format(sql.Identifier(ACTIVE_PARTITION))
+    )
+    cur.execute(
+        """
+        SELECT analisis_crear_particiones(
+            COALESCE(MIN(fecha_eliminado)::date, CURRENT_DATE),
+            (CURRENT_DATE + make_interval(months => %s))::date,
+            %s
+        ) FROM analisis
+        """,
+        (months_ahead, NEW_TABLE)
+    )
+    print(f"Creadas {cur.fetchone()[0]} particiones de la papelera.")
+
+    # La clave primaria pasa a cada partición: en la tabla particionada una
+    # restricción única tendría que incluir fecha_eliminado, que admite NULL.
+    cur.execute(
+        """
+        SELECT i.relname, pg_get_indexdef(x.indexrelid), x.indisunique, x.indisprimary
+        FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid
+        WHERE x.indrelid = 'analisis'::regclass
+        """
+    )
+    for name, definition, unique, primary in cur.fetchall():
+        if primary:
+            continue
+        if unique:
+            print(f"ADVERTENCIA: el índice único {name} no puede crearse en la tabla particionada; se omite.")
+            continue
+        cur.execute(
+            definition
+            .replace(f"INDEX {name} ON", f"INDEX {name}{_INDEX_SUFFIX} ON", 1)
+            .replace(" ON public.analisis ", f" ON public.{NEW_TABLE} ", 1)
+            .replace(" ON ONLY public.analisis ", f" ON public.{NEW_TABLE} ", 1)
+        )
+
+    cur.execute(
+        """
+        SELECT conname, pg_get_constraintdef(oid)
+        FROM pg_constraint
+        WHERE conrelid = 'analisis'::regclass AND contype = 'f'
+        """
+    )
+    for name, definition in cur.fetchall():
+        cur.execute(
+            sql.SQL("ALTER TABLE {} ADD CONSTRAINT {} " + definition).format(
+                sql.Identifier(NEW_TABLE), sql.Identifier(name)
+            )
+        )
+
+    cur.execute(_MIRROR_FUNCTION)
+    cur.execute(
+        "CREATE TRIGGER trg_analisis_espejo AFTER INSERT OR UPDATE OR DELETE ON analisis "
+        "FOR EACH ROW EXECUTE FUNCTION analisis_espejo()"
+    )
+    conn.commit()
+    cur.close()
+    print(f"{NEW_TABLE} creada; las escrituras en analisis ya se replican.")
+
+
+def copy_rows(conn, batch_size, pause):
+    """
+    Copia en lotes las filas que aún no están en la tabla nueva. Cada lote
+    bloquea primero sus filas en analisis: una escritura concurrente espera a
+    que el lote termine y después el trigger la replica sobre la copia.
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT COALESCE(MAX(id_analisis), 0) FROM analisis")
+    max_id = cur.fetchone()[0]
+    last_id, copied = 0, 0
+    start = time.time()
+    while last_id < max_id:
+        upper = last_id + batch_size
+        cur.execute(
+            "SELECT COUNT(*) FROM (SELECT 1 FROM analisis WHERE id_analisis > %s AND id_analisis <= %s FOR UPDATE) AS lote",
+            (last_id, upper)
+        )
+        # Sentencia nueva, instantánea nueva: ve las filas que el trigger ya
+        # replicó mientras esperábamos los bloqueos
+        cur.execute(
+            sql.SQL(
+                """
+                INSERT INTO {new} SELECT a.* FROM analisis a
+                WHERE a.id_analisis > %s AND a.id_analisis <= %s
+                  AND NOT EXISTS (SELECT 1 FROM {new} n WHERE n.id_analisis = a.id_analisis)
+                """
+            ).format(new=sql.Identifier(NEW_TABLE)),
+            (last_id, upper)
+        )
+        copied += cur.rowcount
+        conn.commit()
+        last_id = upper
+        if last_id // batch_size % 20 == 0 or last_id >= max_id:
+            print(f"Copiado hasta el análisis {min(last_id, max_id)} de {max_id}: {copied} filas "
+                  f"({time.time() - start:.1f} s)")
+        if pause:
+            time.sleep(pause)
+    cur.close()
+    return copied
+
+
+def swap(conn, lock_timeout_ms):
+    """Intercambia las tablas. Es el único paso que bloquea analisis, y solo durante la comprobación."""
+    cur = conn.cursor()
+    cur.execute("SET LOCAL lock_timeout = %s", (f"{lock_timeout_ms}ms",))
+    cur.execute("LOCK TABLE analisis IN ACCESS EXCLUSIVE MODE")
+
+    cur.execute(
+        sql.SQL("SELECT (SELECT COUNT(*) FROM analisis), (SELECT COUNT(*) FROM {})").format(sql.Identifier(NEW_TABLE))
+    )
+    old_count, new_count = cur.fetchone()
+    if old_count != new_count:
+        conn.rollback()
+        raise RuntimeError(f"La copia no está completa ({new_count} de {old_count} filas); vuelve a ejecutar el script.")
+
+    cur.execute("DROP TRIGGER trg_analisis_espejo ON analisis")
+    cur.execute("DROP FUNCTION analisis_espejo()")
+
+    # Triggers (versión, lápidas, detecciones) a la tabla nueva
+    cur.execute(
+        "SELECT tgname, pg_get_triggerdef(oid) FROM pg_trigger WHERE tgrelid = 'analisis'::regclass AND NOT tgisinternal"
+    )
+    for name, definition in cur.fetchall():
+        cur.execute(sql.SQL("DROP TRIGGER {} ON analisis").format(sql.Identifier(name)))
+        cur.execute(definition.replace(" ON public.analisis ", f" ON public.{NEW_TABLE} ", 1))
+
+    # Claves foráneas: las que apuntan a analisis (detecciones) se sustituyen
+    # por el trigger trg_analisis_detecciones; las de la tabla antigua se
+    # quitan para que no impidan borrar usuarios mientras se conserva.
+    cur.execute(
+        """
+        SELECT conrelid::regclass::text, conname FROM pg_constraint
+        WHERE contype = 'f' AND (confrelid = 'analisis'::regclass OR conrelid = 'analisis'::regclass)
+        """
+    )
+    for table, name in cur.fetchall():
+        cur.execute(sql.SQL("ALTER TABLE {} DROP CONSTRAINT {}").format(sql.SQL(table), sql.Identifier(name)))
+
+    # Las secuencias (id_analisis) pasan a pertenecer a la tabla nueva para
+    # que no desaparezcan al borrar la antigua
+    cur.execute(
+        """
+        SELECT attname, pg_get_serial_sequence('analisis', attname)
+        FROM pg_attribute
+        WHERE attrelid = 'analisis'::regclass AND attnum > 0 AND NOT attisdropped
+        """
+    )
+    sequences = [(column, sequence) for column, sequence in cur.fetchall() if sequence]
+
+    cur.execute(sql.SQL("ALTER TABLE analisis RENAME TO {}").format(sql.Identifier(OLD_TABLE)))
+    cur.execute(sql.SQL("ALTER TABLE {} RENAME TO analisis").format(sql.Identifier(NEW_TABLE)))
+    for column, sequence in sequences:
+        cur.execute(
+            sql.SQL("ALTER SEQUENCE {} OWNED BY analisis.{}").format(sql.SQL(sequence), sql.Identifier(column))
+        )
+
+    # Los índices de la tabla nueva recuperan los nombres originales
+    cur.execute(
+        """
+        SELECT c.relname FROM pg_index x JOIN pg_class c ON c.oid = x.indexrelid
+        WHERE x.indrelid = 'analisis'::regclass AND c.relname LIKE %s
+        """,
+        ("%" + _INDEX_SUFFIX,)
+    )
+    for (name,) in cur.fetchall():
+        original = name[:-len(_INDEX_SUFFIX)]
+        cur.execute(sql.SQL("ALTER INDEX {} RENAME TO {}").format(
+            sql.Identifier(original), sql.Identifier(original + "_sin_particionar")))
+        cur.execute(sql.SQL("ALTER INDEX {} RENAME TO {}").format(sql.Identifier(name), sql.Identifier(original)))
+    conn.commit()
+
+    cur.execute("ANALYZE analisis")
+    conn.commit()
+    cur.close()
+    print(f"✅ analisis ya está particionada ({new_count} filas). La tabla antigua queda como {OLD_TABLE}.")
+
+
+def partition_analisis(batch_size, pause, lock_timeout_ms, drop_old):
+    print(f"--- Particionado de analisis - {datetime.utcnow()} UTC ---")
+    conn = psycopg2.connect(Config.DATABASE_URI)
+    try:
+        cur = conn.cursor()
+        if is_partitioned(cur):
+            if drop_old and _table_exists(cur, OLD_TABLE):
+                cur.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(OLD_TABLE)))
+                conn.commit()
+                print(f"Se eliminó {OLD_TABLE}.")
+            else:
+                print("analisis ya está particionada.")
+            return
+        cur.close()
+
+        prepare(conn, Config.ANALYSIS_PARTITIONS_AHEAD)
+        copy_rows(conn, batch_size, pause)
+        swap(conn, lock_timeout_ms)
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Particiona analisis por mes de borrado sin detener el servicio.")
+    parser.add_argument('--lote', type=int, default=5000, help="Filas por lote de copia")
+    parser.add_argument('--pausa', type=float, default=0.0, help="Segundos de espera entre lotes")
+    parser.add_argument('--lock-timeout-ms', type=int, default=5000,
+                        help="Espera máxima del bloqueo final; si se agota, basta con volver a ejecutarlo")
+    parser.add_argument('--eliminar-antigua', action='store_true',
+                        help=f"Borra {OLD_TABLE} (tras comprobar que todo funciona)")
+    args = parser.parse_args()
+    partition_analisis(args.lote, args.pausa, args.lock_timeout_ms, args.eliminar_antigua)
@@ -0,0 +1,120 @@
+# backend/partitions.py
+
+import time
+from datetime import datetime
+import psycopg2.errors
+from psycopg2 import sql
+
+# Nombres fijos de las particiones (ver migrations/007_particiones_analisis.sql)
+ACTIVE_PARTITION = "analisis_activos"
+TRASH_PARTITION_PREFIX = "analisis_papelera_"
+
+# Columnas que necesita analysis_image_urls() para borrar las imágenes
+_URL_COLUMNS = (
+    "id_analisis", "url_imagen", "url_imagen_reverso", "url_miniatura", "url_mediana",
+    "url_miniatura_reverso", "url_mediana_reverso",
+)
+
+
+def is_partitioned(cur, table="analisis"):
+    cur.execute("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))", (table,))
+    return cur.fetchone()[0]
+
+
+def ensure_partitions(cur, months_ahead, table="analisis"):
+    """Crea las particiones de la papelera del mes actual y de los `months_ahead` siguientes."""
+    cur.execute(
+        "SELECT analisis_crear_particiones(CURRENT_DATE, (CURRENT_DATE + make_interval(months => %s))::date, %s)",
+        (months_ahead, table)
+    )
+    return cur.fetchone()[0]
+
+
+def trash_partitions(cur):
+    """
+    Devuelve [(nombre, inicio_del_mes_siguiente)] de las particiones de la
+    papelera, de la más antigua a la más nueva. Incluye las que ya se
+    separaron de analisis pero no llegaron a eliminarse (una ejecución
+    anterior se interrumpió entre detach_trash_partition y
+    drop_trash_partition).
+    """
+    cur.execute(
+        """
+        SELECT relname FROM pg_class
+        WHERE relkind = 'r' AND relname LIKE %s AND pg_table_is_visible(oid)
+        ORDER BY relname
+        """,
+        (TRASH_PARTITION_PREFIX + "%",)
+    )
+    partitions = []
+    for (name,) in cur.fetchall():
+        month = datetime.strptime(name[len(TRASH_PARTITION_PREFIX):], "%Y_%m")
+        upper = month.replace(year=month.year + month.month // 12, month=month.month % 12 + 1)
+        partitions.append((name, upper))
+    return partitions
+
+
+def detach_trash_partition(conn, name, lock_timeout_ms, attempts=1, pause=1.0):
+    """
+    Separa una partición de la papelera de analisis en su propia transacción
+    y la confirma. DETACH bloquea analisis en modo ACCESS EXCLUSIVE, pero
+    solo durante esta transacción corta y nunca más de `lock_timeout_ms` por
+    intento: si se agota, se reintenta tras `pause` segundos. (DETACH ...
+    CONCURRENTLY no se puede usar porque analisis_activos es la partición
+    DEFAULT.) Devuelve False si no lo consigue.
+
+    Una vez separada, ningún análisis puede restaurarse desde ella, así que
+    drop_trash_partition() puede leerla sin carreras.
+    """
+    cur = conn.cursor()
+    conn.commit()
+    for attempt in range(attempts):
+        try:
+            cur.execute("SET LOCAL lock_timeout = %s", (f"{lock_timeout_ms}ms",))
+            cur.execute(
+                "SELECT EXISTS (SELECT 1 FROM pg_inherits WHERE inhrelid = to_regclass(%s))", (name,)
+            )
+            if cur.fetchone()[0]:
+                cur.execute(sql.SQL("ALTER TABLE analisis DETACH PARTITION {}").format(sql.Identifier(name)))
+            conn.commit()
+            cur.close()
+            return True
+        except psycopg2.errors.LockNotAvailable:
+            conn.rollback()
+            if attempt + 1 < attempts:
+                time.sleep(pause)
+    cur.close()
+    return False
+
+
+def drop_trash_partition(cur, name):
+    """
+    Elimina una partición de la papelera ya separada con
+    detach_trash_partition(). DROP no dispara los triggers de borrado, así
+    que antes se registran las lápidas para /history/sync y se borran las
+    detecciones. Devuelve las filas con las URLs de las imágenes para
+    borrarlas de Firebase Storage. El DROP solo bloquea la tabla separada;
+    quien llama confirma la transacción.
+    """
+    partition = sql.Identifier(name)
+    cur.execute(
+        sql.SQL("SELECT {} FROM {}").format(sql.SQL(", ").join(map(sql.Identifier, _URL_COLUMNS)), partition)
+    )
+    rows = cur.fetchall()
+    cur.execute(
+        sql.SQL(
+            """
+            INSERT INTO analisis_eliminados (id_analisis, id_usuario)
+            SELECT id_analisis, id_usuario FROM {}
+            ON CONFLICT (id_analisis) DO UPDATE
+                SET version = nextval('analisis_version_seq'),
+                    version_xid = pg_current_xact_id(),
+                    fecha_eliminacion = NOW() AT TIME ZONE 'UTC'
+            """
+        ).format(partition)
+    )
+    cur.execute(
+        sql.SQL("DELETE FROM analisis_detecciones d USING {} p WHERE d.id_analisis = p.id_analisis").format(partition)
+    )
+    cur.execute(sql.SQL("DROP TABLE {}").format(partition))
+    return rows
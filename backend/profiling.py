@@ -0,0 +1,173 @@
+# backend/profiling.py
+
+import cProfile
+import io
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, deque
+import metrics
+
+# Perfilado bajo demanda de un worker en producción (rutas /admin/profile/*).
+# Nada de esto está activo por defecto: el muestreador solo corre durante la
+# ventana pedida, cProfile solo envuelve las peticiones elegidas al azar y
+# tracemalloc solo registra asignaciones entre MemoryTracer.start() y stop().
+# Cada worker lleva su propio estado, como las métricas.
+
+_sampler_lock = threading.Lock()
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def sample_stacks(seconds, interval):
+    """
+    Muestrea las pilas de todos los hilos del proceso cada `interval`
+    segundos durante `seconds` y devuelve un Counter de pilas en formato
+    "collapsed" (hilo;func;func ...), el que leen flamegraph.pl y speedscope.
+    El hilo que muestrea (el de la petición que lo pidió) no se incluye.
+    Solo se admite un muestreo a la vez por worker; si ya hay uno, devuelve None.
+    """
+    if not _sampler_lock.acquire(blocking=False):
+        return None
+    try:
+        names = {}
+        stacks = Counter()
+        own_id = threading.get_ident()
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            if len(names) != threading.active_count():
+                names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                labels.append(names.get(thread_id, str(thread_id)))
+                stacks[";".join(reversed(labels))] += 1
+            time.sleep(interval)
+        metrics.increment("profile.sampler.runs")
+        return stacks
+    finally:
+        _sampler_lock.release()
+
+
+def collapsed(stacks):
+    """Una línea "pila recuento" por pila, de la más frecuente a la menos."""
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+class RequestProfiler:
+    """
+    Perfila con cProfile una fracción `rate` de las peticiones (de todas o
+    solo de `endpoint`) y guarda las últimas `keep`. cProfile solo ve el hilo
+    de la petición: el trabajo que esta manda a io_executor aparece como
+    espera; para eso está el muestreador de pilas.
+    Con rate 0 cada petición solo paga una comparación.
+    """
+
+    def __init__(self, rate=0.0, endpoint=None, keep=20, top=30):
+        self.rate = rate
+        self.endpoint = endpoint
+        self.top = top
+        self.results = deque(maxlen=keep)
+        self._local = threading.local()
+
+    def configure(self, rate, endpoint=None):
+        self.rate = min(max(float(rate), 0.0), 1.0)
+        self.endpoint = endpoint or None
+
+    def start(self, endpoint):
+        if not self.rate or (self.endpoint and endpoint != self.endpoint):
+            return
+        if random.random() >= self.rate:
+            return
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Otro perfilador ya está activo en este hilo
+            return
+        self._local.profiler = (profiler, endpoint, time.perf_counter())
+
+    def stop(self, request_id=None):
+        current = getattr(self._local, "profiler", None)
+        if current is None:
+            return
+        self._local.profiler = None
+        profiler, endpoint, start = current
+        profiler.disable()
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(self.top)
+        metrics.increment("profile.requests")
+        self.results.append({
+            "endpoint": endpoint,
+            "request_id": request_id,
+            "duracion_ms": round((time.perf_counter() - start) * 1000, 1),
+            "fecha": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "estadisticas": out.getvalue(),
+        })
+
+
+class MemoryTracer:
+    """
+    Instantáneas de tracemalloc para buscar crecimiento de memoria. start()
+    guarda una instantánea base; snapshot() devuelve las líneas que más han
+    crecido desde entonces, opcionalmente solo las asignaciones cuya pila
+    pasa por `filename` (p. ej. storage_utils.py para la descarga de imágenes).
+    """
+
+    def __init__(self):
+        self._baseline = None
+        self._lock = threading.Lock()
+
+    @property
+    def active(self):
+        return tracemalloc.is_tracing()
+
+    def start(self, frames):
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(frames)
+            self._baseline = tracemalloc.take_snapshot()
+
+    def stop(self):
+        with self._lock:
+            self._baseline = None
+            tracemalloc.stop()
+
+    def snapshot(self, limit=20, filename=None):
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                return None
+            current = tracemalloc.take_snapshot()
+            baseline = self._baseline
+        filters = [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ]
+        if filename:
+            filters.append(tracemalloc.Filter(True, f"*{filename}", all_frames=True))
+        current = current.filter_traces(filters)
+        traced, peak = tracemalloc.get_traced_memory()
+        result = {"memoria_trazada_kb": traced // 1024, "pico_kb": peak // 1024, "crecimiento": []}
+        if baseline is None:
+            stats = current.statistics("traceback")
+        else:
+            stats = current.compare_to(baseline.filter_traces(filters), "traceback")
+        for stat in stats[:limit]:
+            result["crecimiento"].append({
+                "diferencia_kb": round(getattr(stat, "size_diff", stat.size) / 1024, 1),
+                "total_kb": round(stat.size / 1024, 1),
+                "bloques": stat.count,
+                "pila": [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback],
+            })
+        return result
@@ -0,0 +1,300 @@
+# backend/rate_limit.py
+
+import logging
+import math
+import threading
+import time
+import uuid
+from functools import wraps
+import psycopg2
+from flask import jsonify
+from config import Config
+import metrics
+
+log = logging.getLogger(__name__)
+
+
+class MemoryTokenBucket:
+    """Token bucket en memoria del proceso: cada worker lleva su propia cuenta."""
+
+    MAX_KEYS = 10000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def take(self, key, capacity, refill_per_second):
+        """Consume un token. Devuelve (permitido, segundos hasta el próximo token)."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * refill_per_second)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.MAX_KEYS:
+                self._prune(now, capacity, refill_per_second)
+            metrics.set_gauge("rate_limit.memory_buckets", len(self._buckets))
+        return allowed, 0 if allowed else (1 - tokens) / refill_per_second
+
+    def _prune(self, now, capacity, refill_per_second):
+        # Un bucket que ya se habría rellenado por completo equivale a no tenerlo
+        self._buckets = {
+            key: (tokens, updated) for key, (tokens, updated) in self._buckets.items()
+            if tokens + (now - updated) * refill_per_second < capacity
+        }
+
+
+class PostgresTokenBucket:
+    """
+    Token bucket compartido por todos los workers, guardado en la tabla
+    limites_tasa. El relleno y el consumo se calculan en una única sentencia
+    atómica (INSERT ... ON CONFLICT DO UPDATE).
+    """
+
+    _LEVEL = (
+        "LEAST(%(capacity)s, limites_tasa.tokens"
+        " + EXTRACT(EPOCH FROM (clock_timestamp() - limites_tasa.actualizado)) * %(rate)s)"
+    )
+
+    _QUERY = f"""
+        INSERT INTO limites_tasa (clave, tokens, permitido, actualizado)
+        VALUES (%(key)s, %(capacity)s - 1, TRUE, clock_timestamp())
+        ON CONFLICT (clave) DO UPDATE SET
+            permitido = {_LEVEL} >= 1,
+            tokens = {_LEVEL} - CASE WHEN {_LEVEL} >= 1 THEN 1 ELSE 0 END,
+            actualizado = clock_timestamp()
+        RETURNING permitido, tokens
+    """
+
+    def __init__(self, connection_factory):
+        self._connection_factory = connection_factory
+
+    def take(self, key, capacity, refill_per_second):
+        """
+        Si la base de datos falla, la petición se deja pasar (y se cuenta en
+        rate_limit.errors): un problema del limitador no debe tumbar /analyze.
+        """
+        try:
+            conn = self._connection_factory()
+            try:
+                cur = conn.cursor()
+                cur.execute(self._QUERY, {"key": key, "capacity": capacity, "rate": refill_per_second})
+                allowed, tokens = cur.fetchone()
+                conn.commit()
+                cur.close()
+            finally:
+                conn.close()
+        except psycopg2.Error as e:
+            metrics.increment("rate_limit.errors")
+            log.warning("No se pudo consultar el límite de tasa de %s; se permite la petición: %s", key, e)
+            return True, 0
+        return allowed, 0 if allowed else (1 - tokens) / refill_per_second
+
+
+class InflightLimiter:
+    """Limita las inferencias simultáneas del worker; si no hay hueco, se rechaza al momento."""
+
+    def __init__(self, max_inflight):
+        self.max_inflight = max_inflight
+        self._semaphore = threading.BoundedSemaphore(max_inflight)
+        self._lock = threading.Lock()
+        self._inflight = 0
+
+    def try_acquire(self):
+        """Devuelve un hueco (verdadero) o None si no hay; se libera con release(hueco)."""
+        if not self._semaphore.acquire(blocking=False):
+            return None
+        with self._lock:
+            self._inflight += 1
+            metrics.set_gauge("inference.inflight", self._inflight)
+        return True
+
+    @property
+    def inflight(self):
+        with self._lock:
+            return self._inflight
+
+    def release(self, slot=True):
+        with self._lock:
+            self._inflight -= 1
+            metrics.set_gauge("inference.inflight", self._inflight)
+        self._semaphore.release()
+
+
+class PostgresInflightLimiter:
+    """
+    Tope global de inferencias simultáneas entre todos los workers: cada
+    inferencia ocupa una fila libre de inferencias_en_curso (una por hueco)
+    con un plazo de `lease_seconds`, así que los huecos de un worker que muere
+    se recuperan solos. El tope por worker (`local`) se sigue aplicando antes,
+    para no pedir hueco a la base de datos con el worker ya lleno.
+    Si la base de datos falla se admite la petición con el tope por worker.
+    """
+
+    _SLOTS = """
+        INSERT INTO inferencias_en_curso (hueco)
+        SELECT generate_series(0, %(max)s - 1)
+        ON CONFLICT (hueco) DO NOTHING
+    """
+
+    _ACQUIRE = """
+        UPDATE inferencias_en_curso e SET
+            token = %(token)s,
+            ocupado_hasta = clock_timestamp() + make_interval(secs => %(lease)s)
+        FROM (
+            SELECT hueco FROM inferencias_en_curso
+            WHERE hueco < %(max)s AND ocupado_hasta < clock_timestamp()
+            ORDER BY hueco
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        ) libre
+        WHERE e.hueco = libre.hueco
+        RETURNING e.hueco
+    """
+
+    _RELEASE = """
+        UPDATE inferencias_en_curso SET token = NULL, ocupado_hasta = '-infinity'
+        WHERE hueco = %(hueco)s AND token = %(token)s
+    """
+
+    def __init__(self, connection_factory, max_inflight, lease_seconds, local):
+        self.max_inflight = max_inflight
+        self.lease_seconds = lease_seconds
+        self.local = local
+        self._connection_factory = connection_factory
+        self._slots_ready = False
+
+    @property
+    def inflight(self):
+        return self.local.inflight
+
+    def _execute(self, query, params):
+        conn = self._connection_factory()
+        try:
+            if not self._slots_ready:
+                # Una vez por proceso: no cuenta en el presupuesto de la ruta
+                setup = conn.internal_cursor()
+                setup.execute(self._SLOTS, {"max": self.max_inflight})
+                setup.close()
+                self._slots_ready = True
+            cur = conn.cursor()
+            cur.execute(query, params)
+            row = cur.fetchone() if cur.description else None
+            conn.commit()
+            cur.close()
+        finally:
+            conn.close()
+        return row
+
+    def try_acquire(self):
+        if not self.local.try_acquire():
+            return None
+        token = str(uuid.uuid4())
+        try:
+            row = self._execute(self._ACQUIRE, {"token": token, "max": self.max_inflight, "lease": self.lease_seconds})
+        except psycopg2.Error as e:
+            metrics.increment("inference.global.errors")
+            log.warning("No se pudo reservar un hueco global de inferencia; se aplica solo el tope del worker: %s", e)
+            return (None, None)
+        if row is None:
+            self.local.release()
+            metrics.increment("inference.global.shed")
+            return None
+        return (row[0], token)
+
+    def release(self, slot):
+        self.local.release()
+        hueco, token = slot
+        if hueco is None:
+            return
+        try:
+            self._execute(self._RELEASE, {"hueco": hueco, "token": token})
+        except psycopg2.Error as e:
+            # El hueco se libera solo cuando vence su plazo
+            metrics.increment("inference.global.errors")
+            log.warning("No se pudo liberar el hueco global de inferencia %s: %s", hueco, e)
+
+
+def _too_many_requests(message, retry_after):
+    response = jsonify({"error": message})
+    response.status_code = 429
+    response.headers["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter(connection_factory):
+    """Devuelve el limitador configurado en RATE_LIMIT_BACKEND ('memory' o 'postgres')."""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                if Config.RATE_LIMIT_BACKEND == "postgres":
+                    _limiter = PostgresTokenBucket(connection_factory)
+                else:
+                    _limiter = MemoryTokenBucket()
+    return _limiter
+
+
+def rate_limited(route, capacity, per_minute, connection_factory):
+    """
+    Decorador para rutas con token_required: limita las peticiones de cada
+    usuario en `route` a ráfagas de `capacity` y `per_minute` sostenidas.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(current_user_id, *args, **kwargs):
+            limiter = get_limiter(connection_factory)
+            allowed, retry_after = limiter.take(f"{route}:{current_user_id}", capacity, per_minute / 60.0)
+            if not allowed:
+                metrics.increment(f"rate_limit.{route}.denied")
+                return _too_many_requests(
+                    "Has realizado demasiadas solicitudes. Espera un momento e inténtalo de nuevo.",
+                    retry_after
+                )
+            metrics.increment(f"rate_limit.{route}.allowed")
+            return f(current_user_id, *args, **kwargs)
+        return decorated
+    return decorator
+
+
+def inflight_limiter(connection_factory):
+    """
+    Tope de inferencias simultáneas según INFLIGHT_BACKEND: 'memory' limita
+    cada worker a MAX_INFLIGHT_INFERENCES; 'postgres' limita además el total
+    de todos los workers a MAX_INFLIGHT_INFERENCES_GLOBAL.
+    """
+    local = InflightLimiter(Config.MAX_INFLIGHT_INFERENCES)
+    if Config.INFLIGHT_BACKEND == "postgres":
+        return PostgresInflightLimiter(
+            connection_factory, Config.MAX_INFLIGHT_INFERENCES_GLOBAL, Config.INFLIGHT_LEASE_SECONDS, local
+        )
+    return local
+
+
+def admission_controlled(limiter, retry_after):
+    """
+    Decorador que ocupa un hueco del limitador durante la petición. Si ya
+    está al máximo, responde 429 en lugar de encolar.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            slot = limiter.try_acquire()
+            if not slot:
+                metrics.increment("inference.shed")
+                return _too_many_requests(
+                    "El servidor está procesando demasiados análisis. Inténtalo de nuevo en unos segundos.",
+                    retry_after
+                )
+            try:
+                return f(*args, **kwargs)
+            finally:
+                limiter.release(slot)
+        return decorated
+    return decorator
@@ -0,0 +1,177 @@
+# backend/replay_decisions.py
+
+import argparse
+import sys
+import time
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from config import Config
+from decision_policy import deciding_route, displayed_prediction, merge_sides
+
+# Análisis guardados con las dos caras y, si están en imagenes_hash, la
+# predicción individual de cada una con el modelo actual
+_PAIRS_SQL = """
+    SELECT a.id_analisis, a.url_imagen, a.url_imagen_reverso,
+           hf.resultado_prediccion AS pred_frente, hf.confianza AS conf_frente,
+           hr.resultado_prediccion AS pred_reverso, hr.confianza AS conf_reverso
+    FROM analisis a
+    LEFT JOIN imagenes_hash hf
+           ON hf.url_imagen = a.url_imagen AND hf.modelo = %(modelo)s AND hf.resultado_prediccion IS NOT NULL
+    LEFT JOIN imagenes_hash hr
+           ON hr.url_imagen = a.url_imagen_reverso AND hr.modelo = %(modelo)s AND hr.resultado_prediccion IS NOT NULL
+    WHERE a.url_imagen_reverso IS NOT NULL
+    ORDER BY a.id_analisis DESC
+    LIMIT %(limite)s
+"""
+
+
+def _measure_side(url):
+    """Descarga y predice una cara midiendo cada fase (gasta una llamada al modelo)."""
+    from storage_utils import download_image
+    from app import _infer, _top_prediction
+
+    start = time.time()
+    image_bytes = download_image(url)
+    downloaded = time.time()
+    prediction, confidence = _top_prediction(_infer(image_bytes))
+    return {
+        "prediction": prediction,
+        "confidence": confidence,
+        "download_s": downloaded - start,
+        "inference_s": time.time() - downloaded,
+    }
+
+
+def load_pairs(limit, infer, download_s, inference_s):
+    """
+    Devuelve [(id_analisis, frente, reverso)] con la predicción y los tiempos
+    de cada cara. Sin `infer` se usan las predicciones de imagenes_hash y los
+    tiempos estimados, y se omiten los pares sin predicción guardada; con
+    `infer` se vuelven a predecir todas las caras midiendo los tiempos reales.
+    """
+    conn = psycopg2.connect(Config.DATABASE_URI)
+    try:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute(_PAIRS_SQL, {"modelo": Config.ROBOFLOW_MODEL_ID, "limite": limit})
+        rows = cur.fetchall()
+        cur.close()
+    finally:
+        conn.close()
+
+    pairs, skipped = [], 0
+    for row in rows:
+        if infer:
+            try:
+                front, back = _measure_side(row['url_imagen']), _measure_side(row['url_imagen_reverso'])
+            except Exception as e:
+                print(f"  - ERROR en el análisis {row['id_analisis']}: {e}")
+                skipped += 1
+                continue
+        elif row['pred_frente'] is None or row['pred_reverso'] is None:
+            skipped += 1
+            continue
+        else:
+            front, back = (
+                {"prediction": prediction, "confidence": float(confidence),
+                 "download_s": download_s, "inference_s": inference_s}
+                for prediction, confidence in (
+                    (row['pred_frente'], row['conf_frente']), (row['pred_reverso'], row['conf_reverso'])
+                )
+            )
+        pairs.append((row['id_analisis'], front, back))
+    return pairs, skipped
+
+
+def simulate(policy, front, back, front_min_confidence=0.0, first=None):
+    """
+    Reproduce una política sobre un par ya predicho. La cara que termina
+    antes sale de los tiempos de cada una, salvo que se fuerce con `first`.
+    Devuelve (resultado_final, llamadas, segundos).
+    """
+    total = {side: result["download_s"] + result["inference_s"] for side, result in
+             (("frente", front), ("reverso", back))}
+
+    if policy == "secuencial":
+        if deciding_route("reverso", back):
+            return back, 1, total["reverso"]
+        return merge_sides(front, back), 2, total["reverso"] + total["frente"]
+
+    if first is None and total["frente"] != total["reverso"]:
+        first = min(total, key=total.get)
+    if policy == "anticipada" and first:
+        other = "reverso" if first == "frente" else "frente"
+        results = {"frente": front, "reverso": back}
+        if deciding_route(first, results[first], front_min_confidence):
+            # La inferencia de la otra cara se evita si aún estaba descargando
+            calls = 1 if total[first] < results[other]["download_s"] else 2
+            return results[first], calls, total[first]
+
+    return merge_sides(front, back), 2, max(total.values())
+
+
+def replay(pairs, scenarios):
+    """
+    Compara cada escenario (política, umbral) con la política 'completa'.
+    Devuelve {escenario: (predicciones_cambiadas, llamadas, segundos)}.
+    Los cambios se cuentan en el peor caso: con 'anticipada' la cara que
+    termina antes depende de la red, así que se prueban los dos órdenes.
+    """
+    report = {}
+    for policy, threshold in scenarios:
+        changed, calls, seconds = 0, 0, 0.0
+        for _, front, back in pairs:
+            baseline = displayed_prediction(simulate("completa", front, back)[0])
+            orders = ("frente", "reverso") if policy == "anticipada" else (None,)
+            changed += any(
+                displayed_prediction(simulate(policy, front, back, threshold, first)[0]) != baseline
+                for first in orders
+            )
+            _, pair_calls, pair_seconds = simulate(policy, front, back, threshold)
+            calls += pair_calls
+            seconds += pair_seconds
+        report[(policy, threshold)] = (changed, calls, seconds)
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Reproduce las políticas de decisión sobre pares frente/reverso guardados y "
+                    "comprueba que no cambian las predicciones."
+    )
+    parser.add_argument('--limite', type=int, default=1000, help="Pares más recientes a reproducir")
+    parser.add_argument('--inferir', action='store_true',
+                        help="Vuelve a predecir cada cara midiendo tiempos reales (gasta llamadas al modelo)")
+    parser.add_argument('--umbrales', type=float, nargs='*', default=[0.8, 0.9, 0.95],
+                        help="Umbrales de DECISION_FRONT_MIN_CONFIDENCE a evaluar con 'anticipada'")
+    parser.add_argument('--ms-descarga', type=float, default=300, help="Descarga estimada sin --inferir")
+    parser.add_argument('--ms-inferencia', type=float, default=1500, help="Inferencia estimada sin --inferir")
+    args = parser.parse_args()
+
+    pairs, skipped = load_pairs(args.limite, args.inferir, args.ms_descarga / 1000, args.ms_inferencia / 1000)
+    print(f"Pares reproducidos: {len(pairs)} (omitidos {skipped} sin predicción de alguna cara)")
+    if not args.inferir:
+        print("Tiempos estimados: usa --inferir para medir la latencia real")
+    if not pairs:
+        sys.exit(0)
+
+    configured = (Config.DECISION_POLICY, Config.DECISION_FRONT_MIN_CONFIDENCE)
+    scenarios = [("completa", 0.0), ("secuencial", 0.0), ("anticipada", 0.0)]
+    scenarios += [("anticipada", threshold) for threshold in args.umbrales]
+    if configured not in scenarios:
+        scenarios.append(configured)
+    report = replay(pairs, scenarios)
+
+    _, base_calls, base_seconds = report[("completa", 0.0)]
+    print(f"\n{'política':<12} {'umbral':>6} {'cambios':>8} {'llamadas':>9} {'ahorro':>7} {'ms/par':>8} {'ahorro':>7}")
+    for (policy, threshold), (changed, calls, seconds) in report.items():
+        marker = "  ← configurada" if (policy, threshold) == configured else ""
+        print(
+            f"{policy:<12} {threshold:>6.2f} {changed:>8} {calls:>9} {1 - calls / base_calls:>7.1%} "
+            f"{1000 * seconds / len(pairs):>8.0f} {1 - seconds / base_seconds:>7.1%}{marker}"
+        )
+
+    changed = report[configured][0]
+    if changed:
+        print(f"\n❌ La política configurada cambia {changed} predicciones respecto a 'completa'")
+        sys.exit(1)
+    print("\n✅ La política configurada no cambia ninguna predicción")
@@ -0,0 +1,873 @@
+# backend/repository.py
+
+import contextvars
+import logging
+import re
+import time
+from contextlib import contextmanager
+from functools import wraps
+import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+import psycopg2.extras
+from config import Config
+from db_routing import ReplicaRouter, RoutedConnection
+from admin_search import SEARCH_QUERIES
+import metrics
+
+log = logging.getLogger(__name__)
+
+# Todas las consultas de app.py y cleanup_script.py. Cada sentencia tiene un
+# nombre y se prepara en el servidor (PREPARE) la primera vez que se usa en
+# una conexión del pool; después solo se ejecuta (EXECUTE) sin volver a
+# analizarla ni planificarla.
+#
+# Cada ruta declara con @db_route su clase (que fija el statement_timeout
+# de sus conexiones) y cuántas consultas puede hacer como máximo. Las
+# consultas de la petición se cuentan y se cronometran; pasarse del
+# presupuesto queda en las métricas y, con QUERY_BUDGET_STRICT=true (en las
+# pruebas), hace fallar la petición para detectar regresiones N+1.
+
+# statement_timeout en milisegundos por clase de ruta (0 = sin límite)
+STATEMENT_TIMEOUTS_MS = {
+    "lectura": Config.QUERY_TIMEOUT_READ_MS,
+    "escritura": Config.QUERY_TIMEOUT_WRITE_MS,
+    "admin": Config.QUERY_TIMEOUT_ADMIN_MS,
+    "salud": Config.HEALTH_DB_TIMEOUT_MS,
+    # Consultas fuera de una ruta: tareas en segundo plano y cachés
+    "segundo_plano": Config.QUERY_TIMEOUT_BACKGROUND_MS,
+    "mantenimiento": Config.QUERY_TIMEOUT_MAINTENANCE_MS,
+}
+BACKGROUND = "segundo_plano"
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Una ruta ha hecho más consultas de las que declara."""
+
+
+class _RequestStats:
+    __slots__ = ("endpoint", "route_class", "budget", "count", "seconds", "connections")
+
+    def __init__(self, endpoint, route_class, budget):
+        self.endpoint = endpoint
+        self.route_class = route_class
+        self.budget = budget
+        self.count = 0
+        self.seconds = 0.0
+        self.connections = []
+
+
+_current = contextvars.ContextVar("db_request", default=None)
+
+_tracked_cursors = {}
+
+
+def _tracked_cursor(factory):
+    """Subclase del tipo de cursor pedido que cuenta y cronometra cada consulta."""
+    tracked = _tracked_cursors.get(factory)
+    if tracked is None:
+        class TrackedCursor(factory):
+            def execute(self, query, vars=None):
+                start = time.perf_counter()
+                try:
+                    return super().execute(query, vars)
+                finally:
+                    _record(self.connection.target, time.perf_counter() - start)
+
+            def executemany(self, query, vars_list):
+                start = time.perf_counter()
+                try:
+                    return super().executemany(query, vars_list)
+                finally:
+                    _record(self.connection.target, time.perf_counter() - start)
+
+        tracked = _tracked_cursors[factory] = TrackedCursor
+    return tracked
+
+
+def _record(target, seconds):
+    metrics.observe(f"db.query.{target}", seconds)
+    stats = _current.get()
+    if stats is not None:
+        stats.count += 1
+        stats.seconds += seconds
+
+
+class TrackedConnection(RoutedConnection):
+    """Conexión del pool cuyos cursores cuentan las consultas de la petición en curso."""
+
+    timeout_ms = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Sentencias ya preparadas en esta sesión del servidor
+        self.prepared = set()
+
+    def cursor(self, *args, cursor_factory=None, **kwargs):
+        factory = cursor_factory or self.cursor_factory or psycopg2.extensions.cursor
+        return super().cursor(*args, cursor_factory=_tracked_cursor(factory), **kwargs)
+
+
+router = ReplicaRouter(
+    Config.DATABASE_URI,
+    Config.REPLICA_DATABASE_URLS,
+    max_lag_seconds=Config.REPLICA_MAX_LAG_SECONDS,
+    status_seconds=Config.REPLICA_STATUS_SECONDS,
+    connect_timeout=Config.REPLICA_CONNECT_TIMEOUT,
+    write_marks_backend=Config.READ_YOUR_WRITES_BACKEND,
+    read_your_writes_seconds=Config.READ_YOUR_WRITES_SECONDS,
+    pool_size=Config.DB_POOL_SIZE,
+    pool_timeout=Config.DB_POOL_TIMEOUT,
+    connection_factory=TrackedConnection,
+    pool_ping_seconds=Config.DB_POOL_PING_SECONDS,
+)
+
+
+def _set_statement_timeout(conn, route_class):
+    timeout_ms = STATEMENT_TIMEOUTS_MS[route_class]
+    if conn.timeout_ms == timeout_ms:
+        return
+    cur = conn.internal_cursor()
+    if conn.info.transaction_status == psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        # Fuera de transacción para que se mantenga aunque la ruta haga rollback
+        conn.autocommit = True
+        cur.execute("SET statement_timeout = %s", (timeout_ms,))
+        conn.autocommit = False
+        conn.timeout_ms = timeout_ms
+    else:
+        cur.execute("SET statement_timeout = %s", (timeout_ms,))
+        conn.timeout_ms = None
+    cur.close()
+
+
+def _checkout(conn):
+    stats = _current.get()
+    _set_statement_timeout(conn, stats.route_class if stats else BACKGROUND)
+    if stats is not None:
+        stats.connections.append((conn, conn.lease))
+    return conn
+
+
+def connect():
+    """Conexión del pool al primario, con el statement_timeout de la ruta en curso; close() la devuelve."""
+    return _checkout(router.primary_connection())
+
+
+def connect_read(user_id=None):
+    """Conexión para lecturas: una réplica si hay alguna al día (ver db_routing.py) o el primario."""
+    return _checkout(router.read_connection(user_id))
+
+
+def connect_script(route_class="mantenimiento"):
+    """Conexión propia (fuera del pool) para los scripts, con el statement_timeout de `route_class`."""
+    conn = psycopg2.connect(Config.DATABASE_URI, connection_factory=TrackedConnection)
+    _set_statement_timeout(conn, route_class)
+    return conn
+
+
+@contextmanager
+def reading(user_id=None, cursor_factory=psycopg2.extras.DictCursor):
+    """Cursor de solo lectura, en una réplica si es posible. `user_id` ve sus propias escrituras."""
+    conn = connect_read(user_id)
+    try:
+        cur = conn.cursor(cursor_factory=cursor_factory)
+        yield cur
+        cur.close()
+    finally:
+        conn.close()
+
+
+@contextmanager
+def transaction(user_id=None, cursor_factory=psycopg2.extras.DictCursor):
+    """
+    Cursor en el primario dentro de una transacción: commit al salir del
+    bloque, rollback si hay una excepción. Con `user_id`, sus próximas
+    lecturas ven lo escrito aunque vayan a una réplica.
+    """
+    conn = connect()
+    try:
+        cur = conn.cursor(cursor_factory=cursor_factory)
+        try:
+            yield cur
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+        router.record_write(conn, user_id)
+        cur.close()
+    finally:
+        conn.close()
+
+
+def db_route(route_class, max_queries):
+    """
+    Declara la clase de la ruta (su statement_timeout) y su presupuesto de
+    consultas. Va debajo de @token_required / @admin_required.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            stats = _RequestStats(f.__name__, route_class, max_queries)
+            token = _current.set(stats)
+            try:
+                return f(*args, **kwargs)
+            finally:
+                _current.reset(token)
+                _finish(stats)
+        decorated.query_budget = max_queries
+        return decorated
+    return decorator
+
+
+@contextmanager
+def count_queries(route_class=BACKGROUND):
+    """
+    Cuenta las consultas hechas dentro del bloque por cursores de
+    TrackedConnection (los PREPARE no cuentan). Para los scripts de
+    comprobación, y para dejar fuera del presupuesto de una ruta las
+    consultas excepcionales (p. ej. al fallar Storage).
+    """
+    stats = _RequestStats("script", route_class, None)
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+
+def _finish(stats):
+    # Conexiones que la ruta no devolvió (p. ej. en un return anticipado).
+    # Una que sí devolvió puede estar ya prestada a otro hilo (io_executor):
+    # solo se cierran los préstamos que siguen siendo de la ruta
+    for conn, lease in stats.connections:
+        if conn.opened_at is not None and conn.lease == lease:
+            metrics.increment("db.pool.no_devuelta")
+            conn.close()
+    metrics.observe(f"db.request.{stats.endpoint}", stats.seconds)
+    metrics.increment(f"db.queries.{stats.endpoint}", stats.count)
+    if stats.count > stats.budget:
+        metrics.increment(f"db.budget_exceeded.{stats.endpoint}")
+        message = f"{stats.endpoint} hizo {stats.count} consultas (presupuesto: {stats.budget})"
+        log.warning(message, extra={"consultas": stats.count, "presupuesto": stats.budget})
+        if Config.QUERY_BUDGET_STRICT:
+            raise QueryBudgetExceeded(message)
+
+
+# --- Sentencias preparadas ---------------------------------------------------
+
+_PARAM = re.compile(r"%\((\w+)\)s|%s|%%")
+_compiled = {}
+
+
+def _compile(sql):
+    """Pasa los parámetros de psycopg2 (%s o %(nombre)s) a los $1, $2... de PREPARE."""
+    names = []
+
+    def replace(match):
+        if match.group(0) == "%%":
+            return "%"
+        name = match.group(1) if match.group(1) is not None else len(names)
+        if name not in names:
+            names.append(name)
+        return f"${names.index(name) + 1}"
+
+    return _PARAM.sub(replace, sql), names
+
+
+def run(cur, name, sql, params=()):
+    """Ejecuta `sql` como la sentencia preparada `name` de la conexión del cursor."""
+    compiled = _compiled.get(name)
+    if compiled is None:
+        compiled = _compiled[name] = _compile(sql)
+    text, names = compiled
+    conn = cur.connection
+    if name not in conn.prepared:
+        prepare = conn.internal_cursor()
+        prepare.execute(f"PREPARE {name} AS {text}")
+        prepare.close()
+        conn.prepared.add(name)
+        metrics.increment("db.prepared")
+    args = [params[key] for key in names]
+    try:
+        if args:
+            cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(args))})", args)
+        else:
+            cur.execute(f"EXECUTE {name}")
+    except psycopg2.errors.FeatureNotSupported:
+        # "cached plan must not change result type": una migración cambió
+        # las columnas de un SELECT *. La conexión no vuelve al pool.
+        conn.discard = True
+        raise
+
+
+# --- Usuarios y sesión -------------------------------------------------------
+
+def create_user(cur, nombre_completo, email, password_hash, ong, profile_image_url):
+    run(cur, "usuario_registrar", """
+        INSERT INTO usuarios (nombre_completo, email, password_hash, ong, profile_image_url)
+        VALUES (%s, %s, %s, %s, %s)
+    """, (nombre_completo, email, password_hash, ong, profile_image_url))
+
+
+def user_credentials(cur, email):
+    run(cur, "usuario_credenciales", """
+        SELECT id_usuario, password_hash, es_admin, nombre_completo
+        FROM usuarios WHERE LOWER(email) = LOWER(%s::text)
+    """, (email,))
+    return cur.fetchone()
+
+
+def password_hash(cur, user_id):
+    run(cur, "usuario_hash", "SELECT password_hash FROM usuarios WHERE id_usuario = %s", (user_id,))
+    return cur.fetchone()
+
+
+def set_password_hash(cur, user_id, new_hash):
+    """Devuelve False si el usuario no existe."""
+    run(cur, "usuario_cambiar_hash", "UPDATE usuarios SET password_hash = %s WHERE id_usuario = %s",
+        (new_hash, user_id))
+    return cur.rowcount > 0
+
+
+def profile(cur, user_id):
+    run(cur, "perfil", """
+        SELECT nombre_completo, email, ong, profile_image_url FROM usuarios WHERE id_usuario = %s
+    """, (user_id,))
+    return cur.fetchone()
+
+
+def update_profile(cur, user_id, nombre_completo=None, profile_image_url=None):
+    """Los campos a None se dejan como están."""
+    run(cur, "perfil_actualizar", """
+        UPDATE usuarios SET
+            nombre_completo = COALESCE(%s, nombre_completo),
+            profile_image_url = COALESCE(%s, profile_image_url)
+        WHERE id_usuario = %s
+    """, (nombre_completo, profile_image_url, user_id))
+
+
+def delete_user_with_data(cur, user_id, allow_admin):
+    """
+    Borra un usuario y todos sus análisis en una única sentencia. La fila del
+    usuario se bloquea (FOR UPDATE) para que no se inserten análisis nuevos
+    mientras tanto, y los DELETE ... RETURNING devuelven las URLs de las
+    imágenes sin tener que volver a leer las filas.
+    Devuelve la fila con es_admin (NULL si el usuario no existe), borrado
+    y la lista de URLs a eliminar de Firebase Storage.
+    """
+    run(cur, "usuario_borrar_con_datos", """
+        WITH objetivo AS (
+            SELECT id_usuario, es_admin
+            FROM usuarios
+            WHERE id_usuario = %(user_id)s
+            FOR UPDATE
+        ),
+        analisis_borrados AS (
+            DELETE FROM analisis a
+            USING objetivo o
+            WHERE a.id_usuario = o.id_usuario
+              AND (%(allow_admin)s OR NOT COALESCE(o.es_admin, FALSE))
+            RETURNING a.url_imagen, a.url_imagen_reverso, a.url_miniatura, a.url_mediana,
+                      a.url_miniatura_reverso, a.url_mediana_reverso
+        ),
+        usuario_borrado AS (
+            DELETE FROM usuarios u
+            USING objetivo o
+            WHERE u.id_usuario = o.id_usuario
+              AND (%(allow_admin)s OR NOT COALESCE(o.es_admin, FALSE))
+            RETURNING u.profile_image_url
+        )
+        SELECT
+            (SELECT es_admin FROM objetivo) AS es_admin,
+            EXISTS (SELECT 1 FROM usuario_borrado) AS borrado,
+            ARRAY(
+                SELECT profile_image_url FROM usuario_borrado WHERE profile_image_url IS NOT NULL
+                UNION ALL
+                SELECT url
+                FROM analisis_borrados,
+                     unnest(ARRAY[url_imagen, url_imagen_reverso, url_miniatura, url_mediana,
+                                  url_miniatura_reverso, url_mediana_reverso]) AS url
+                WHERE url IS NOT NULL
+            ) AS urls
+    """, {"user_id": user_id, "allow_admin": allow_admin})
+    return cur.fetchone()
+
+
+def ping(cur):
+    run(cur, "salud", "SELECT 1")
+    return cur.fetchone()
+
+
+# --- Historial ---------------------------------------------------------------
+
+def save_analysis(cur, user_id, url_imagen, url_imagen_reverso, resultado_prediccion, confianza, fecha_analisis,
+                  hash_frente=None, hash_reverso=None):
+    """
+    Inserta el análisis y copia las detecciones que /analyze dejó en
+    imagenes_hash. Devuelve su ID. Cada cara se busca por el hash de
+    contenido que devolvió /analyze; sin él, por su URL (que no coincide si
+    la imagen ya estaba registrada con otra URL todavía en uso). Las reservas
+    del usuario sobre sus imágenes (ver image_hash.lookup_image) sobran una
+    vez guardado.
+    """
+    run(cur, "analisis_guardar", """
+        WITH nuevo AS (
+            INSERT INTO analisis (id_usuario, url_imagen, url_imagen_reverso, resultado_prediccion, confianza, fecha_analisis)
+            VALUES (%(user_id)s, %(frente)s, %(reverso)s, %(resultado)s, %(confianza)s, %(fecha)s)
+            RETURNING id_analisis
+        ), liberadas AS (
+            DELETE FROM imagenes_reservadas
+            WHERE id_usuario = %(user_id)s AND url IN (%(frente)s, %(reverso)s)
+        )
+        SELECT id_analisis FROM nuevo
+    """, {
+        "user_id": user_id, "frente": url_imagen, "reverso": url_imagen_reverso,
+        "resultado": resultado_prediccion, "confianza": confianza, "fecha": fecha_analisis,
+    })
+    new_id = cur.fetchone()[0]
+    run(cur, "detecciones_copiar", """
+        INSERT INTO analisis_detecciones (id_analisis, modelo, frente, reverso)
+        SELECT %(id)s, COALESCE(frente.modelo, reverso.modelo), frente.detecciones, reverso.detecciones
+        FROM (SELECT modelo, detecciones FROM imagenes_hash
+              WHERE detecciones IS NOT NULL
+                AND (hash_contenido = %(hash_frente)s::text
+                     OR (%(hash_frente)s::text IS NULL AND url_imagen = %(frente)s))
+              LIMIT 1) AS frente
+        FULL JOIN (SELECT modelo, detecciones FROM imagenes_hash
+                   WHERE detecciones IS NOT NULL
+                     AND (hash_contenido = %(hash_reverso)s::text
+                          OR (%(hash_reverso)s::text IS NULL AND url_imagen = %(reverso)s))
+                   LIMIT 1) AS reverso ON TRUE
+    """, {
+        "id": new_id, "frente": url_imagen, "reverso": url_imagen_reverso,
+        "hash_frente": hash_frente, "hash_reverso": hash_reverso,
+    })
+    return new_id
+
+
+def user_history(cur, user_id):
+    run(cur, "historial", """
+        SELECT id_analisis, url_imagen, url_imagen_reverso,
+               url_miniatura, url_mediana, url_miniatura_reverso, url_mediana_reverso,
+               resultado_prediccion, confianza, fecha_analisis
+        FROM analisis
+        WHERE id_usuario = %s AND fecha_eliminado IS NULL
+        ORDER BY fecha_analisis DESC
+    """, (user_id,))
+    return cur.fetchall()
+
+
+def history_changes(cur, user_id, since, limit):
+    """
+    Cambios y borrados definitivos con versión mayor que `since`, en orden de
+    versión. Solo los de transacciones anteriores a la más antigua que sigue
+    en curso: una versión menor aún sin confirmar no puede quedar por debajo
+    de la marca que se devuelve (ver migrations/010_version_transaccion.sql).
+    """
+    run(cur, "historial_cambios", """
+        SELECT version, id_analisis, FALSE AS borrado,
+               url_imagen, url_imagen_reverso,
+               url_miniatura, url_mediana, url_miniatura_reverso, url_mediana_reverso,
+               resultado_prediccion, confianza, fecha_analisis, fecha_eliminado
+        FROM analisis
+        WHERE id_usuario = %(user_id)s AND version > %(since)s
+          AND (version_xid IS NULL OR version_xid < pg_snapshot_xmin(pg_current_snapshot()))
+        UNION ALL
+        SELECT version, id_analisis, TRUE AS borrado,
+               NULL, NULL, NULL, NULL, NULL, NULL, NULL, NULL, NULL, NULL
+        FROM analisis_eliminados
+        WHERE id_usuario = %(user_id)s AND version > %(since)s
+          AND (version_xid IS NULL OR version_xid < pg_snapshot_xmin(pg_current_snapshot()))
+        ORDER BY version
+        LIMIT %(limit)s
+    """, {"user_id": user_id, "since": since, "limit": limit})
+    return cur.fetchall()
+
+
+def analysis_detections(cur, analysis_id, user_id):
+    run(cur, "detecciones_analisis", """
+        SELECT a.url_imagen, a.url_imagen_reverso, d.modelo, d.frente, d.reverso
+        FROM analisis a
+        LEFT JOIN analisis_detecciones d ON d.id_analisis = a.id_analisis
+        WHERE a.id_analisis = %s AND a.id_usuario = %s
+    """, (analysis_id, user_id))
+    return cur.fetchone()
+
+
+def store_detections(cur, analysis_id, modelo, frente, reverso):
+    """Guarda las detecciones que falten sin sobrescribir las que ya hay."""
+    run(cur, "detecciones_guardar", """
+        INSERT INTO analisis_detecciones (id_analisis, modelo, frente, reverso)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (id_analisis) DO UPDATE SET
+            frente = COALESCE(analisis_detecciones.frente, EXCLUDED.frente),
+            reverso = COALESCE(analisis_detecciones.reverso, EXCLUDED.reverso),
+            modelo = COALESCE(analisis_detecciones.modelo, EXCLUDED.modelo)
+    """, (analysis_id, modelo, *(
+        psycopg2.extras.Json(side) if side is not None else None for side in (frente, reverso)
+    )))
+
+
+def trash_analysis(cur, analysis_id, owner_id=None):
+    """Mueve un análisis a la papelera (owner_id None = cualquier usuario). False si no existe."""
+    run(cur, "analisis_a_papelera", """
+        UPDATE analisis SET fecha_eliminado = NOW() AT TIME ZONE 'UTC'
+        WHERE id_analisis = %(id)s AND (%(owner_id)s::int IS NULL OR id_usuario = %(owner_id)s)
+    """, {"id": analysis_id, "owner_id": owner_id})
+    return cur.rowcount > 0
+
+
+def restore_analysis(cur, analysis_id, owner_id=None):
+    """Saca un análisis de la papelera (owner_id None = cualquier usuario). False si no existe."""
+    run(cur, "analisis_restaurar", """
+        UPDATE analisis SET fecha_eliminado = NULL
+        WHERE id_analisis = %(id)s AND (%(owner_id)s::int IS NULL OR id_usuario = %(owner_id)s)
+    """, {"id": analysis_id, "owner_id": owner_id})
+    return cur.rowcount > 0
+
+
+def restore_all(cur, user_id):
+    """Restaura toda la papelera del usuario. Devuelve cuántos análisis."""
+    run(cur, "papelera_restaurar_todo", """
+        UPDATE analisis SET fecha_eliminado = NULL WHERE id_usuario = %s AND fecha_eliminado IS NOT NULL
+    """, (user_id,))
+    return cur.rowcount
+
+
+def user_trash(cur, user_id):
+    run(cur, "papelera_usuario", """
+        SELECT * FROM analisis WHERE id_usuario = %s AND fecha_eliminado IS NOT NULL ORDER BY fecha_eliminado DESC
+    """, (user_id,))
+    return cur.fetchall()
+
+
+def delete_analysis(cur, analysis_id, user_id):
+    """Borra definitivamente un análisis del usuario. Devuelve sus URLs o None si no existe."""
+    run(cur, "analisis_borrar", """
+        DELETE FROM analisis WHERE id_analisis = %s AND id_usuario = %s
+        RETURNING url_imagen, url_imagen_reverso, url_miniatura, url_mediana, url_miniatura_reverso, url_mediana_reverso
+    """, (analysis_id, user_id))
+    return cur.fetchone()
+
+
+def empty_trash(cur, user_id):
+    """Borra definitivamente la papelera del usuario. Devuelve las URLs de lo borrado."""
+    run(cur, "papelera_vaciar", """
+        DELETE FROM analisis WHERE id_usuario = %s AND fecha_eliminado IS NOT NULL
+        RETURNING url_imagen, url_imagen_reverso, url_miniatura, url_mediana, url_miniatura_reverso, url_mediana_reverso
+    """, (user_id,))
+    return cur.fetchall()
+
+
+# Condición que debe cumplir cada análisis y sentencia a aplicar por acción masiva
+BULK_ACTIONS = {
+    "delete": (
+        "fecha_eliminado IS NULL",
+        """UPDATE analisis a SET fecha_eliminado = NOW() AT TIME ZONE 'UTC'
+           FROM objetivos o
+           WHERE a.id_analisis = o.id_analisis AND a.fecha_eliminado IS NULL AND {propietario}
+           RETURNING a.*""",
+    ),
+    "restore": (
+        "fecha_eliminado IS NOT NULL",
+        """UPDATE analisis a SET fecha_eliminado = NULL
+           FROM objetivos o
+           WHERE a.id_analisis = o.id_analisis AND a.fecha_eliminado IS NOT NULL AND {propietario}
+           RETURNING a.*""",
+    ),
+    "permanent": (
+        "fecha_eliminado IS NOT NULL",
+        """DELETE FROM analisis a
+           USING objetivos o
+           WHERE a.id_analisis = o.id_analisis AND a.fecha_eliminado IS NOT NULL AND {propietario}
+           RETURNING a.*""",
+    ),
+}
+
+
+def bulk_trash(cur, action, owner_id, limit, ids=None, prediccion=None, antes_de=None):
+    """
+    Aplica una acción de BULK_ACTIONS a una lista de IDs o, si `ids` es None,
+    a los análisis que cumplan el filtro, con una sola sentencia. Devuelve
+    una fila por análisis solicitado (id_solicitado y las columnas del
+    análisis afectado, NULL si no se encontró).
+    """
+    state_condition, action_sql = BULK_ACTIONS[action]
+    if ids is not None:
+        targets_sql = "SELECT DISTINCT unnest(%(ids)s::int[]) AS id_analisis"
+    else:
+        targets_sql = f"""
+            SELECT id_analisis FROM analisis
+            WHERE {state_condition}
+              AND (%(owner_id)s::int IS NULL OR id_usuario = %(owner_id)s)
+              AND (%(prediccion)s::text IS NULL OR resultado_prediccion = %(prediccion)s)
+              AND (%(antes_de)s::timestamp IS NULL OR fecha_analisis < %(antes_de)s::timestamp)
+            ORDER BY id_analisis
+            LIMIT %(limite)s
+        """
+    run(cur, f"masivo_{action}_{'ids' if ids is not None else 'filtro'}", f"""
+        WITH objetivos AS ({targets_sql}),
+        afectados AS ({action_sql.format(propietario="(%(owner_id)s::int IS NULL OR a.id_usuario = %(owner_id)s)")})
+        SELECT o.id_analisis AS id_solicitado, af.*
+        FROM objetivos o
+        LEFT JOIN afectados af ON af.id_analisis = o.id_analisis
+        ORDER BY o.id_analisis
+    """, {"owner_id": owner_id, "limite": limit, "ids": ids, "prediccion": prediccion, "antes_de": antes_de})
+    return cur.fetchall()
+
+
+def expired_trash(cur, cutoff):
+    """Borra los análisis que llevan en la papelera desde antes de `cutoff` y devuelve sus URLs."""
+    run(cur, "papelera_caducada", """
+        DELETE FROM analisis WHERE fecha_eliminado IS NOT NULL AND fecha_eliminado < %s
+        RETURNING id_analisis, url_imagen, url_imagen_reverso, url_miniatura, url_mediana,
+                  url_miniatura_reverso, url_mediana_reverso
+    """, (cutoff,))
+    return cur.fetchall()
+
+
+# --- Enfermedades y tratamientos ---------------------------------------------
+
+def disease_by_class(cur, roboflow_class):
+    run(cur, "enfermedad_por_clase", "SELECT * FROM enfermedades WHERE roboflow_class = %s", (roboflow_class,))
+    return cur.fetchone()
+
+
+def disease_treatments(cur, disease_id):
+    run(cur, "tratamientos_enfermedad", "SELECT * FROM tratamientos WHERE id_enfermedad = %s", (disease_id,))
+    return cur.fetchall()
+
+
+def disease_guide(cur):
+    """Todas las enfermedades con los datos de la Guía de Tratamientos."""
+    run(cur, "guia_enfermedades", """
+        SELECT
+            id_enfermedad as id,
+            nombre_comun,
+            roboflow_class,
+            imagen_url,
+            tipo,
+            prevencion,
+            riesgo
+        FROM enfermedades
+        ORDER BY nombre_comun ASC
+    """)
+    return cur.fetchall()
+
+
+def treatment_guide(cur, disease_id):
+    """Tratamientos de una enfermedad para la Guía de Tratamientos."""
+    run(cur, "guia_tratamientos", """
+        SELECT
+            id_tratamiento as id,
+            nombre_comercial,
+            ingrediente_activo,
+            tipo_tratamiento,
+            COALESCE(dosis_valor, 0.0) as dosis, -- Si es NULL, devuelve 0.0
+            COALESCE(dosis_unidad, '') as unidad_medida, -- Si es NULL, devuelve ''
+            CAST(NULL AS TEXT) as periodo_carencia
+        FROM tratamientos
+        WHERE id_enfermedad = %s
+        ORDER BY nombre_comercial ASC
+    """, (disease_id,))
+    return cur.fetchall()
+
+
+def disease_list(cur):
+    run(cur, "enfermedades_admin",
+        "SELECT id_enfermedad, nombre_comun, roboflow_class FROM enfermedades ORDER BY nombre_comun ASC")
+    return cur.fetchall()
+
+
+def update_disease(cur, disease_id, imagen_url=None, tipo=None, prevencion=None, riesgo=None):
+    """Actualiza los campos que no son None. Devuelve la fila actualizada o None si no existe."""
+    run(cur, "enfermedad_actualizar", """
+        UPDATE enfermedades SET
+            imagen_url = COALESCE(%s, imagen_url),
+            tipo = COALESCE(%s, tipo),
+            prevencion = COALESCE(%s, prevencion),
+            riesgo = COALESCE(%s, riesgo)
+        WHERE id_enfermedad = %s RETURNING *
+    """, (imagen_url, tipo, prevencion, riesgo, disease_id))
+    return cur.fetchone()
+
+
+def create_treatment(cur, id_enfermedad, nombre_comercial, ingrediente_activo, tipo_tratamiento, dosis,
+                     frecuencia_aplicacion, notas_adicionales):
+    run(cur, "tratamiento_crear", """
+        INSERT INTO tratamientos (id_enfermedad, nombre_comercial, ingrediente_activo, tipo_tratamiento, dosis,
+                                  frecuencia_aplicacion, notas_adicionales)
+        VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING *
+    """, (id_enfermedad, nombre_comercial, ingrediente_activo, tipo_tratamiento, dosis,
+          frecuencia_aplicacion, notas_adicionales))
+    return cur.fetchone()
+
+
+def update_treatment(cur, treatment_id, nombre_comercial, ingrediente_activo, tipo_tratamiento, dosis,
+                     frecuencia_aplicacion, notas_adicionales):
+    run(cur, "tratamiento_actualizar", """
+        UPDATE tratamientos SET
+            nombre_comercial = %s,
+            ingrediente_activo = %s,
+            tipo_tratamiento = %s,
+            dosis = %s,
+            frecuencia_aplicacion = %s,
+            notas_adicionales = %s
+        WHERE id_tratamiento = %s RETURNING *
+    """, (nombre_comercial, ingrediente_activo, tipo_tratamiento, dosis, frecuencia_aplicacion,
+          notas_adicionales, treatment_id))
+    return cur.fetchone()
+
+
+def delete_treatment(cur, treatment_id):
+    """False si el tratamiento no existe."""
+    run(cur, "tratamiento_borrar", "DELETE FROM tratamientos WHERE id_tratamiento = %s", (treatment_id,))
+    return cur.rowcount > 0
+
+
+# --- Administración ----------------------------------------------------------
+
+def all_analyses(cur, only_duplicates=False):
+    run(cur, "analisis_admin", """
+        SELECT a.*, u.email, a.duplicado_de IS NOT NULL AS es_duplicado
+        FROM analisis a
+        JOIN usuarios u ON a.id_usuario = u.id_usuario
+        WHERE a.fecha_eliminado IS NULL
+          AND (NOT %s OR a.duplicado_de IS NOT NULL)
+        ORDER BY a.fecha_analisis DESC
+    """, (only_duplicates,))
+    return cur.fetchall()
+
+
+def user_analyses(cur, user_id):
+    run(cur, "analisis_usuario_admin", """
+        SELECT a.*, u.email, a.duplicado_de IS NOT NULL AS es_duplicado
+        FROM analisis a
+        JOIN usuarios u ON a.id_usuario = u.id_usuario
+        WHERE a.id_usuario = %s AND a.fecha_eliminado IS NULL
+        ORDER BY a.fecha_analisis DESC
+    """, (user_id,))
+    return cur.fetchall()
+
+
+def users_with_analysis_count(cur):
+    run(cur, "usuarios_con_analisis", """
+        SELECT DISTINCT ON (u.id_usuario) u.id_usuario, u.nombre_completo, u.email, u.profile_image_url,
+        (SELECT COUNT(*) FROM analisis a WHERE a.id_usuario = u.id_usuario AND a.fecha_eliminado IS NULL) as analysis_count
+        FROM usuarios u
+        LEFT JOIN analisis a ON u.id_usuario = a.id_usuario
+        ORDER BY u.id_usuario
+    """)
+    return cur.fetchall()
+
+
+def all_trash(cur):
+    """Papelera de todos los usuarios, con el email de cada uno."""
+    run(cur, "papelera_admin", """
+        SELECT a.*, u.email
+        FROM analisis a
+        JOIN usuarios u ON a.id_usuario = u.id_usuario
+        WHERE a.fecha_eliminado IS NOT NULL
+        ORDER BY a.fecha_eliminado DESC
+    """)
+    return cur.fetchall()
+
+
+def admin_summary(cur):
+    """
+    Totales del panel de administración en una sola consulta. analisis se
+    recorre una vez: GROUPING SETS da a la vez los recuentos por clase y
+    estado y la fila de totales (con los usuarios distintos de la semana).
+    Las imágenes se cuentan por referencia: las que comparten los análisis
+    duplicados cuentan una vez por análisis.
+    """
+    run(cur, "resumen_admin", """
+        WITH grupos AS (
+            SELECT resultado_prediccion AS clase,
+                   fecha_eliminado IS NULL AS activo,
+                   GROUPING(resultado_prediccion, fecha_eliminado IS NULL) <> 0 AS total,
+                   COUNT(*) AS analisis,
+                   COUNT(*) FILTER (WHERE fecha_analisis >= NOW() - INTERVAL '1 day') AS ultimo_dia,
+                   COUNT(*) FILTER (WHERE fecha_analisis >= NOW() - INTERVAL '7 days') AS ultima_semana,
+                   COUNT(*) FILTER (WHERE fecha_analisis >= NOW() - INTERVAL '30 days') AS ultimo_mes,
+                   COUNT(DISTINCT id_usuario) FILTER (
+                       WHERE fecha_analisis >= NOW() - INTERVAL '7 days'
+                   ) AS usuarios_semana,
+                   MAX(fecha_analisis) AS ultimo_analisis,
+                   COUNT(url_imagen) + COUNT(url_imagen_reverso) + COUNT(url_miniatura) + COUNT(url_mediana)
+                       + COUNT(url_miniatura_reverso) + COUNT(url_mediana_reverso) AS imagenes
+            FROM analisis
+            GROUP BY GROUPING SETS ((resultado_prediccion, fecha_eliminado IS NULL), ())
+        )
+        SELECT u.usuarios, u.administradores, u.imagenes_perfil,
+               COALESCE((SELECT SUM(analisis) FROM grupos WHERE NOT total AND activo), 0) AS activos,
+               COALESCE((SELECT SUM(analisis) FROM grupos WHERE NOT total AND NOT activo), 0) AS en_papelera,
+               COALESCE((
+                   SELECT jsonb_object_agg(COALESCE(clase, 'Sin clase'), analisis)
+                   FROM grupos WHERE NOT total AND activo
+               ), '{}'::jsonb) AS por_clase,
+               t.ultimo_dia, t.ultima_semana, t.ultimo_mes, t.usuarios_semana, t.ultimo_analisis, t.imagenes
+        FROM grupos t,
+             (SELECT COUNT(*) AS usuarios,
+                     COUNT(*) FILTER (WHERE es_admin) AS administradores,
+                     COUNT(profile_image_url) AS imagenes_perfil
+              FROM usuarios) u
+        WHERE t.total
+    """)
+    return cur.fetchone()
+
+
+def search(cur, tipo, params):
+    """Búsqueda de administración (admin_search.SEARCH_QUERIES) con los parámetros de search_params()."""
+    run(cur, f"busqueda_{tipo}", SEARCH_QUERIES[tipo], params)
+    return cur.fetchall()
+
+
+# --- Borrados pendientes de Firebase Storage ----------------------------------
+
+def queue_image_deletions(cur, urls, errors):
+    """Encola (o reprograma, con espera creciente) el borrado de imágenes que falló."""
+    run(cur, "borrados_encolar", """
+        INSERT INTO imagenes_por_borrar (url, ultimo_error)
+        SELECT * FROM unnest(%s::text[], %s::text[])
+        ON CONFLICT (url) DO UPDATE SET
+            intentos = imagenes_por_borrar.intentos + 1,
+            ultimo_error = EXCLUDED.ultimo_error,
+            proximo_intento = NOW() + LEAST(imagenes_por_borrar.intentos + 1, 12) * INTERVAL '10 minutes'
+    """, (urls, errors))
+
+
+def pending_image_deletions(cur, limit):
+    """Borrados que toca reintentar, con el instante de la consulta (para forget_image_deletions)."""
+    run(cur, "borrados_pendientes", """
+        SELECT url, NOW() AS inicio FROM imagenes_por_borrar
+        WHERE proximo_intento <= NOW()
+        ORDER BY proximo_intento
+        LIMIT %s
+    """, (limit,))
+    return cur.fetchall()
+
+
+def forget_image_deletions(cur, urls, before):
+    """Quita de la cola las URLs que no se han vuelto a encolar después de `before`."""
+    run(cur, "borrados_olvidar", """
+        DELETE FROM imagenes_por_borrar WHERE url = ANY(%s::text[]) AND proximo_intento <= %s
+    """, (urls, before))
+    return cur.rowcount
+
+
+# --- Evaluación en sombra ----------------------------------------------------
+
+def save_shadow_evaluation(cur, evaluation):
+    """Guarda una fila de evaluaciones_sombra (ver shadow.py) a partir de su dict."""
+    run(cur, "sombra_guardar", """
+        INSERT INTO evaluaciones_sombra (
+            request_id, hash_contenido, modelo_produccion, clase_produccion, confianza_produccion,
+            latencia_produccion_ms, modelo_candidato, clase_candidato, confianza_candidato,
+            latencia_candidato_ms, error
+        ) VALUES (
+            %(request_id)s, %(hash_contenido)s, %(modelo_produccion)s, %(clase_produccion)s,
+            %(confianza_produccion)s, %(latencia_produccion_ms)s, %(modelo_candidato)s, %(clase_candidato)s,
+            %(confianza_candidato)s, %(latencia_candidato_ms)s, %(error)s
+        )
+    """, evaluation)
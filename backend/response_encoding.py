@@ -0,0 +1,92 @@
+# backend/response_encoding.py
+
+import gzip
+import json
+import time
+from flask import request
+from config import Config
+import metrics
+
+try:
+    import msgpack
+except ImportError:  # msgpack viene en requirements.txt, pero es opcional
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:  # brotli no es obligatorio: sin él se usa gzip
+    brotli = None
+
+MSGPACK_MIMETYPE = "application/x-msgpack"
+
+
+def to_columnar(rows):
+    """
+    Convierte una lista de objetos con las mismas claves en un formato por
+    columnas: las claves se envían una sola vez en lugar de en cada fila.
+    """
+    columns = list(rows[0].keys())
+    return {
+        "columnas": columns,
+        "filas": [[row.get(column) for column in columns] for row in rows],
+    }
+
+
+def _is_row_list(data):
+    return isinstance(data, list) and bool(data) and all(isinstance(row, dict) for row in data)
+
+
+def _compress(body):
+    """Comprime el cuerpo con el mejor algoritmo que acepte el cliente."""
+    accepted = request.accept_encodings
+    if brotli is not None and accepted["br"]:
+        return "br", brotli.compress(body, quality=Config.BROTLI_QUALITY)
+    if accepted["gzip"]:
+        return "gzip", gzip.compress(body, compresslevel=Config.GZIP_LEVEL)
+    return None, body
+
+
+def encode_response(response):
+    """
+    Hook after_request: negocia la representación de las respuestas JSON.
+      - ?formato=columnar     -> listas de filas en formato por columnas.
+      - Accept: application/x-msgpack -> cuerpo en MessagePack.
+      - Accept-Encoding: br/gzip      -> compresión si supera el umbral.
+    """
+    if (
+        response.direct_passthrough
+        or response.mimetype != "application/json"
+        or "Content-Encoding" in response.headers
+    ):
+        return response
+
+    start = time.perf_counter()
+    use_msgpack = (
+        msgpack is not None
+        and request.accept_mimetypes.best_match(["application/json", MSGPACK_MIMETYPE]) == MSGPACK_MIMETYPE
+    )
+    use_columnar = request.args.get("formato") == "columnar"
+
+    if use_msgpack or use_columnar:
+        data = response.get_json(silent=True)
+        if use_columnar and _is_row_list(data):
+            data = to_columnar(data)
+        if use_msgpack:
+            response.set_data(msgpack.packb(data, use_bin_type=True))
+            response.mimetype = MSGPACK_MIMETYPE
+        else:
+            response.set_data(json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+    response.vary.add("Accept")
+    response.vary.add("Accept-Encoding")
+
+    body = response.get_data()
+    if len(body) >= Config.COMPRESSION_MIN_BYTES:
+        encoding, compressed = _compress(body)
+        if encoding:
+            response.set_data(compressed)
+            response.headers["Content-Encoding"] = encoding
+            metrics.increment(f"response.{encoding}_bytes_saved", len(body) - len(compressed))
+
+    metrics.observe("response.encoding", time.perf_counter() - start)
+    return response
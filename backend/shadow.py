@@ -0,0 +1,96 @@
+# backend/shadow.py
+
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import metrics
+
+log = logging.getLogger(__name__)
+
+
+class ShadowEvaluator:
+    """
+    Envía una copia muestreada del tráfico de /analyze a un modelo candidato
+    sin tocar la petición: offer() se llama al cerrar la respuesta y solo
+    encola; si la cola está llena, la imagen se descarta y se cuenta en
+    shadow.descartadas. Unos pocos hilos propios llaman al candidato y
+    guardan con `record` su predicción y su latencia junto a las de
+    producción.
+
+    Cada elemento es un dict con image_bytes, hash_contenido, request_id y
+    la clase, confianza y latencia de producción (None si la predicción se
+    reutilizó de imagenes_hash).
+
+    Los hilos se arrancan en cada proceso la primera vez que se usa, así que
+    sobreviven al fork de los workers de gunicorn.
+    """
+
+    def __init__(self, candidate_model, production_model, predict, record, sample_rate, queue_size, workers=1):
+        self.candidate_model = candidate_model
+        self.production_model = production_model
+        self.sample_rate = sample_rate
+        self._predict = predict
+        self._record = record
+        self._queue_size = queue_size
+        self._workers = workers
+        self._start_lock = threading.Lock()
+        self._pid = None
+
+    def sampled(self):
+        return random.random() < self.sample_rate
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(self._queue_size)
+            for i in range(self._workers):
+                threading.Thread(target=self._work, name=f"sombra-{i}", daemon=True).start()
+            self._pid = os.getpid()
+
+    def offer(self, items):
+        self._ensure_started()
+        for item in items:
+            try:
+                self._queue.put_nowait(item)
+                metrics.increment("shadow.encoladas")
+            except queue.Full:
+                metrics.increment("shadow.descartadas")
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            try:
+                self._evaluate(item)
+            except Exception as e:
+                log.warning("No se pudo guardar la evaluación en sombra: %s", e)
+
+    def _evaluate(self, item):
+        clase = confianza = error = None
+        start = time.perf_counter()
+        try:
+            clase, confianza = self._predict(item["image_bytes"])
+        except Exception as e:
+            error = str(e)[:500]
+            metrics.increment("shadow.errores")
+        latency_ms = (time.perf_counter() - start) * 1000
+        metrics.observe("shadow.inference", latency_ms / 1000)
+        self._record({
+            "request_id": item["request_id"],
+            "hash_contenido": item["hash_contenido"],
+            "modelo_produccion": self.production_model,
+            "clase_produccion": item["clase_produccion"],
+            "confianza_produccion": item["confianza_produccion"],
+            "latencia_produccion_ms": item["latencia_produccion_ms"],
+            "modelo_candidato": self.candidate_model,
+            "clase_candidato": clase,
+            "confianza_candidato": confianza,
+            "latencia_candidato_ms": None if error else round(latency_ms, 1),
+            "error": error,
+        })
+        metrics.increment("shadow.evaluadas")
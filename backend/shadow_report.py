@@ -0,0 +1,132 @@
+# backend/shadow_report.py
+
+import argparse
+import sys
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from config import Config
+
+# Compara el modelo candidato con el de producción sobre las evaluaciones en
+# sombra guardadas (tabla evaluaciones_sombra, ver shadow.py): acuerdo en la
+# clase, distribución de la confianza de cada modelo y latencia p50/p95.
+
+_FILTER = "WHERE modelo_candidato = %(modelo)s AND fecha >= NOW() - make_interval(days => %(dias)s)"
+
+_SUMMARY_SQL = f"""
+    SELECT COUNT(*) AS evaluaciones,
+           COUNT(*) FILTER (WHERE error IS NOT NULL) AS errores,
+           COUNT(*) FILTER (WHERE error IS NULL AND clase_candidato IS NOT DISTINCT FROM clase_produccion) AS acuerdos,
+           MIN(modelo_produccion) AS modelo_produccion,
+           COUNT(DISTINCT modelo_produccion) AS modelos_produccion,
+           AVG(confianza_produccion) FILTER (WHERE error IS NULL) AS confianza_media_produccion,
+           AVG(confianza_candidato) FILTER (WHERE error IS NULL) AS confianza_media_candidato,
+           percentile_cont(0.5) WITHIN GROUP (ORDER BY confianza_produccion) FILTER (WHERE error IS NULL)
+               AS confianza_mediana_produccion,
+           percentile_cont(0.5) WITHIN GROUP (ORDER BY confianza_candidato) FILTER (WHERE error IS NULL)
+               AS confianza_mediana_candidato,
+           COUNT(latencia_produccion_ms) AS latencias_produccion,
+           percentile_cont(0.5) WITHIN GROUP (ORDER BY latencia_produccion_ms) AS p50_produccion_ms,
+           percentile_cont(0.95) WITHIN GROUP (ORDER BY latencia_produccion_ms) AS p95_produccion_ms,
+           COUNT(latencia_candidato_ms) AS latencias_candidato,
+           percentile_cont(0.5) WITHIN GROUP (ORDER BY latencia_candidato_ms) AS p50_candidato_ms,
+           percentile_cont(0.95) WITHIN GROUP (ORDER BY latencia_candidato_ms) AS p95_candidato_ms
+    FROM evaluaciones_sombra
+    {_FILTER}
+"""
+
+# Histograma de la confianza de ambos modelos en tramos de 0.1 (el último
+# tramo incluye el 1.0)
+_CONFIDENCE_SQL = f"""
+    SELECT LEAST(FLOOR(confianza * 10), 9)::int AS tramo,
+           COUNT(*) FILTER (WHERE modelo = 'produccion') AS produccion,
+           COUNT(*) FILTER (WHERE modelo = 'candidato') AS candidato
+    FROM (
+        SELECT 'produccion' AS modelo, confianza_produccion AS confianza FROM evaluaciones_sombra
+        {_FILTER} AND error IS NULL
+        UNION ALL
+        SELECT 'candidato', confianza_candidato FROM evaluaciones_sombra
+        {_FILTER} AND error IS NULL
+    ) confianzas
+    WHERE confianza IS NOT NULL
+    GROUP BY 1
+    ORDER BY 1
+"""
+
+_DISAGREEMENTS_SQL = f"""
+    SELECT clase_produccion, clase_candidato, COUNT(*) AS veces
+    FROM evaluaciones_sombra
+    {_FILTER} AND error IS NULL AND clase_candidato IS DISTINCT FROM clase_produccion
+    GROUP BY 1, 2
+    ORDER BY veces DESC
+    LIMIT %(limite)s
+"""
+
+
+def load_report(model, days, limit):
+    conn = psycopg2.connect(Config.DATABASE_URI)
+    try:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        params = {"modelo": model, "dias": days, "limite": limit}
+        cur.execute(_SUMMARY_SQL, params)
+        summary = cur.fetchone()
+        cur.execute(_CONFIDENCE_SQL, params)
+        confidence = cur.fetchall()
+        cur.execute(_DISAGREEMENTS_SQL, params)
+        disagreements = cur.fetchall()
+        cur.close()
+    finally:
+        conn.close()
+    return summary, confidence, disagreements
+
+
+def _fmt(value, pattern):
+    return "-" if value is None else format(value, pattern)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Compara el modelo candidato en sombra con el de producción: acuerdo, "
+                    "confianza y latencia."
+    )
+    parser.add_argument('--modelo', default=Config.SHADOW_MODEL_ID,
+                        help="Modelo candidato (por defecto SHADOW_MODEL_ID)")
+    parser.add_argument('--dias', type=int, default=7, help="Evaluaciones de los últimos N días")
+    parser.add_argument('--limite', type=int, default=10, help="Pares de clases en desacuerdo a mostrar")
+    args = parser.parse_args()
+
+    if not args.modelo:
+        parser.error("indica el modelo candidato con --modelo o SHADOW_MODEL_ID")
+
+    summary, confidence, disagreements = load_report(args.modelo, args.dias, args.limite)
+    total = summary['evaluaciones']
+    print(f"Candidato: {args.modelo} · producción: {summary['modelo_produccion'] or '-'} · últimos {args.dias} días")
+    if summary['modelos_produccion'] > 1:
+        print(f"⚠️  Las evaluaciones mezclan {summary['modelos_produccion']} modelos de producción")
+    if not total:
+        print("No hay evaluaciones en sombra en el periodo")
+        sys.exit(0)
+
+    evaluated = total - summary['errores']
+    print(f"Evaluaciones: {total} ({summary['errores']} errores del candidato, {summary['errores'] / total:.1%})")
+    if evaluated:
+        print(f"Acuerdo en la clase: {summary['acuerdos']}/{evaluated} ({summary['acuerdos'] / evaluated:.1%})")
+
+    print(f"\n{'':<12} {'conf. media':>11} {'mediana':>8} {'p50 ms':>8} {'p95 ms':>8} {'latencias':>10}")
+    for label, key in (("producción", "produccion"), ("candidato", "candidato")):
+        print(
+            f"{label:<12} {_fmt(summary[f'confianza_media_{key}'], '>11.3f')} "
+            f"{_fmt(summary[f'confianza_mediana_{key}'], '>8.3f')} "
+            f"{_fmt(summary[f'p50_{key}_ms'], '>8.0f')} {_fmt(summary[f'p95_{key}_ms'], '>8.0f')} "
+            f"{summary[f'latencias_{key}']:>10}"
+        )
+    print("  (la latencia de producción falta cuando la predicción se reutilizó de imagenes_hash)")
+
+    print(f"\n{'confianza':<10} {'producción':>11} {'candidato':>10}")
+    for row in confidence:
+        low = row['tramo'] / 10
+        print(f"{low:.1f}-{low + 0.1:.1f}{'':<3} {row['produccion']:>11} {row['candidato']:>10}")
+
+    if disagreements:
+        print(f"\n{'producción':<28} {'candidato':<28} {'veces':>6}")
+        for row in disagreements:
+            print(f"{row['clase_produccion'] or '-':<28} {row['clase_candidato'] or '-':<28} {row['veces']:>6}")
@@ -0,0 +1,39 @@
+# backend/startup.py
+
+import importlib
+import logging
+import time
+import metrics
+
+log = logging.getLogger(__name__)
+
+# Módulos lentos de importar que la app carga de forma diferida
+HEAVY_MODULES = (
+    "numpy",
+    "PIL.Image",
+    "requests",
+    "firebase_admin.storage",
+    "google.cloud.storage",
+    "google.api_core.exceptions",
+)
+
+
+def preload_heavy_modules():
+    """
+    Importa los módulos pesados e inicializa Firebase Admin por adelantado.
+    No abre conexiones de red: los clientes HTTP y de Storage se siguen
+    creando en cada proceso la primera vez que se usan, así que es seguro
+    llamarla antes del fork de los workers.
+    """
+    from storage_utils import init_firebase
+
+    start = time.perf_counter()
+    for name in HEAVY_MODULES:
+        importlib.import_module(name)
+    try:
+        init_firebase()
+    except Exception as e:
+        log.error("Error inicializando Firebase Admin: %s", e)
+    elapsed = time.perf_counter() - start
+    metrics.observe("startup.preload", elapsed)
+    log.info("Módulos pesados precargados en %.0f ms", elapsed * 1000)
@@ -0,0 +1,249 @@
+# backend/storage_utils.py
+
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, unquote, urlparse
+from config import Config
+from circuit_breaker import CircuitBreaker
+import metrics
+from structured_logging import with_request_id
+
+log = logging.getLogger(__name__)
+# Un mensaje por imagen borrada: se muestrea (LOG_SAMPLE_RATES)
+deletion_log = logging.getLogger(f"{__name__}.borrado")
+
+# firebase_admin, google-cloud-storage y requests se importan la primera vez
+# que se usan: son los módulos más lentos de cargar y no todas las rutas los
+# necesitan.
+
+_pool_thread = threading.local()
+
+
+# Pool compartido para el trabajo de E/S (descargas, inferencia y borrado de
+# imágenes) que puede ejecutarse en paralelo dentro de una misma petición.
+class _RequestExecutor(ThreadPoolExecutor):
+    """
+    Las tareas registran con el identificador de la petición que las lanzó.
+    Cada hilo del pool se marca al arrancar, para que una tarea sepa si está
+    dentro del pool (y no debe esperar a otras tareas suyas).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, initializer=self._mark_thread, **kwargs)
+
+    def _mark_thread(self):
+        _pool_thread.executor = self
+
+    def owns_current_thread(self):
+        return getattr(_pool_thread, "executor", None) is self
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(with_request_id(fn), *args, **kwargs)
+
+
+io_executor = _RequestExecutor(max_workers=Config.IO_WORKERS, thread_name_prefix="io")
+
+STORAGE_BUCKET = 'identificador-plagas-v2.firebasestorage.app'
+
+# Protege al worker cuando Firebase Storage está caído o muy lento: las
+# llamadas fallan al instante mientras el circuito está abierto. Solo cuentan
+# las llamadas a nuestro bucket; una URL arbitraria que manda un cliente no
+# puede abrirlo.
+storage_breaker = CircuitBreaker(
+    "storage",
+    window_seconds=Config.BREAKER_WINDOW_SECONDS,
+    min_calls=Config.BREAKER_MIN_CALLS,
+    failure_ratio=Config.BREAKER_FAILURE_RATIO,
+    slow_call_seconds=Config.STORAGE_SLOW_SECONDS,
+    slow_call_ratio=Config.BREAKER_SLOW_CALL_RATIO,
+    open_seconds=Config.BREAKER_OPEN_SECONDS,
+)
+
+_firebase_lock = threading.Lock()
+
+
+def init_firebase():
+    """Inicializa Firebase Admin una sola vez por proceso (seguro entre hilos)."""
+    import firebase_admin
+    if firebase_admin._apps:
+        return
+    with _firebase_lock:
+        if not firebase_admin._apps:
+            from firebase_admin import credentials
+            start = time.perf_counter()
+            cred = credentials.Certificate("serviceAccountKey.json")
+            firebase_admin.initialize_app(cred, {
+                'storageBucket': STORAGE_BUCKET
+            })
+            metrics.observe("startup.firebase", time.perf_counter() - start)
+
+
+def _bucket():
+    """Bucket de Firebase Storage; inicializa Firebase Admin en el primer uso."""
+    from firebase_admin import storage
+    init_firebase()
+    return storage.bucket()
+
+
+def storage_path_from_url(image_url):
+    """
+    Convierte una URL de descarga de Firebase Storage
+    (.../o/<ruta codificada>?alt=media&token=...) en la ruta del archivo.
+    """
+    path_part = image_url.split('?')[0]
+    if '/o/' not in path_part:
+        return None
+    return unquote(path_part.split('/o/')[-1])
+
+
+def is_storage_url(image_url):
+    """True si la URL es de un archivo de nuestro bucket de Firebase Storage."""
+    parsed = urlparse(image_url or "")
+    if parsed.hostname == "firebasestorage.googleapis.com":
+        return parsed.path.startswith(f"/v0/b/{STORAGE_BUCKET}/o/")
+    if parsed.hostname == "storage.googleapis.com":
+        return parsed.path.startswith(f"/{STORAGE_BUCKET}/")
+    return False
+
+
+def download_image(image_url):
+    """
+    Descarga una imagen con la sesión HTTP compartida. Solo los errores del
+    servidor (5xx, timeouts) de nuestro bucket cuentan como fallos para el
+    circuito de Storage; una URL inválida (4xx) es un error del cliente y las
+    URLs de otros servidores no pasan por el circuito.
+    """
+    from http_session import get_session
+
+    def _get():
+        response = get_session().get(image_url)
+        if response.status_code >= 500:
+            response.raise_for_status()
+        return response
+
+    if is_storage_url(image_url):
+        response = storage_breaker.call(_get)
+    else:
+        metrics.increment("storage.download.external")
+        response = _get()
+    response.raise_for_status()
+    return response.content
+
+
+def download_url(bucket_name, file_path, token):
+    """Construye la URL de descarga pública de Firebase para un archivo con token."""
+    return (
+        f"https://firebasestorage.googleapis.com/v0/b/{bucket_name}/o/"
+        f"{quote(file_path, safe='')}?alt=media&token={token}"
+    )
+
+
+def upload_image(image_bytes, content_type, folder, extension="jpg"):
+    """
+    Sube una imagen a Firebase Storage con un nombre único dentro de `folder`
+    y devuelve su URL de descarga, con el mismo formato que genera la app
+    con getDownloadURL().
+    """
+    bucket = _bucket()
+    file_path = f"{folder}/{uuid.uuid4()}.{extension}"
+    token = str(uuid.uuid4())
+
+    blob = bucket.blob(file_path)
+    blob.metadata = {"firebaseStorageDownloadTokens": token}
+    storage_breaker.call(
+        blob.upload_from_string, image_bytes, content_type=content_type, timeout=Config.STORAGE_TIMEOUT
+    )
+    return download_url(bucket.name, file_path, token)
+
+
+def delete_image(image_url):
+    """
+    Borra una imagen de Firebase Storage a partir de su URL.
+    Devuelve True si se borró y False si no existía.
+    """
+    file_path = storage_path_from_url(image_url)
+    if not file_path:
+        log.warning("La URL %s no pertenece a Firebase Storage.", image_url)
+        return False
+
+    from google.api_core.exceptions import NotFound
+    blob = _bucket().blob(file_path)
+
+    def _delete():
+        # Un solo viaje de red: borramos directamente en lugar de preguntar
+        # primero con blob.exists(). Un archivo inexistente no es un fallo
+        # del servicio, así que no cuenta para el circuito.
+        try:
+            blob.delete(timeout=Config.STORAGE_TIMEOUT)
+        except NotFound:
+            return False
+        return True
+
+    if storage_breaker.call(_delete):
+        deletion_log.info("Imagen %s borrada de Firebase Storage.", file_path, extra={"ruta": file_path})
+        return True
+    deletion_log.info(
+        "Imagen %s no encontrada en Firebase, posiblemente ya fue borrada.", file_path, extra={"ruta": file_path}
+    )
+    return False
+
+
+def _queue_failed_deletions(failed):
+    """
+    Guarda en imagenes_por_borrar las imágenes que no se pudieron borrar
+    (circuito abierto, 5xx, timeouts) para que cleanup_script las reintente:
+    sus filas ya no existen y nadie más volvería a borrarlas.
+    """
+    import repository
+    try:
+        # Solo ocurre cuando Storage falla: no cuenta en el presupuesto de la ruta
+        with repository.count_queries(), repository.transaction() as cur:
+            repository.queue_image_deletions(cur, list(failed), [str(e)[:500] for e in failed.values()])
+        metrics.increment("storage.delete.queued", len(failed))
+    except Exception as e:
+        log.error("No se pudieron encolar %s borrados fallidos: %s (%s)", len(failed), e, ", ".join(failed))
+
+
+def _delete_in_sequence(image_urls):
+    """Borra una tras otra; devuelve (borradas, {url: error} de las que fallaron)."""
+    deleted = 0
+    failed = {}
+    for image_url in image_urls:
+        try:
+            if delete_image(image_url):
+                deleted += 1
+        except Exception as e:
+            log.warning("No se pudo borrar la imagen %s de Firebase Storage: %s", image_url, e)
+            failed[image_url] = e
+    return deleted, failed
+
+
+def delete_images(image_urls):
+    """
+    Borra un conjunto de imágenes de Firebase Storage, repartidas entre como
+    mucho IO_FANOUT hilos del pool para no acaparar el de las demás
+    peticiones. Los errores de cada imagen se registran sin interrumpir el
+    resto, y esas imágenes se encolan para reintentar el borrado más tarde.
+    Devuelve el número de imágenes efectivamente borradas.
+    """
+    urls = [url for url in dict.fromkeys(image_urls) if url]
+    if not urls:
+        return 0
+
+    fanout = min(Config.IO_FANOUT, len(urls))
+    if fanout <= 1 or io_executor.owns_current_thread():
+        # En un hilo del pool, esperar a otras tareas del mismo pool podría
+        # bloquearlo: se borra en secuencia
+        deleted, failed = _delete_in_sequence(urls)
+    else:
+        deleted, failed = 0, {}
+        for future in [io_executor.submit(_delete_in_sequence, urls[i::fanout]) for i in range(fanout)]:
+            share_deleted, share_failed = future.result()
+            deleted += share_deleted
+            failed.update(share_failed)
+    if failed:
+        _queue_failed_deletions(failed)
+    return deleted
@@ -0,0 +1,252 @@
+# backend/structured_logging.py
+
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import uuid
+from datetime import datetime, timezone
+from functools import wraps
+from config import Config
+import metrics
+
+# Registro en JSON (una línea por mensaje) sin escribir desde el hilo de la
+# petición: los handlers encolan el mensaje y un hilo por proceso lo formatea
+# y lo escribe. Cada mensaje lleva el identificador de la petición en curso.
+REQUEST_ID_HEADER = "X-Request-ID"
+_VALID_REQUEST_ID = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+_request_id = contextvars.ContextVar("request_id", default=None)
+
+# Atributos propios de LogRecord: el resto son los campos pasados con extra=
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "request_id", "taskName"}
+
+_handler = None
+_setup_lock = threading.Lock()
+
+
+def current_request_id():
+    return _request_id.get()
+
+
+def set_request_id(request_id=None):
+    """Fija el identificador de la petición en curso (uno nuevo si no se da) y lo devuelve."""
+    request_id = request_id or uuid.uuid4().hex
+    _request_id.set(request_id)
+    return request_id
+
+
+def with_request_id(fn):
+    """Envuelve `fn` para que, al ejecutarse en otro hilo, registre con el identificador de la petición actual."""
+    request_id = _request_id.get()
+    if request_id is None:
+        return fn
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        token = _request_id.set(request_id)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _request_id.reset(token)
+    return wrapper
+
+
+def parse_sample_rates(value):
+    """'storage_utils.borrado=0.1,otro=0.5' -> {'storage_utils.borrado': 0.1, 'otro': 0.5}"""
+    rates = {}
+    for item in value.split(","):
+        name, _, rate = item.partition("=")
+        if name.strip() and rate.strip():
+            rates[name.strip()] = min(max(float(rate), 0.0), 1.0)
+    return rates
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Deja pasar solo una fracción de los mensajes INFO y DEBUG de los loggers
+    configurados (o de sus hijos). Los avisos y errores pasan siempre. Los
+    mensajes que pasan llevan el campo `muestreo` con la fracción, para que
+    quien los cuente pueda escalarlos.
+    """
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def _rate(self, name):
+        while name:
+            if name in self.rates:
+                return self.rates[name]
+            name = name.rpartition(".")[0]
+        return None
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate(record.name)
+        if rate is None:
+            return True
+        if random.random() >= rate:
+            metrics.increment("log.descartados.muestreo")
+            return False
+        record.muestreo = rate
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por mensaje con los campos fijos y los pasados con extra=."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "nivel": record.levelname,
+            "logger": record.name,
+            "mensaje": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+            "pid": record.process,
+            "hilo": record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["excepcion"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Formato legible para desarrollo local."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s")
+
+
+class AsyncHandler(logging.handlers.QueueHandler):
+    """
+    Encola los mensajes en una cola acotada que vacía un QueueListener. El
+    hilo que registra solo resuelve el mensaje y la excepción; el JSON y la
+    escritura ocurren en el hilo del listener. Si la cola está llena, los
+    INFO se descartan (contados en métricas) y los avisos y errores esperan
+    como mucho `block_timeout` segundos.
+
+    El listener se arranca en cada proceso la primera vez que se registra
+    algo, así que sobrevive al fork de los workers de gunicorn.
+    """
+
+    def __init__(self, target, maxsize, block_timeout=0.1):
+        super().__init__(queue.Queue(maxsize))
+        self.target = target
+        self.maxsize = maxsize
+        self.block_timeout = block_timeout
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_listener(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            # Tras un fork la cola heredada y el hilo del listener no sirven
+            self.queue = queue.Queue(self.maxsize)
+            self._listener = logging.handlers.QueueListener(self.queue, self.target, respect_handler_level=True)
+            self._listener.start()
+            self._pid = os.getpid()
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            # El traceback se formatea aquí: sus frames pueden cambiar después
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.request_id = _request_id.get()
+        return record
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if record.levelno >= logging.WARNING:
+                try:
+                    self.queue.put(record, timeout=self.block_timeout)
+                    return
+                except queue.Full:
+                    pass
+            metrics.increment("log.descartados.cola")
+
+    def close(self):
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+            self._listener = None
+            self._pid = None
+        super().close()
+
+
+def setup_logging(stream=None):
+    """
+    Configura el logger raíz con el handler asíncrono según Config. Se puede
+    llamar varias veces: solo la primera tiene efecto. Devuelve el handler.
+    """
+    global _handler
+    with _setup_lock:
+        if _handler is not None:
+            return _handler
+        target = logging.StreamHandler(stream or sys.stdout)
+        target.setFormatter(JsonFormatter() if Config.LOG_FORMAT == "json" else TextFormatter())
+        handler = AsyncHandler(target, Config.LOG_QUEUE_SIZE)
+        sample_rates = parse_sample_rates(Config.LOG_SAMPLE_RATES)
+        if sample_rates:
+            handler.addFilter(SamplingFilter(sample_rates))
+        root = logging.getLogger()
+        root.handlers = [handler]
+        root.setLevel(Config.LOG_LEVEL.upper())
+        _handler = handler
+    # Lo que quede en la cola se escribe al terminar el proceso
+    atexit.register(shutdown_logging)
+    return handler
+
+
+def shutdown_logging():
+    """Escribe lo que quede en la cola y detiene el listener."""
+    global _handler
+    with _setup_lock:
+        if _handler is not None:
+            logging.getLogger().removeHandler(_handler)
+            _handler.close()
+            _handler = None
+
+
+def init_app(app):
+    """Asigna un identificador a cada petición (o respeta el del balanceador) y lo devuelve en la respuesta."""
+    from flask import request
+
+    @app.before_request
+    def _assign_request_id():
+        incoming = request.headers.get(REQUEST_ID_HEADER, "")
+        set_request_id(incoming if _VALID_REQUEST_ID.match(incoming) else None)
+
+    @app.after_request
+    def _return_request_id(response):
+        request_id = _request_id.get()
+        if request_id:
+            response.headers[REQUEST_ID_HEADER] = request_id
+        return response
+
+    @app.teardown_request
+    def _clear_request_id(exc):
+        _request_id.set(None)
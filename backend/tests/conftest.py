@@ -0,0 +1,8 @@
+# backend/tests/conftest.py
+
+import os
+import sys
+
+# Los módulos del backend se importan como en producción (import repository),
+# sin paquete: las pruebas se lanzan con `python -m pytest` desde backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
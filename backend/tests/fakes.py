@@ -0,0 +1,102 @@
+# backend/tests/fakes.py
+
+import psycopg2
+import psycopg2.extensions
+from db_routing import PooledConnection
+import metrics
+import repository
+
+
+def counter(name):
+    return metrics.snapshot()["counters"].get(name, 0)
+
+
+class FakeCursor:
+    """
+    Cursor que anota las consultas de su conexión y devuelve las filas de
+    `conn.rows` (por la primera palabra de la consulta). Como los de
+    TrackedConnection, cuenta en la petición en curso salvo si es interno.
+    """
+
+    def __init__(self, conn, tracked=True):
+        self.connection = conn
+        self.tracked = tracked
+        self.description = None
+
+    def execute(self, query, params=None):
+        if self.connection.broken:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+        self.connection.executed.append((query, params))
+        if self.tracked:
+            repository._record(self.connection.target, 0.0)
+        rows = self.connection.rows.get(query.split()[0].upper(), [])
+        self._rows = list(rows)
+        self.description = [("columna",)] if rows else None
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def close(self):
+        pass
+
+
+class _FakeLibpq:
+    """Lo que PooledConnection espera de la conexión de psycopg2."""
+
+    def close(self):
+        self.closed = 1
+
+
+class _Info:
+    transaction_status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+
+class FakeConnection(PooledConnection, _FakeLibpq):
+    """
+    Conexión sin servidor para ConnectionPool: se pasa como
+    connection_factory y psycopg2.connect() la crea con la DSN.
+    `broken = True` simula que el servidor la cerró.
+    """
+
+    def __init__(self, dsn, *args, **kwargs):
+        self.dsn = dsn
+        self.closed = 0
+        self.autocommit = False
+        self.broken = False
+        self.timeout_ms = None
+        self.prepared = set()
+        self.executed = []
+        self.rows = {}
+        self.info = _Info()
+
+    def cursor(self, *args, **kwargs):
+        return FakeCursor(self)
+
+    def internal_cursor(self):
+        return FakeCursor(self, tracked=False)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+class FakeClock:
+    """Sustituye al módulo time de un módulo (monkeypatch) con un reloj que solo avanza a mano."""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def monotonic(self):
+        return self.now
+
+    def perf_counter(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
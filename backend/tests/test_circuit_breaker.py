@@ -0,0 +1,119 @@
+# backend/tests/test_circuit_breaker.py
+
+import pytest
+import circuit_breaker
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from fakes import FakeClock
+
+
+class _NotFound(Exception):
+    pass
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(circuit_breaker, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def breaker(clock):
+    return CircuitBreaker(
+        "prueba", window_seconds=30, min_calls=4, failure_ratio=0.5, slow_call_seconds=2,
+        slow_call_ratio=0.5, open_seconds=10, ignored_exceptions=(_NotFound,),
+    )
+
+
+def _ok():
+    return "ok"
+
+
+def _fail():
+    raise RuntimeError("503")
+
+
+def _calls(breaker, fn, times):
+    for _ in range(times):
+        try:
+            breaker.call(fn)
+        except (RuntimeError, _NotFound):
+            pass
+
+
+def test_opens_when_the_failure_ratio_is_reached(breaker):
+    _calls(breaker, _ok, 2)
+    _calls(breaker, _fail, 1)
+    assert breaker.state == CircuitBreaker.CLOSED
+    _calls(breaker, _fail, 1)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.is_open()
+
+
+def test_needs_min_calls_before_opening(breaker):
+    _calls(breaker, _fail, 3)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_open_circuit_rejects_calls_without_running_them(breaker, clock):
+    _calls(breaker, _fail, 4)
+    clock.advance(4)
+    ran = []
+    with pytest.raises(CircuitOpenError) as error:
+        breaker.call(lambda: ran.append(True))
+    assert ran == []
+    assert error.value.retry_after == pytest.approx(6)
+    assert breaker.retry_after() == pytest.approx(6)
+
+
+def test_old_calls_leave_the_window(breaker, clock):
+    _calls(breaker, _fail, 3)
+    clock.advance(31)
+    _calls(breaker, _ok, 3)
+    _calls(breaker, _fail, 1)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_slow_calls_open_the_circuit(breaker, clock):
+    def slow():
+        clock.advance(2)
+        return "ok"
+
+    _calls(breaker, _ok, 2)
+    _calls(breaker, slow, 2)
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_ignored_exceptions_do_not_count_as_failures(breaker):
+    def not_found():
+        raise _NotFound()
+
+    _calls(breaker, not_found, 10)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_half_open_lets_one_probe_through_and_closes_on_success(breaker, clock):
+    _calls(breaker, _fail, 4)
+    clock.advance(10)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+    def probe():
+        # Mientras la prueba está en curso, el resto se rechaza
+        with pytest.raises(CircuitOpenError):
+            breaker.call(_ok)
+        assert breaker.is_open()
+        return "ok"
+
+    assert breaker.call(probe) == "ok"
+    assert breaker.state == CircuitBreaker.CLOSED
+    # La ventana empieza de cero: los fallos de antes no cuentan
+    _calls(breaker, _fail, 1)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_failed_probe_opens_the_circuit_again(breaker, clock):
+    _calls(breaker, _fail, 4)
+    clock.advance(10)
+    _calls(breaker, _fail, 1)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.retry_after() == pytest.approx(10)
@@ -0,0 +1,83 @@
+# backend/tests/test_connection_pool.py
+
+import psycopg2.pool
+import pytest
+from db_routing import ConnectionPool
+from fakes import FakeConnection, counter
+
+
+def _pool(size=2, ping_seconds=None):
+    return ConnectionPool("prueba", "dbname=falsa", size, 0.05, FakeConnection, ping_seconds)
+
+
+def test_close_returns_the_connection_for_reuse():
+    pool = _pool()
+    conn = pool.get()
+    assert conn.pool is pool and conn.target == "prueba" and conn.lease == 1
+    conn.close()
+    assert conn.opened_at is None and not conn.closed
+
+    again = pool.get()
+    assert again is conn
+    assert again.lease == 2
+
+
+def test_closing_twice_returns_the_connection_once():
+    pool = _pool(size=1)
+    conn = pool.get()
+    conn.close()
+    conn.close()
+    assert pool.get() is conn
+    with pytest.raises(psycopg2.pool.PoolError):
+        pool.get()
+
+
+def test_get_waits_and_fails_when_every_connection_is_lent():
+    pool = _pool(size=1)
+    pool.get()
+    before = counter("db.pool.prueba.agotado")
+    with pytest.raises(psycopg2.pool.PoolError):
+        pool.get()
+    assert counter("db.pool.prueba.agotado") == before + 1
+
+
+def test_discarded_connection_is_closed_instead_of_reused():
+    pool = _pool()
+    conn = pool.get()
+    conn.discard = True
+    conn.close()
+    assert conn.closed and conn.pool is None
+    assert pool.get() is not conn
+
+
+def test_recently_used_connection_is_lent_without_ping():
+    pool = _pool(ping_seconds=60)
+    conn = pool.get()
+    conn.close()
+    assert pool.get() is conn
+    assert conn.executed == []
+
+
+def test_idle_connection_is_pinged_and_kept_if_alive():
+    pool = _pool(ping_seconds=0)
+    conn = pool.get()
+    conn.close()
+    assert pool.get() is conn
+    assert conn.executed == [("SELECT 1", None)]
+    assert not conn.autocommit
+
+
+def test_idle_connection_closed_by_the_server_is_replaced():
+    pool = _pool(size=1, ping_seconds=0)
+    conn = pool.get()
+    conn.close()
+    conn.broken = True
+    before = counter("db.pool.prueba.descartada")
+
+    replacement = pool.get()
+    assert replacement is not conn
+    assert conn.closed and conn.pool is None
+    assert counter("db.pool.prueba.descartada") == before + 1
+    # El hueco del pool sigue ocupado por la nueva, no se ha liberado dos veces
+    with pytest.raises(psycopg2.pool.PoolError):
+        pool.get()
@@ -0,0 +1,172 @@
+# backend/tests/test_db_routing.py
+
+import psycopg2
+import pytest
+import db_routing
+from db_routing import PRIMARY, MemoryWriteMarks, PostgresWriteMarks, ReplicaRouter, lsn_to_int
+from fakes import FakeClock, FakeConnection, counter
+
+PRIMARY_DSN = "dbname=primario"
+REPLICA_DSN = "dbname=replica"
+
+
+class _Servers:
+    """
+    Estado de los servidores falsos: posición de WAL del primario y
+    posición aplicada y retraso de la réplica (None si no responde).
+    """
+
+    def __init__(self):
+        self.primary_lsn = "0/200"
+        self.replica = ("0/200", 0.0)
+
+
+@pytest.fixture
+def servers():
+    return _Servers()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(db_routing, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def make_router(servers, clock):
+    class ServerConnection(FakeConnection):
+        def __init__(self, dsn, *args, **kwargs):
+            if dsn.startswith(REPLICA_DSN) and servers.replica is None:
+                raise psycopg2.OperationalError("could not connect to server")
+            super().__init__(dsn, *args, **kwargs)
+
+        def internal_cursor(self):
+            # Lo que respondería cada servidor a la consulta de su estado o de la posición de WAL
+            self.rows = {"SELECT": [servers.replica if self.dsn.startswith(REPLICA_DSN) else (servers.primary_lsn,)]}
+            return super().internal_cursor()
+
+    def make_router(max_lag_seconds=5, status_seconds=60, window_seconds=30):
+        return ReplicaRouter(
+            PRIMARY_DSN, [REPLICA_DSN], max_lag_seconds=max_lag_seconds, status_seconds=status_seconds,
+            connect_timeout=1, read_your_writes_seconds=window_seconds, pool_size=4, pool_timeout=0.05,
+            connection_factory=ServerConnection,
+        )
+
+    return make_router
+
+
+def _read_target(router, user_id=None):
+    conn = router.read_connection(user_id)
+    conn.close()
+    return conn.target
+
+
+def _write(router, user_id):
+    conn = router.primary_connection()
+    router.record_write(conn, user_id)
+    conn.close()
+
+
+def test_lsn_to_int_orders_wal_positions():
+    assert lsn_to_int(None) is None
+    assert lsn_to_int("0/16B3748") == 0x16B3748
+    assert lsn_to_int("0/FFFFFFFF") < lsn_to_int("1/0") < lsn_to_int("1/10")
+
+
+def test_memory_marks_expire_after_the_window(clock):
+    marks = MemoryWriteMarks(window_seconds=30)
+    conn = FakeConnection(PRIMARY_DSN)
+    conn.rows = {"SELECT": [("0/300",)]}
+    assert marks.mark(conn, 7) == 0x300
+    assert marks.required_lsn(7) == 0x300
+    assert marks.required_lsn(8) is None
+
+    clock.advance(30)
+    assert marks.required_lsn(7) is None
+
+
+def test_memory_marks_prune_expired_users(clock):
+    marks = MemoryWriteMarks(window_seconds=30)
+    conn = FakeConnection(PRIMARY_DSN)
+    conn.rows = {"SELECT": [("0/1",)]}
+    for user_id in range(1000):
+        marks.mark(conn, user_id)
+    clock.advance(31)
+    marks.mark(conn, "nuevo")
+    assert list(marks._marks) == ["nuevo"]
+
+
+def test_postgres_marks_read_the_shared_table():
+    conn = FakeConnection(PRIMARY_DSN)
+    conn.rows = {"SELECT": [("1/0",)]}
+    marks = PostgresWriteMarks(lambda: conn, window_seconds=30)
+    assert marks.required_lsn(7) == 1 << 32
+    query, params = conn.executed[-1]
+    assert "escrituras_recientes" in query and params == (7, 30)
+
+
+def test_reads_go_to_an_up_to_date_replica(make_router):
+    assert _read_target(make_router()) == "replica1"
+
+
+def test_lagging_replica_falls_back_to_primary(make_router, servers):
+    servers.replica = ("0/200", 12.0)
+    before = counter("db.route.descartada.retraso")
+    router = make_router(max_lag_seconds=5)
+    assert _read_target(router) == PRIMARY
+    assert counter("db.route.descartada.retraso") == before + 1
+    assert router.status()["replica1"]["disponible"] is False
+
+
+def test_unreachable_replica_falls_back_to_primary(make_router, servers):
+    servers.replica = None
+    router = make_router()
+    assert _read_target(router) == PRIMARY
+    assert router.status()["replica1"]["disponible"] is False
+
+
+def test_replica_status_is_cached_for_status_seconds(make_router, servers, clock):
+    router = make_router(max_lag_seconds=5, status_seconds=10)
+    assert _read_target(router) == "replica1"
+    servers.replica = ("0/200", 60.0)
+    assert _read_target(router) == "replica1"
+
+    clock.advance(10)
+    assert _read_target(router) == PRIMARY
+
+
+def test_user_reads_own_write_from_primary_until_replica_applies_it(make_router, servers):
+    router = make_router()
+    servers.replica = ("0/100", 0.0)
+    servers.primary_lsn = "0/200"
+    _write(router, 7)
+
+    assert _read_target(router, 7) == PRIMARY
+    # Otro usuario no necesita esa escritura
+    assert _read_target(router, 8) == "replica1"
+
+    # La réplica está al día en cuanto ha aplicado la posición marcada,
+    # aunque su estado guardado sea anterior
+    servers.replica = ("0/200", 0.0)
+    assert _read_target(router, 7) == "replica1"
+
+
+def test_write_marks_expire_after_the_window(make_router, servers, clock):
+    router = make_router(window_seconds=30)
+    servers.replica = ("0/100", 0.0)
+    _write(router, 7)
+    assert _read_target(router, 7) == PRIMARY
+
+    clock.advance(30)
+    assert _read_target(router, 7) == "replica1"
+
+
+def test_writes_are_not_marked_without_replicas(clock):
+    router = ReplicaRouter(PRIMARY_DSN, [], max_lag_seconds=5, status_seconds=60, connect_timeout=1,
+                           pool_size=2, pool_timeout=0.05, connection_factory=FakeConnection)
+    conn = router.primary_connection()
+    router.record_write(conn, 7)
+    assert conn.executed == []
+    conn.close()
+    assert router.read_connection(7) is conn
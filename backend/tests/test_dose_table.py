@@ -0,0 +1,97 @@
+# backend/tests/test_dose_table.py
+
+from dose_table import DoseTable, calculate_plan
+
+_COLUMNS = ("id_tratamiento", "id_enfermedad", "nombre_comercial", "dosis_por_planta_ml",
+            "agua_por_planta_ml", "nombre_enfermedad")
+
+
+class _Database:
+    """versiones_cache y tratamientos en memoria; cuenta conexiones y consultas."""
+
+    def __init__(self):
+        self.version = 1
+        self.rows = [(1, 10, "Cobre", 2.0, 500.0, "Roya")]
+        self.connections = 0
+        self.queries = []
+
+    def connect(self):
+        self.connections += 1
+        return _Connection(self)
+
+
+class _Connection:
+    def __init__(self, database):
+        self.database = database
+
+    def cursor(self):
+        return _Cursor(self.database)
+
+    def close(self):
+        pass
+
+
+class _Cursor:
+    def __init__(self, database):
+        self.database = database
+        self.description = None
+
+    def execute(self, query):
+        self.database.queries.append(query)
+        if "versiones_cache" in query:
+            self._rows = [(self.database.version,)]
+        else:
+            self.description = [(column,) for column in _COLUMNS]
+            self._rows = list(self.database.rows)
+
+    def fetchone(self):
+        return self._rows[0]
+
+    def fetchall(self):
+        return self._rows
+
+    def close(self):
+        pass
+
+
+def test_snapshot_is_served_without_a_connection_between_checks():
+    database = _Database()
+    table = DoseTable(database.connect, check_seconds=60)
+    first = table.get()
+    assert database.connections == 1 and len(database.queries) == 2
+
+    for _ in range(5):
+        assert table.get() is first
+    assert database.connections == 1
+
+
+def test_unchanged_version_keeps_the_snapshot():
+    database = _Database()
+    table = DoseTable(database.connect, check_seconds=0)
+    first = table.get()
+    assert table.get() is first
+    assert database.connections == 2
+    # La segunda vez solo se lee la versión
+    assert len(database.queries) == 3
+
+
+def test_new_version_reloads_after_the_check_interval():
+    database = _Database()
+    table = DoseTable(database.connect, check_seconds=60)
+    table.get()
+    database.version = 2
+    database.rows = [(1, 10, "Cobre", 3.0, 500.0, "Roya")]
+    assert table.get().rows[1]["dosis_por_planta_ml"] == 2.0
+
+    table.check_seconds = 0
+    snapshot = table.get()
+    assert snapshot.version == 2
+    assert snapshot.rows[1]["dosis_por_planta_ml"] == 3.0
+
+
+def test_calculate_plan_reports_unknown_treatments():
+    database = _Database()
+    results, summary = calculate_plan(DoseTable(database.connect).get(), [1, 99], [100, 100])
+    assert results[0]["total_producto_ml"] == 200.0
+    assert results[1]["estado"] == "no_encontrado"
+    assert len(summary) == 1
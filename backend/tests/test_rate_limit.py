@@ -0,0 +1,130 @@
+# backend/tests/test_rate_limit.py
+
+import pytest
+from flask import Flask
+import rate_limit
+from rate_limit import (
+    InflightLimiter, MemoryTokenBucket, PostgresInflightLimiter, PostgresTokenBucket, admission_controlled,
+)
+from fakes import FakeClock, FakeConnection, counter
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limit, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def app_context():
+    with Flask(__name__).app_context():
+        yield
+
+
+def _connection(rows=None, broken=False):
+    def connect():
+        conn = FakeConnection("dbname=falsa")
+        conn.rows = rows or {}
+        conn.broken = broken
+        connect.opened.append(conn)
+        return conn
+    connect.opened = []
+    return connect
+
+
+def test_memory_bucket_allows_a_burst_then_refills(clock):
+    bucket = MemoryTokenBucket()
+    assert [bucket.take("analyze:1", 3, 0.5)[0] for _ in range(3)] == [True, True, True]
+    allowed, retry_after = bucket.take("analyze:1", 3, 0.5)
+    assert not allowed
+    assert retry_after == pytest.approx(2)
+    # Cada usuario tiene su propio bucket
+    assert bucket.take("analyze:2", 3, 0.5)[0]
+
+    clock.advance(2)
+    assert bucket.take("analyze:1", 3, 0.5) == (True, 0)
+    assert not bucket.take("analyze:1", 3, 0.5)[0]
+
+
+def test_memory_bucket_prunes_full_buckets(clock, monkeypatch):
+    monkeypatch.setattr(MemoryTokenBucket, "MAX_KEYS", 10)
+    bucket = MemoryTokenBucket()
+    for user_id in range(10):
+        bucket.take(f"analyze:{user_id}", 3, 1)
+    clock.advance(5)
+    bucket.take("analyze:nuevo", 3, 1)
+    assert list(bucket._buckets) == ["analyze:nuevo"]
+
+
+def test_postgres_bucket_returns_the_database_decision():
+    connect = _connection({"INSERT": [(False, 0.25)]})
+    assert PostgresTokenBucket(connect).take("analyze:1", 3, 0.5) == (False, pytest.approx(1.5))
+    assert connect.opened[0].closed
+
+
+def test_postgres_bucket_fails_open_when_the_database_fails():
+    before = counter("rate_limit.errors")
+    connect = _connection(broken=True)
+    assert PostgresTokenBucket(connect).take("analyze:1", 3, 0.5) == (True, 0)
+    assert counter("rate_limit.errors") == before + 1
+    assert connect.opened[0].closed
+
+
+def test_inflight_limiter_caps_and_releases():
+    limiter = InflightLimiter(2)
+    slots = [limiter.try_acquire(), limiter.try_acquire()]
+    assert all(slots) and limiter.inflight == 2
+    assert limiter.try_acquire() is None
+    limiter.release(slots[0])
+    assert limiter.inflight == 1
+    assert limiter.try_acquire()
+
+
+def test_global_limiter_takes_a_database_slot_after_the_local_one():
+    connect = _connection({"UPDATE": [(3,)]})
+    limiter = PostgresInflightLimiter(connect, 8, 60, InflightLimiter(2))
+    slot = limiter.try_acquire()
+    assert slot[0] == 3 and limiter.inflight == 1
+    # Los huecos se crean una vez, por el cursor interno (sin contar en la ruta)
+    assert "INSERT INTO inferencias_en_curso" in connect.opened[0].executed[0][0]
+
+    limiter.release(slot)
+    assert limiter.inflight == 0
+    query, params = connect.opened[-1].executed[-1]
+    assert query.strip().startswith("UPDATE") and params == {"hueco": 3, "token": slot[1]}
+    assert not any("INSERT" in query for query, _ in connect.opened[-1].executed)
+
+
+def test_global_limiter_sheds_when_every_database_slot_is_taken():
+    limiter = PostgresInflightLimiter(_connection(), 8, 60, InflightLimiter(2))
+    assert limiter.try_acquire() is None
+    assert limiter.inflight == 0
+
+
+def test_global_limiter_falls_back_to_the_local_cap_when_the_database_fails():
+    before = counter("inference.global.errors")
+    limiter = PostgresInflightLimiter(_connection(broken=True), 8, 60, InflightLimiter(1))
+    slot = limiter.try_acquire()
+    assert slot == (None, None)
+    assert counter("inference.global.errors") == before + 1
+    assert limiter.try_acquire() is None
+    limiter.release(slot)
+    assert limiter.inflight == 0
+
+
+def test_admission_controlled_answers_429_when_full(app_context):
+    limiter = InflightLimiter(1)
+
+    @admission_controlled(limiter, retry_after=2.5)
+    def route():
+        return "ok"
+
+    slot = limiter.try_acquire()
+    rejected = route()
+    assert rejected.status_code == 429
+    assert rejected.headers["Retry-After"] == "3"
+
+    limiter.release(slot)
+    assert route() == "ok"
+    assert limiter.inflight == 0
@@ -0,0 +1,137 @@
+# backend/tests/test_repository.py
+
+import threading
+import pytest
+from config import Config
+from db_routing import ReplicaRouter
+import repository
+from repository import QueryBudgetExceeded, db_route, transaction
+from fakes import FakeConnection, counter
+
+
+@pytest.fixture
+def router(monkeypatch):
+    router = ReplicaRouter(
+        "dbname=falsa", [], max_lag_seconds=1, status_seconds=1, connect_timeout=1,
+        pool_size=2, pool_timeout=0.05, connection_factory=FakeConnection,
+    )
+    monkeypatch.setattr(repository, "router", router)
+    return router
+
+
+def test_finish_closes_connections_the_route_did_not_return(router):
+    @db_route("lectura", 1)
+    def route():
+        route.conn = repository.connect()
+        route.conn.cursor().execute("SELECT 1")
+
+    before = counter("db.pool.no_devuelta")
+    route()
+    assert counter("db.pool.no_devuelta") == before + 1
+    assert route.conn.opened_at is None
+    assert router._connect_primary() is route.conn
+
+
+def test_finish_leaves_alone_a_connection_lent_again_to_another_thread(router):
+    # Como /history/save: la ruta devuelve su conexión y, antes de que
+    # termine, una tarea de io_executor pide otra al pool y le toca la misma
+    borrowed = threading.Event()
+    release = threading.Event()
+    task = {}
+
+    def io_task():
+        task["conn"] = repository.connect()
+        borrowed.set()
+        release.wait(5)
+        task["conn"].cursor().execute("UPDATE analisis SET duplicado_de = 1")
+        task["conn"].close()
+
+    @db_route("escritura", 1)
+    def route():
+        with transaction() as cur:
+            cur.execute("INSERT INTO analisis DEFAULT VALUES")
+            route.conn = cur.connection
+        task["thread"] = threading.Thread(target=io_task)
+        task["thread"].start()
+        borrowed.wait(5)
+
+    before = counter("db.pool.no_devuelta")
+    route()
+    assert task["conn"] is route.conn
+    assert counter("db.pool.no_devuelta") == before
+    assert task["conn"].opened_at is not None
+
+    release.set()
+    task["thread"].join(5)
+    assert task["conn"].executed[-1][0].startswith("UPDATE")
+    assert task["conn"].opened_at is None
+
+
+def test_routes_within_budget_pass(router, monkeypatch):
+    monkeypatch.setattr(Config, "QUERY_BUDGET_STRICT", True)
+
+    @db_route("lectura", 2)
+    def route():
+        with transaction() as cur:
+            cur.execute("SELECT 1")
+            cur.execute("SELECT 2")
+        return "ok"
+
+    before = counter("db.queries.route")
+    assert route() == "ok"
+    assert counter("db.queries.route") == before + 2
+
+
+def test_routes_over_budget_fail_in_strict_mode(router, monkeypatch):
+    monkeypatch.setattr(Config, "QUERY_BUDGET_STRICT", True)
+
+    @db_route("lectura", 1)
+    def route():
+        with transaction() as cur:
+            cur.execute("SELECT 1")
+            cur.execute("SELECT 2")
+
+    with pytest.raises(QueryBudgetExceeded):
+        route()
+
+
+def test_routes_over_budget_only_warn_outside_strict_mode(router, monkeypatch):
+    monkeypatch.setattr(Config, "QUERY_BUDGET_STRICT", False)
+
+    @db_route("lectura", 1)
+    def over_budget():
+        with transaction() as cur:
+            cur.execute("SELECT 1")
+            cur.execute("SELECT 2")
+        return "ok"
+
+    before = counter("db.budget_exceeded.over_budget")
+    assert over_budget() == "ok"
+    assert counter("db.budget_exceeded.over_budget") == before + 1
+
+
+def test_internal_queries_do_not_count(router, monkeypatch):
+    monkeypatch.setattr(Config, "QUERY_BUDGET_STRICT", True)
+
+    @db_route("lectura", 0)
+    def no_queries():
+        # El SET statement_timeout de la clase va por el cursor interno
+        with transaction() as cur:
+            no_queries.conn = cur.connection
+
+    no_queries()
+    assert any(query.startswith("SET statement_timeout") for query, _ in no_queries.conn.executed)
+
+
+@pytest.mark.parametrize("urls", [0, 1, 50])
+def test_deleting_a_user_is_one_query_whatever_their_analyses(urls):
+    conn = FakeConnection("dbname=falsa")
+    conn.rows = {"EXECUTE": [(False, True, [f"https://example.org/{i}.jpg" for i in range(urls)])]}
+    for _ in range(2):
+        with repository.count_queries() as stats:
+            row = repository.delete_user_with_data(conn.cursor(), 7, allow_admin=False)
+        assert stats.count == 1
+        assert row[1] is True and len(row[2]) == urls
+    # Se prepara una vez por conexión, fuera del presupuesto
+    assert sum(query.startswith("PREPARE") for query, _ in conn.executed) == 1
+    assert conn.executed[-1] == ("EXECUTE usuario_borrar_con_datos (%s, %s)", [7, False])
@@ -0,0 +1,59 @@
+# backend/tests/test_storage_utils.py
+
+import threading
+import pytest
+import storage_utils
+from storage_utils import _RequestExecutor
+
+
+@pytest.fixture
+def single_thread_pool(monkeypatch):
+    pool = _RequestExecutor(max_workers=1, thread_name_prefix="prueba")
+    monkeypatch.setattr(storage_utils, "io_executor", pool)
+    monkeypatch.setattr(storage_utils, "delete_image", lambda url: True)
+    yield pool
+    pool.shutdown()
+
+
+def test_pool_threads_are_recognised_by_their_own_executor_only():
+    pool = _RequestExecutor(max_workers=1, thread_name_prefix="io")
+    other = _RequestExecutor(max_workers=1, thread_name_prefix="io")
+    assert pool.submit(pool.owns_current_thread).result(5)
+    assert not other.submit(pool.owns_current_thread).result(5)
+    assert not pool.owns_current_thread()
+
+    # El nombre del hilo no cuenta
+    result = []
+    thread = threading.Thread(target=lambda: result.append(pool.owns_current_thread()), name="io_falso")
+    thread.start()
+    thread.join(5)
+    assert result == [False]
+    pool.shutdown()
+    other.shutdown()
+
+
+def test_delete_images_inside_the_pool_does_not_wait_for_the_pool(single_thread_pool):
+    urls = [f"https://example.org/{i}.jpg" for i in range(3)]
+    # Con un solo hilo, repartir los borrados en el pool desde una de sus
+    # tareas se quedaría esperando para siempre
+    assert single_thread_pool.submit(storage_utils.delete_images, urls).result(5) == 3
+
+
+def test_delete_images_from_a_request_thread_uses_the_pool(single_thread_pool):
+    assert storage_utils.delete_images(["https://example.org/a.jpg", "https://example.org/b.jpg", None]) == 2
+
+
+def test_delete_images_uses_at_most_io_fanout_pool_threads(monkeypatch):
+    pool = _RequestExecutor(max_workers=8, thread_name_prefix="prueba")
+    threads = set()
+
+    def delete_image(url):
+        threads.add(threading.current_thread().name)
+        return True
+
+    monkeypatch.setattr(storage_utils, "io_executor", pool)
+    monkeypatch.setattr(storage_utils, "delete_image", delete_image)
+    monkeypatch.setattr(storage_utils.Config, "IO_FANOUT", 2)
+    assert storage_utils.delete_images([f"https://example.org/{i}.jpg" for i in range(10)]) == 10
+    assert 1 <= len(threads) <= 2
+    pool.shutdown()
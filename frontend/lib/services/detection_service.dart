@@ -479,6 +479,22 @@ Future<List<dynamic>> getUsersWithAnalyses() async {
     }
   }
 
+  // Totales del panel de administración calculados en el servidor, sin
+  // descargar los listados completos de análisis y usuarios.
+  Future<Map<String, dynamic>> getAdminSummary() async {
+    final token = await _authService.readToken();
+    final response = await http.get(
+      Uri.parse('$_baseUrl/admin/summary'),
+      headers: {'x-access-token': token ?? ''},
+    ).timeout(const Duration(seconds: 20));
+
+    if (response.statusCode == 200) {
+      return json.decode(response.body);
+    } else {
+      throw Exception('Error al cargar el resumen: ${response.reasonPhrase}');
+    }
+  }
+
 }
 
 